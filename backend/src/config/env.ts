@@ -15,6 +15,9 @@ const configSchema = z.object({
   RABBITMQ_URL: z.string(),
   MONGODB_URI: z.string(),
   MONGODB_DB_NAME: z.string().default('helmet_detection'),
+  // Shared with the AI service render server, which only serves URLs signed with it
+  RENDER_URL_SECRET: z.string().optional(),
+  RENDER_URL_EXPIRY_SECONDS: z.string().default('3600').transform(Number),
 });
 
 export const config = configSchema.parse(process.env);
@@ -2,7 +2,7 @@ import { appLogger, LogAllMethods } from '../../packages/logger';
 import { validateSchema } from '../../utils/validate-schema';
 import { helmetDetectionRabbitMQDAL } from './dal';
 import { helmetDetectionService } from './service';
-import { processingResultEventSchema } from './validations';
+import { processingResultEventSchema, videoProcessingResultEventSchema } from './validations';
 
 @LogAllMethods()
 class HelmetDetectionConsumers {
@@ -16,6 +16,12 @@ class HelmetDetectionConsumers {
   }
 
   private async handleProcessingResultMessage(data: any): Promise<void> {
+    if (data.data?.video_filename) {
+      const videoEvent = validateSchema(videoProcessingResultEventSchema, data.data);
+      await helmetDetectionService.handleVideoProcessingResult(videoEvent);
+      return;
+    }
+
     const validatedEvent = validateSchema(processingResultEventSchema, data.data);
     await helmetDetectionService.handleProcessingResult(validatedEvent);
   }
@@ -88,7 +88,8 @@ export class HelmetDetectionMongoDAL {
 
     const updateData: Partial<ImageRecord> = {
       processingStatus: result.processing_status,
-      annotatedFilename: result.annotated_filename,
+      annotatedFilename: result.annotated_filename ?? undefined,
+      annotationUrl: result.annotation_url ?? undefined,
       totalPeople: result.total_people,
       peopleWithHelmets: result.people_with_helmets,
       complianceRate: result.compliance_rate,
@@ -135,7 +136,9 @@ export class HelmetDetectionRabbitMQDAL {
     );
   }
 
-  public static async consumeProcessingResults(callback: (msg: Record<string, any>) => void) {
+  public static async consumeProcessingResults(
+    callback: (msg: Record<string, any>) => void | Promise<void>
+  ) {
     await RabbitMQUtils.consume(this.PROCESSING_RESULTS_QUEUE, callback);
   }
 
@@ -1,5 +1,7 @@
 import { v4 as uuidv4 } from 'uuid';
 import path from 'path';
+import crypto from 'crypto';
+import { config } from '../../config/env';
 import { MinioUtils } from '../../packages/minio';
 import { appLogger, LogAllMethods } from '../../packages/logger';
 import { helmetDetectionMongoDAL, helmetDetectionRabbitMQDAL } from './dal';
@@ -7,6 +9,7 @@ import {
   ImageRecord,
   ProcessingRequestEvent,
   ProcessingResultEvent,
+  VideoProcessingResultEvent,
   GetImagesResponse,
   GetImageByIdResponse,
   ImageStatsResponse,
@@ -99,6 +102,8 @@ class HelmetDetectionService {
 
       if (image.annotatedFilename) {
         annotatedImageUrl = `http://localhost:9000/helmet-detection/${image.annotatedFilename}`;
+      } else if (image.annotationUrl) {
+        annotatedImageUrl = this.signRenderUrl(image.annotationUrl);
       }
 
       return {
@@ -122,6 +127,17 @@ class HelmetDetectionService {
     }
   }
 
+  public async handleVideoProcessingResult(result: VideoProcessingResultEvent): Promise<void> {
+    // Videos have no image record; their per-track events are only reported for now
+    if (result.processing_status === 'failed') {
+      appLogger.error(`Video processing failed for ${result.video_filename}: ${result.error}`);
+      return;
+    }
+    appLogger.info(
+      `Processed video ${result.video_filename}: ${result.people_with_helmets}/${result.total_people} people with helmets`
+    );
+  }
+
   public async getImageStats(): Promise<ImageStatsResponse> {
     try {
       // Get all images to calculate stats
@@ -173,6 +189,26 @@ class HelmetDetectionService {
     }
   }
 
+  // Short-lived URL the render server accepts: HMAC-SHA256 over "<annotated filename>:<expires>"
+  private signRenderUrl(annotationUrl: string): string | undefined {
+    if (!config.RENDER_URL_SECRET) {
+      appLogger.warn('RENDER_URL_SECRET is not set, lazy annotated images are unavailable');
+      return undefined;
+    }
+
+    const url = new URL(annotationUrl);
+    const annotatedFilename = decodeURIComponent(url.pathname.replace(/^\/annotated\//, ''));
+    const expires = Math.floor(Date.now() / 1000) + config.RENDER_URL_EXPIRY_SECONDS;
+    const signature = crypto
+      .createHmac('sha256', config.RENDER_URL_SECRET)
+      .update(`${annotatedFilename}:${expires}`)
+      .digest('hex');
+
+    url.searchParams.set('expires', String(expires));
+    url.searchParams.set('signature', signature);
+    return url.toString();
+  }
+
   public validateImageFile(file: Express.Multer.File): { isValid: boolean; error?: string } {
     // Check file size (max 10MB)
     const maxSize = 10 * 1024 * 1024; // 10MB
@@ -35,6 +35,7 @@ const baseImageSchema = z.object({
   uploadedAt: z.date(),
   processingStatus: processingStatusSchema,
   annotatedFilename: z.string().optional(),
+  annotationUrl: z.string().optional(),
   totalPeople: z.number().optional(),
   peopleWithHelmets: z.number().optional(),
   complianceRate: z.number().optional(),
@@ -105,7 +106,9 @@ export type ProcessingRequestEvent = z.infer<typeof processingRequestEventSchema
 export const processingResultEventSchema = z.object({
   image_id: z.string(),
   image_filename: z.string(),
-  annotated_filename: z.string().optional(),
+  annotated_filename: z.string().nullable().optional(),
+  // Render server URL of an annotated image rendered on first view (lazy annotation mode)
+  annotation_url: z.string().nullable().optional(),
   processing_status: z.enum(['completed', 'failed']),
   total_people: z.number(),
   people_with_helmets: z.number(),
@@ -116,6 +119,36 @@ export const processingResultEventSchema = z.object({
 });
 export type ProcessingResultEvent = z.infer<typeof processingResultEventSchema>;
 
+// Per-track compliance event of a video
+const videoTrackEventSchema = z.object({
+  event: z.enum(['track_confirmed', 'track_ended']),
+  source: z.string(),
+  track_id: z.number(),
+  status: z.string(),
+  has_helmet: z.boolean(),
+  status_confidence: z.number(),
+  first_seen: z.number(),
+  last_seen: z.number(),
+  keyframes: z.number(),
+  bbox: bboxSchema,
+});
+
+// Video results are published on the same exchange and carry video_id instead of image_id
+export const videoProcessingResultEventSchema = z.object({
+  video_id: z.string().nullable().optional(),
+  video_filename: z.string(),
+  processing_status: z.enum(['completed', 'failed']),
+  total_people: z.number(),
+  people_with_helmets: z.number(),
+  compliance_rate: z.number(),
+  events: z.array(videoTrackEventSchema),
+  frames_read: z.number().optional(),
+  keyframes: z.number().optional(),
+  error: z.union([z.string(), z.null()]).optional(),
+  timestamp: z.string(),
+});
+export type VideoProcessingResultEvent = z.infer<typeof videoProcessingResultEventSchema>;
+
 // Additional Type Exports
 export type HelmetStatus = z.infer<typeof helmetStatusSchema>;
 export type Detection = z.infer<typeof detectionSchema>;
@@ -61,17 +61,26 @@ export class RabbitMQUtils {
     RabbitMQUtils.channel?.publish(exchangeName, routingKey, messageBuffer, { persistent: true });
   }
 
-  static async consume(queueName: string, callback: (msg: Record<string, any>) => void) {
+  static async consume(
+    queueName: string,
+    callback: (msg: Record<string, any>) => void | Promise<void>
+  ) {
     if (!RabbitMQUtils.channel) {
       throw new Error('RabbitMQ channel not initialized');
     }
-    await RabbitMQUtils.channel?.consume(queueName, (msg: ConsumeMessage | null) => {
-      if (msg) {
+    await RabbitMQUtils.channel?.consume(queueName, async (msg: ConsumeMessage | null) => {
+      if (!msg) return;
+
+      try {
         const content = msg.content.toString();
         const parsedContent = JSON.parse(content);
 
-        callback(parsedContent);
+        await callback(parsedContent);
         RabbitMQUtils.channel?.ack(msg);
+      } catch (error) {
+        // Malformed or unhandled messages are dropped rather than requeued forever
+        appLogger.error(`Failed to handle message from ${queueName}:`, error);
+        RabbitMQUtils.channel?.nack(msg, false, false);
       }
     });
   }
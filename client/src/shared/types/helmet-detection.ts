@@ -15,6 +15,7 @@ export interface ImageRecord {
   uploadedAt: string;
   processingStatus: 'pending' | 'processing' | 'completed' | 'failed';
   annotatedFilename?: string;
+  annotationUrl?: string;
   totalPeople?: number;
   peopleWithHelmets?: number;
   complianceRate?: number;
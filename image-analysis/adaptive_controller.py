@@ -0,0 +1,103 @@
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+from metrics import QueueDepthSampler
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def quality_tiers() -> List[Dict]:
+    """
+    Quality tiers from best to cheapest: model input size, whether annotated images are
+    produced, and the inference batch size. ADAPTIVE_TIERS (a JSON list) replaces the defaults.
+    """
+    if ADAPTIVE_TIERS:
+        return json.loads(ADAPTIVE_TIERS)
+
+    return [
+        {'image_size': INFERENCE_IMAGE_SIZE, 'annotate': True, 'batch_size': BATCH_SIZE},
+        {'image_size': 512, 'annotate': True, 'batch_size': BATCH_SIZE * 2},
+        {'image_size': 416, 'annotate': False, 'batch_size': BATCH_SIZE * 2},
+        {'image_size': 320, 'annotate': False, 'batch_size': BATCH_SIZE * 4}
+    ]
+
+
+class AdaptiveController(threading.Thread):
+    def __init__(self, service, queue_sampler: Optional[QueueDepthSampler]):
+        """
+        Background thread that steps the service down a quality tier while the request backlog
+        or the age of the oldest in-flight request is above its threshold, and back up once both
+        are low again. Consecutive changes are at least ADAPTIVE_HOLD_SECONDS apart.
+        """
+        super().__init__(name="adaptive-controller", daemon=True)
+        self.service = service
+        self.tiers = service.quality_tiers
+
+        # Reuse the metrics endpoint's sampler, or sample the queue ourselves
+        self.own_sampler = queue_sampler is None
+        if self.own_sampler:
+            queue_sampler = QueueDepthSampler(
+                service.message_handler.connection_parameters(), REQUEST_QUEUES, ADAPTIVE_INTERVAL_SECONDS
+            )
+            queue_sampler.start()
+        self.queue_sampler = queue_sampler
+
+        # Allow the first step right away
+        self.last_change = time.monotonic() - ADAPTIVE_HOLD_SECONDS
+        self.stopped = threading.Event()
+
+    def oldest_in_flight_ms(self) -> float:
+        """
+        Age of the oldest request received but not yet acknowledged, videos aside
+        """
+        message_handler = self.service.message_handler
+        try:
+            received_at = [received for delivery_tag, received in list(message_handler.received_at.items())
+                           if delivery_tag not in message_handler.long_running]
+        except RuntimeError:
+            # Changed by the connection thread while copying; try again next interval
+            return 0.0
+        if not received_at:
+            return 0.0
+        return (time.monotonic() - min(received_at)) * 1000
+
+    def evaluate(self) -> int:
+        """
+        Tier to use next, one step at a time
+        """
+        tier = self.service.quality_tier
+        backlog = sum(self.queue_sampler.backlog.get(queue, 0) for queue in REQUEST_QUEUES)
+        latency_ms = self.oldest_in_flight_ms()
+
+        if time.monotonic() - self.last_change < ADAPTIVE_HOLD_SECONDS:
+            return tier
+
+        if (backlog > ADAPTIVE_BACKLOG_HIGH or latency_ms > ADAPTIVE_LATENCY_SLO_MS) and tier < len(self.tiers) - 1:
+            logger.warning(f"Backlog {backlog}, oldest request {latency_ms:.0f} ms: stepping down to quality tier {tier + 1}")
+            return tier + 1
+
+        # Step back up only with clear headroom, so the tier does not flap around a threshold
+        if backlog < ADAPTIVE_BACKLOG_LOW and latency_ms < ADAPTIVE_LATENCY_SLO_MS / 2 and tier > 0:
+            logger.info(f"Backlog {backlog}, oldest request {latency_ms:.0f} ms: stepping up to quality tier {tier - 1}")
+            return tier - 1
+
+        return tier
+
+    def run(self) -> None:
+        while not self.stopped.wait(ADAPTIVE_INTERVAL_SECONDS):
+            try:
+                tier = self.evaluate()
+                if tier != self.service.quality_tier:
+                    self.service.apply_quality_tier(tier)
+                    self.last_change = time.monotonic()
+            except Exception as e:
+                logger.error(f"Adaptive controller failed: {e}")
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.own_sampler:
+            self.queue_sampler.stop()
@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+from detections import STATUS_WEARING_HELMET
+from config import *
+
+
+def annotation_object_name(annotated_filename: str) -> str:
+    """
+    MinIO object holding the detections an annotated image is rendered from in lazy annotation mode
+    """
+    return f"{ANNOTATION_DETECTIONS_PREFIX}{annotated_filename}.json"
+
+
+def draw_detections(image: np.ndarray, detections: np.ndarray, scale: np.ndarray = None) -> np.ndarray:
+    """
+    Draw bounding boxes and labels in place on a BGR image.
+    scale maps the image to the coordinates of the detections when it was decoded at reduced size.
+    """
+    bboxes = detections['bbox'] if scale is None else np.rint(detections['bbox'] / np.tile(scale, 2)).astype(np.int32)
+    for (x, y, width, height), confidence, status in zip(
+            bboxes.tolist(), detections['confidence'].tolist(), detections['status'].tolist()):
+        # Convert bbox from [x, y, width, height] to [x1, y1, x2, y2] for drawing
+        x1, y1, x2, y2 = x, y, x + width, y + height
+    
+        # Choose color based on helmet status
+        if status == STATUS_WEARING_HELMET:
+            color = (0, 255, 0)  # Green for wearing helmet
+            label = f"Helmet ({confidence:.2f})"
+        else:
+            color = (0, 0, 255)  # Red for no helmet
+            label = "No Helmet"
+    
+        # Draw bounding box
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 3)
+    
+        # Draw label
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        font_scale = 0.7
+        thickness = 2
+        (text_width, text_height), baseline = cv2.getTextSize(label, font, font_scale, thickness)
+    
+        # Draw background for text
+        cv2.rectangle(image, (x1, y1 - text_height - baseline - 10), 
+                     (x1 + text_width, y1), color, -1)
+    
+        # Draw text
+        cv2.putText(image, label, (x1, y1 - baseline - 5), 
+                   font, font_scale, (255, 255, 255), thickness)
+
+    return image
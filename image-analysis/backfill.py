@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from helmet_detector import HelmetDetector
+from storage_service import StorageService
+from detections import detections_to_json
+from main import create_detector
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Source images; annotated copies and other objects in the bucket are skipped
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'})
+CHECKPOINT_FILE = 'checkpoint.json'
+
+# name, decoded image, scale to original coordinates, error
+Fetched = Tuple[str, Optional[np.ndarray], Optional[np.ndarray], Optional[str]]
+
+
+def is_source_image(object_name: str) -> bool:
+    """
+    Whether an object is an uploaded image rather than an annotated copy, cached result or video
+    """
+    if object_name.startswith((RESULT_CACHE_PREFIX, ANNOTATION_DETECTIONS_PREFIX)):
+        return False
+    name, ext = os.path.splitext(object_name)
+    return ext.lower() in IMAGE_EXTENSIONS and not name.endswith('_annotated')
+
+
+def parquet_schema():
+    """
+    Arrow schema of a result record, with detections as in result messages
+    """
+    import pyarrow as pa
+
+    detection = pa.struct([
+        ('bbox', pa.list_(pa.int32(), 4)),
+        ('confidence', pa.float32()),
+        ('has_helmet', pa.bool_()),
+        ('helmet_confidence', pa.float32()),
+        ('status', pa.string()),
+        ('detection_method', pa.string())
+    ])
+    return pa.schema([
+        ('image_filename', pa.string()),
+        ('success', pa.bool_()),
+        ('error', pa.string()),
+        ('total_people', pa.int32()),
+        ('people_with_helmets', pa.int32()),
+        ('compliance_rate', pa.float64()),
+        ('detections', pa.list_(detection))
+    ])
+
+
+class PartitionWriter:
+    def __init__(self, output_dir: str, output_format: str, checkpoint: Dict):
+        """
+        Writes result records into numbered partition files of BACKFILL_PARTITION_SIZE records.
+        Each partition is moved into place once complete and the checkpoint then advances to its
+        last image, so an interrupted run resumes right after the last complete partition.
+        """
+        if output_format not in ('jsonl', 'parquet'):
+            raise ValueError(f"Unknown backfill format: {output_format}")
+
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.checkpoint = checkpoint
+        self.records: List[Dict] = []
+        self.started = time.monotonic()
+        self.written = 0
+
+    @staticmethod
+    def load_checkpoint(output_dir: str) -> Optional[Dict]:
+        path = os.path.join(output_dir, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def add(self, record: Dict) -> None:
+        self.records.append(record)
+        if len(self.records) >= BACKFILL_PARTITION_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the buffered records as the next partition and advance the checkpoint
+        """
+        if not self.records:
+            return
+
+        path = os.path.join(self.output_dir, f"part-{self.checkpoint['next_partition']:06d}.{self.output_format}")
+        temporary_path = f"{path}.tmp"
+
+        if self.output_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            pq.write_table(pa.Table.from_pylist(self.records, schema=parquet_schema()), temporary_path)
+        else:
+            with open(temporary_path, 'w') as f:
+                for record in self.records:
+                    f.write(json.dumps(record))
+                    f.write('\n')
+        os.replace(temporary_path, path)
+
+        self.checkpoint['next_partition'] += 1
+        self.checkpoint['last_object'] = self.records[-1]['image_filename']
+        self.checkpoint['records'] += len(self.records)
+        self.save_checkpoint()
+
+        self.written += len(self.records)
+        rate = self.written / max(time.monotonic() - self.started, 1e-9)
+        logger.info(f"Wrote {path} ({self.checkpoint['records']} images in total, {rate:.1f} images/s)")
+        self.records = []
+
+    def save_checkpoint(self) -> None:
+        path = os.path.join(self.output_dir, CHECKPOINT_FILE)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'w') as f:
+            json.dump(self.checkpoint, f, indent=2)
+        os.replace(temporary_path, path)
+
+
+class Backfill:
+    def __init__(self, detector: HelmetDetector, storage_service: StorageService, writer: PartitionWriter,
+                 batch_size: int = BATCH_SIZE, workers: int = BACKFILL_DOWNLOAD_WORKERS):
+        """
+        Re-scores stored images: lists a bucket prefix, downloads and decodes images on a thread
+        pool ahead of inference and runs them through the detector in batches
+        """
+        self.detector = detector
+        self.storage_service = storage_service
+        self.writer = writer
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def fetch(self, object_name: str) -> Fetched:
+        """
+        Download and decode one image on a prefetch thread
+        """
+        try:
+            # The download buffer belongs to this thread and is reused by its next download
+            image_data = self.storage_service.download_image_bytes(object_name)
+            image, scale = self.detector.decode_image_scaled(image_data)
+            return object_name, image, scale, None
+        except Exception as e:
+            return object_name, None, None, str(e)
+
+    def prefetch(self, object_names: Iterator[str]) -> Iterator[Fetched]:
+        """
+        Fetched images in listing order, with a bounded number of downloads ahead of inference
+        """
+        window = 2 * max(self.workers, self.batch_size)
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='backfill-fetch') as pool:
+            pending = deque()
+            for object_name in object_names:
+                pending.append(pool.submit(self.fetch, object_name))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def run(self, prefix: str, limit: int = None) -> None:
+        """
+        Process every source image under the prefix after the checkpoint
+        """
+        object_names = (
+            object_name
+            for object_name in self.storage_service.list_objects(prefix, self.writer.checkpoint['last_object'])
+            if is_source_image(object_name)
+        )
+        if limit:
+            object_names = itertools.islice(object_names, limit)
+
+        batch: List[Fetched] = []
+        for fetched in self.prefetch(object_names):
+            batch.append(fetched)
+            if len(batch) >= self.batch_size:
+                self.process_batch(batch)
+                batch = []
+
+        self.process_batch(batch)
+        self.writer.flush()
+
+    def process_batch(self, batch: List[Fetched]) -> None:
+        """
+        Run batched inference on the decoded images and hand records to the writer in listing order
+        """
+        decoded = [(image, scale) for _, image, scale, _ in batch if image is not None]
+        processing_results = iter(self.detector.analyze_images(
+            [image for image, _ in decoded], [scale for _, scale in decoded]
+        ))
+
+        for object_name, image, _, error in batch:
+            if image is None:
+                logger.error(f"Error processing image {object_name}: {error}")
+                processing_result = {'success': False, 'error': error}
+            else:
+                processing_result = next(processing_results)
+            self.writer.add(self.build_record(object_name, processing_result))
+
+    def build_record(self, object_name: str, processing_result: Dict) -> Dict:
+        if not processing_result['success']:
+            return {
+                'image_filename': object_name,
+                'success': False,
+                'error': processing_result.get('error', 'Unknown error'),
+                'total_people': 0,
+                'people_with_helmets': 0,
+                'compliance_rate': 0.0,
+                'detections': []
+            }
+
+        return {
+            'image_filename': object_name,
+            'success': True,
+            'error': None,
+            'total_people': processing_result['total_people'],
+            'people_with_helmets': processing_result['people_with_helmets'],
+            'compliance_rate': float(processing_result['compliance_rate']),
+            'detections': detections_to_json(processing_result['detections'])
+        }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Re-score stored images with the current model")
+    parser.add_argument('--prefix', default='', help="Bucket prefix to process")
+    parser.add_argument('--output-dir', default=BACKFILL_OUTPUT_DIR)
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default=BACKFILL_FORMAT)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=BACKFILL_DOWNLOAD_WORKERS, help="Download and decode threads")
+    parser.add_argument('--limit', type=int, help="Stop after this many images")
+    args = parser.parse_args()
+
+    try:
+        os.makedirs(args.output_dir, exist_ok=True)
+        detector = create_detector()
+
+        checkpoint = PartitionWriter.load_checkpoint(args.output_dir)
+        run_settings = {
+            'prefix': args.prefix,
+            'format': args.format,
+            'model_checksum': detector.model_checksum,
+            'confidence_threshold': detector.confidence_threshold,
+            'iou_threshold': detector.iou_threshold
+        }
+        if checkpoint is None:
+            checkpoint = dict(run_settings, last_object=None, next_partition=0, records=0)
+        else:
+            changed = [key for key, value in run_settings.items() if checkpoint.get(key) != value]
+            if changed:
+                raise ValueError(f"{args.output_dir} holds a backfill with different {', '.join(changed)}; use a new output directory")
+            logger.info(f"Resuming after {checkpoint['last_object']} ({checkpoint['records']} images done)")
+
+        writer = PartitionWriter(args.output_dir, args.format, checkpoint)
+        Backfill(detector, StorageService(), writer, args.batch_size, args.workers).run(args.prefix, args.limit)
+
+        logger.info(f"Backfill complete: {checkpoint['records']} images in {args.output_dir}")
+        return 0
+
+    except KeyboardInterrupt:
+        logger.info("Backfill interrupted; run again to resume from the checkpoint")
+        return 130
+    except Exception as e:
+        logger.error(f"Backfill failed: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
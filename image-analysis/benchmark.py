@@ -0,0 +1,544 @@
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from datetime import datetime, UTC
+from typing import Dict, List, Tuple
+import cv2
+import numpy as np
+import stage_timing
+from detections import CLASS_STATUS, DETECTION_DTYPE
+from main import HelmetDetectionService, create_detector
+from message_handler import RESULT_CONTENT_TYPES, MessageHandler
+from storage_service import StorageService
+from config import *
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STAGES = ('download', 'decode', 'inference', 'postprocess', 'annotate', 'encode', 'upload', 'publish')
+
+
+class InMemoryResponse:
+    def __init__(self, data: bytes):
+        """
+        Stand-in for the HTTP response returned by Minio.get_object
+        """
+        self.data = data
+
+    def stream(self, chunk_size: int):
+        for offset in range(0, len(self.data), chunk_size):
+            yield self.data[offset:offset + chunk_size]
+
+    def read(self) -> bytes:
+        return self.data
+
+    def close(self) -> None:
+        pass
+
+    def release_conn(self) -> None:
+        pass
+
+
+class InMemoryObjectStore:
+    def __init__(self):
+        """
+        Stand-in for the Minio client calls StorageService makes, backed by a dict
+        """
+        self.objects: Dict[str, bytes] = {}
+
+    def get_object(self, bucket: str, name: str) -> InMemoryResponse:
+        return InMemoryResponse(self.objects[name])
+
+    def put_object(self, bucket: str, name: str, data, length: int, content_type: str = None) -> None:
+        self.objects[name] = data.read(length)
+
+    def fget_object(self, bucket: str, name: str, path: str) -> None:
+        with open(path, 'wb') as f:
+            f.write(self.objects[name])
+
+    def fput_object(self, bucket: str, name: str, path: str) -> None:
+        with open(path, 'rb') as f:
+            self.objects[name] = f.read()
+
+    def stat_object(self, bucket: str, name: str) -> None:
+        if name not in self.objects:
+            raise KeyError(name)
+
+    def copy_object(self, bucket: str, name: str, source) -> None:
+        self.objects[name] = self.objects[source.object_name]
+
+
+class InMemoryStorageService(StorageService):
+    def __init__(self):
+        """
+        StorageService running against an in-memory object store instead of MinIO
+        """
+        self.client = InMemoryObjectStore()
+        self.thread_local = threading.local()
+
+
+class RecordingChannel:
+    def __init__(self):
+        """
+        Stand-in for a pika channel that records published message sizes
+        """
+        self.published_bytes: List[int] = []
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None) -> None:
+        self.published_bytes.append(len(body))
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        pass
+
+    def basic_nack(self, delivery_tag: int, multiple: bool = False, requeue: bool = True) -> None:
+        pass
+
+
+class InMemoryMessageHandler(MessageHandler):
+    def __init__(self):
+        """
+        MessageHandler that serializes results but publishes into a RecordingChannel
+        """
+        self.connection = None
+        self.channel = RecordingChannel()
+        self.received_at = {}
+        self.long_running = set()
+        self.deliveries = {}
+        self.delay_queues = set()
+        self.confirmed = {}
+        self.publisher = None
+        self.batch_size = BATCH_SIZE
+        self.result_encoding = RESULT_ENCODING
+        self.on_message = None
+        self.consumer_tags = []
+        self.consumer_queues = {}
+
+
+class CrowdBackend:
+    def __init__(self, backend, people: int, seed: int = 0):
+        """
+        Wraps the real inference backend and adds synthetic person boxes to every prediction,
+        so post-processing, annotation and publishing can be measured at a given crowd density
+        """
+        self.backend = backend
+        self.people = people
+        self.names = backend.names
+        self.model_file = backend.model_file
+        self.random = np.random.default_rng(seed)
+        self.person_classes = np.array([class_id for class_id, name in backend.names.items() if name in CLASS_STATUS])
+
+    def predict(self, images: List[np.ndarray], conf: float, iou: float, image_size: int = None) -> List[np.ndarray]:
+        predictions = self.backend.predict(images, conf, iou, image_size)
+        if not self.people or not len(self.person_classes):
+            return predictions
+        return [np.concatenate([data, self.synthetic_boxes(image.shape[:2])]) for data, image in zip(predictions, images)]
+
+    def synthetic_boxes(self, shape: Tuple[int, int]) -> np.ndarray:
+        height, width = shape
+        sizes = self.random.uniform(0.03, 0.15, (self.people, 2)) * [width, height]
+        top_left = self.random.uniform(0, 1, (self.people, 2)) * ([width, height] - sizes)
+        boxes = np.empty((self.people, 6), dtype=np.float32)
+        boxes[:, :2] = top_left
+        boxes[:, 2:4] = top_left + sizes
+        boxes[:, 4] = self.random.uniform(CONFIDENCE_THRESHOLD, 1.0, self.people)
+        boxes[:, 5] = self.random.choice(self.person_classes, self.people)
+        return boxes
+
+    def configure_threads(self, threads: int) -> None:
+        self.backend.configure_threads(threads)
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """
+    Busy synthetic scene: gradient background, shapes and sensor-like noise, so JPEG sizes are realistic
+    """
+    random = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                      np.full((height, width), 128, np.float32)], axis=2).astype(np.uint8)
+
+    for _ in range(40):
+        x1, x2 = sorted(random.integers(0, width, 2))
+        y1, y2 = sorted(random.integers(0, height, 2))
+        cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), random.integers(0, 255, 3).tolist(), -1)
+
+    noise = random.integers(-12, 12, image.shape, dtype=np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def load_scenario_images(args) -> List[Tuple[str, bytes]]:
+    """
+    Encoded (label, bytes) images for every synthetic resolution and every sample image
+    """
+    images = []
+    for resolution in filter(None, args.resolutions.split(',')):
+        width, height = (int(value) for value in resolution.lower().split('x'))
+        success, encoded = cv2.imencode('.jpg', synthetic_image(width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        images.append((f"synthetic_{width}x{height}", encoded.tobytes()))
+
+    if args.images:
+        for name in sorted(os.listdir(args.images)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                with open(os.path.join(args.images, name), 'rb') as f:
+                    images.append((f"sample_{os.path.splitext(name)[0]}", f.read()))
+
+    return images
+
+
+def summarize(samples: List[float]) -> Dict:
+    """
+    Count, mean and p50/p95/p99 of durations in seconds, reported in milliseconds
+    """
+    values = np.asarray(samples) * 1000.0
+    if not len(values):
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': int(len(values)),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3)
+    }
+
+
+def run_scenario(name: str, run_once, iterations: int, warmup: int) -> Dict:
+    """
+    Run a request function repeatedly and collect total and per-stage latencies
+    """
+    for _ in range(warmup):
+        run_once()
+
+    stage_samples: Dict[str, List[float]] = defaultdict(list)
+
+    def observer(stage: str, seconds: float) -> None:
+        stage_samples[stage].append(seconds)
+
+    latencies = []
+    stage_timing.add_observer(observer)
+    try:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            request_started = time.perf_counter()
+            run_once()
+            latencies.append(time.perf_counter() - request_started)
+        elapsed = time.perf_counter() - started
+    finally:
+        stage_timing.remove_observer(observer)
+
+    report = {
+        'name': name,
+        'requests': iterations,
+        'throughput_rps': round(iterations / elapsed, 3) if elapsed else None,
+        'latency': summarize(latencies),
+        'stages': {stage: summarize(stage_samples[stage]) for stage in STAGES if stage_samples[stage]}
+    }
+    logger.info(f"{name}: {report['throughput_rps']} req/s, p50 {report['latency']['p50_ms']} ms, p99 {report['latency']['p99_ms']} ms")
+    return report
+
+
+def run_in_process(args, images: List[Tuple[str, bytes]]) -> List[Dict]:
+    """
+    Benchmark HelmetDetectionService.process_image_request and HelmetDetector.process_image
+    against in-memory storage and messaging stand-ins
+    """
+    detector = create_detector()
+    real_backend = detector.backend
+    storage_service = InMemoryStorageService()
+    message_handler = InMemoryMessageHandler()
+    service = HelmetDetectionService(detector=detector, storage_service=storage_service, message_handler=message_handler)
+
+    temp_dir = tempfile.mkdtemp()
+    scenarios = []
+    try:
+        for label, data in images:
+            image_filename = f"{label}.jpg"
+            storage_service.client.objects[image_filename] = data
+            image_path = os.path.join(temp_dir, image_filename)
+            with open(image_path, 'wb') as f:
+                f.write(data)
+
+            for people in (int(value) for value in args.crowds.split(',')):
+                detector.backend = CrowdBackend(real_backend, people)
+                message = {'image_id': label, 'image_filename': image_filename}
+
+                def service_request():
+                    message_handler.publish_result(service.process_image_request(message))
+
+                def detector_request():
+                    detector.process_image(image_path, os.path.join(temp_dir, f"{label}_annotated.jpg"))
+
+                scenario = run_scenario(f"service/{label}/crowd_{people}", service_request, args.iterations, args.warmup)
+                scenario.update({'target': 'service', 'image': label, 'crowd': people, 'image_bytes': len(data),
+                                 'result_bytes': message_handler.channel.published_bytes[-1]})
+                scenarios.append(scenario)
+
+                scenario = run_scenario(f"detector/{label}/crowd_{people}", detector_request, args.iterations, args.warmup)
+                scenario.update({'target': 'detector', 'image': label, 'crowd': people, 'image_bytes': len(data)})
+                scenarios.append(scenario)
+    finally:
+        detector.backend = real_backend
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return scenarios
+
+
+def synthetic_result(people: int, seed: int = 0) -> Dict:
+    """
+    Completed result with the given number of random person detections on a 1920x1080 image
+    """
+    random = np.random.default_rng(seed)
+    detections = np.zeros(people, dtype=DETECTION_DTYPE)
+    detections['bbox'][:, 0] = random.integers(0, 1800, people)
+    detections['bbox'][:, 1] = random.integers(0, 900, people)
+    detections['bbox'][:, 2] = random.integers(20, 120, people)
+    detections['bbox'][:, 3] = random.integers(60, 180, people)
+    detections['confidence'] = random.uniform(0.25, 1.0, people)
+    detections['status'] = random.integers(0, 2, people)
+
+    with_helmets = int(np.count_nonzero(detections['status'] == 0))
+    return {
+        'image_id': 'synthetic',
+        'image_filename': 'synthetic.jpg',
+        'annotated_filename': 'synthetic_annotated.jpg',
+        'processing_status': 'completed',
+        'total_people': people,
+        'people_with_helmets': with_helmets,
+        'compliance_rate': with_helmets / people if people else 0,
+        'detections': detections,
+        'quality_tier': 0,
+        'timestamp': datetime.now(UTC).isoformat()
+    }
+
+
+def run_result_encodings(args) -> List[Dict]:
+    """
+    Compare result message size and serialization time of each result encoding per crowd size
+    """
+    message_handler = InMemoryMessageHandler()
+    scenarios = []
+
+    for encoding in args.result_encodings.split(','):
+        if encoding not in RESULT_CONTENT_TYPES:
+            raise ValueError(f"Unknown result encoding: {encoding}")
+        if encoding == 'msgpack':
+            try:
+                import msgpack
+            except ImportError:
+                logger.warning("msgpack is not installed, skipping its result encoding")
+                continue
+
+        message_handler.result_encoding = encoding
+        for people in (int(value) for value in args.crowds.split(',')):
+            result = synthetic_result(people)
+            body, _ = message_handler.build_result_message(result)
+
+            scenario = run_scenario(f"encoding/{encoding}/crowd_{people}",
+                                    lambda: message_handler.build_result_message(result),
+                                    args.iterations * 10, args.warmup)
+            scenario.update({'target': 'encoding', 'encoding': encoding, 'crowd': people, 'result_bytes': len(body)})
+            scenarios.append(scenario)
+
+    for scenario in scenarios:
+        print(f"{scenario['name']:<32} {scenario['result_bytes']:>10} bytes {scenario['latency']['p50_ms']:>10.3f} ms p50")
+
+    return scenarios
+
+
+def run_end_to_end(args, images: List[Tuple[str, bytes]]) -> List[Dict]:
+    """
+    Benchmark a running service through the real RabbitMQ and MinIO (e.g. from docker-compose):
+    upload images, publish requests and time until each result arrives.
+    Note that other consumers of the results exchange (the backend) will also see these results.
+    """
+    import pika
+
+    storage_service = StorageService()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(
+        host=RABBITMQ_HOST,
+        port=RABBITMQ_PORT,
+        credentials=pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+    ))
+    channel = connection.channel()
+    result_queue = channel.queue_declare(queue='', exclusive=True).method.queue
+    channel.queue_bind(exchange=PROCESSING_RESULTS_EXCHANGE, queue=result_queue, routing_key=ROUTING_KEY)
+
+    scenarios = []
+    try:
+        for label, data in images:
+            requests = []
+            for _ in range(args.iterations):
+                image_id = f"benchmark-{uuid.uuid4().hex}"
+                image_filename = f"benchmark/{image_id}.jpg"
+                storage_service.client.put_object(MINIO_BUCKET, image_filename, io.BytesIO(data), len(data), content_type='image/jpeg')
+                requests.append((image_id, image_filename))
+
+            sent_at: Dict[str, float] = {}
+            latencies = []
+            next_request = 0
+            started = time.perf_counter()
+
+            def publish_next():
+                nonlocal next_request
+                image_id, image_filename = requests[next_request]
+                next_request += 1
+                sent_at[image_id] = time.perf_counter()
+                channel.basic_publish(
+                    exchange=IMAGE_PROCESSING_EXCHANGE,
+                    routing_key=ROUTING_KEY,
+                    body=json.dumps({'data': {
+                        'image_id': image_id,
+                        'image_filename': image_filename,
+                        'timestamp': datetime.now(UTC).isoformat()
+                    }})
+                )
+
+            while next_request < min(args.e2e_concurrency, len(requests)):
+                publish_next()
+
+            for method, properties, body in channel.consume(result_queue, auto_ack=True, inactivity_timeout=args.e2e_timeout):
+                if method is None:
+                    logger.warning(f"{label}: timed out with {len(sent_at)} results outstanding")
+                    break
+
+                image_id = MessageHandler.parse_result_message(body, properties.content_type).get('data', {}).get('image_id')
+                if image_id not in sent_at:
+                    continue
+
+                latencies.append(time.perf_counter() - sent_at.pop(image_id))
+                if next_request < len(requests):
+                    publish_next()
+                if not sent_at:
+                    break
+
+            channel.cancel()
+            elapsed = time.perf_counter() - started
+
+            for _, image_filename in requests:
+                for name in (image_filename, storage_service.generate_annotated_filename(image_filename)):
+                    try:
+                        storage_service.client.remove_object(MINIO_BUCKET, name)
+                    except Exception:
+                        pass
+
+            scenario = {
+                'name': f"e2e/{label}",
+                'target': 'e2e',
+                'image': label,
+                'requests': len(latencies),
+                'concurrency': args.e2e_concurrency,
+                'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed else None,
+                'latency': summarize(latencies)
+            }
+            logger.info(f"{scenario['name']}: {scenario['throughput_rps']} req/s, p50 {scenario['latency'].get('p50_ms')} ms")
+            scenarios.append(scenario)
+    finally:
+        connection.close()
+
+    return scenarios
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(report: Dict, baseline: Dict, threshold: float) -> int:
+    """
+    Print p50/p95 changes against a previous report; returns the number of regressions above threshold
+    """
+    baseline_scenarios = {scenario['name']: scenario for scenario in baseline.get('scenarios', [])}
+    regressions = 0
+
+    for scenario in report['scenarios']:
+        previous = baseline_scenarios.get(scenario['name'])
+        if not previous:
+            continue
+
+        rows = [('total', scenario['latency'], previous['latency'])]
+        rows += [(stage, stats, previous.get('stages', {}).get(stage, {})) for stage, stats in scenario.get('stages', {}).items()]
+
+        for stage, current, old in rows:
+            for percentile in ('p50_ms', 'p95_ms'):
+                if not old.get(percentile) or current.get(percentile) is None:
+                    continue
+                change = (current[percentile] - old[percentile]) / old[percentile]
+                flag = ''
+                if change > threshold:
+                    flag = '  REGRESSION'
+                    regressions += 1
+                print(f"{scenario['name']:<48} {stage:<12} {percentile:<7} {old[percentile]:>10.2f} -> {current[percentile]:>10.2f} ms ({change:+.1%}){flag}")
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the helmet detection worker")
+    parser.add_argument('--resolutions', default='640x480,1920x1080,4000x3000', help="Synthetic image sizes, comma separated")
+    parser.add_argument('--images', help="Folder of sample images to include")
+    parser.add_argument('--crowds', default='0,20,200', help="Synthetic people added per image, comma separated")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help="Report changes against a previous run")
+    parser.add_argument('--regression-threshold', type=float, default=0.10)
+    parser.add_argument('--e2e', action='store_true', help="Run against a live service through RabbitMQ and MinIO")
+    parser.add_argument('--e2e-concurrency', type=int, default=1, help="Requests kept in flight in end-to-end mode")
+    parser.add_argument('--e2e-timeout', type=float, default=60.0)
+    parser.add_argument('--result-encodings', default=','.join(RESULT_CONTENT_TYPES),
+                        help="Result encodings to compare by size and serialization time, comma separated ('' skips)")
+    parser.add_argument('--encodings-only', action='store_true', help="Only compare result encodings; no model needed")
+    args = parser.parse_args()
+
+    if args.encodings_only:
+        scenarios = []
+    else:
+        images = load_scenario_images(args)
+        scenarios = run_end_to_end(args, images) if args.e2e else run_in_process(args, images)
+    if args.result_encodings:
+        scenarios += run_result_encodings(args)
+
+    report = {
+        'commit': current_commit(),
+        'timestamp': datetime.now(UTC).isoformat(),
+        'config': {
+            'inference_backend': INFERENCE_BACKEND,
+            'in_memory_io': IN_MEMORY_IO,
+            'confidence_threshold': CONFIDENCE_THRESHOLD,
+            'iou_threshold': IOU_THRESHOLD,
+            'result_encoding': RESULT_ENCODING,
+            'cpu_count': os.cpu_count()
+        },
+        'scenarios': scenarios
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Benchmark results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.regression_threshold)
+        if regressions:
+            logger.error(f"{regressions} latency regressions above {args.regression_threshold:.0%}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
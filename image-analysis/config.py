@@ -15,11 +15,35 @@ MINIO_ENDPOINT = os.getenv('MINIO_ENDPOINT', 'localhost:9000')
 MINIO_ACCESS_KEY = os.getenv('MINIO_ACCESS_KEY', 'minioadmin')
 MINIO_SECRET_KEY = os.getenv('MINIO_SECRET_KEY', 'minioadmin')
 MINIO_BUCKET = os.getenv('MINIO_BUCKET', 'helmet-detection')
+# Keep downloads, decoding, encoding and uploads in memory instead of going through temp files
+IN_MEMORY_IO = os.getenv('IN_MEMORY_IO', 'false').lower() == 'true'
+# Initial size of the reusable in-memory download buffer (grows on demand)
+DOWNLOAD_BUFFER_SIZE = int(os.getenv('DOWNLOAD_BUFFER_SIZE', str(4 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
 
 # Model Configuration
 MODEL_PATH = os.getenv('MODEL_PATH', './models/yolov8n.pt')
 CONFIDENCE_THRESHOLD = float(os.getenv('CONFIDENCE_THRESHOLD', '0.25'))
 IOU_THRESHOLD = float(os.getenv('IOU_THRESHOLD', '0.4'))
+# Specialized PPE detection weights, used only when there is no model registry
+HELMET_MODEL_PATH = os.getenv('HELMET_MODEL_PATH', './models/helmet_detection.pt')
+# Local model registry pinning model versions to checksums; fetch weights with `python model_registry.py fetch`
+MODEL_REGISTRY_PATH = os.getenv('MODEL_REGISTRY_PATH', './models/registry.json')
+MODEL_NAME = os.getenv('MODEL_NAME', 'helmet_detection')
+MODEL_VERSION = os.getenv('MODEL_VERSION', 'v1')
+
+# Inference Backend Configuration
+# 'torch' runs the weights with ultralytics/PyTorch; 'onnx' (ONNX Runtime) and 'openvino' run an
+# exported graph and do not need torch at runtime. The export happens once, on first use or via model_export.py
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch')
+# Square input size the exported graph is run at
+INFERENCE_IMAGE_SIZE = int(os.getenv('INFERENCE_IMAGE_SIZE', '640'))
+# Intra-op threads for ONNX Runtime / OpenVINO (0 = runtime default)
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', '0'))
+EXPORTED_MODEL_DIR = os.getenv('EXPORTED_MODEL_DIR', './models/exported')
+# INT8 post-training quantization of the exported graph, calibrated on images from CALIBRATION_IMAGE_DIR
+INT8_QUANTIZATION = os.getenv('INT8_QUANTIZATION', 'false').lower() == 'true'
+CALIBRATION_IMAGE_DIR = os.getenv('CALIBRATION_IMAGE_DIR', './calibration')
 
 # RabbitMQ Exchange and Queue Configuration
 # Exchange to consume image processing requests from
@@ -29,4 +53,206 @@ PROCESSING_RESULTS_EXCHANGE = 'ai_service_processing_results_exchange'
 # Our own queue for consuming processing requests
 AI_SERVICE_QUEUE = 'ai_service_image_processing_queue'
 # Routing key - using catch-all as specified
-ROUTING_KEY = '#' 
\ No newline at end of file
+ROUTING_KEY = '#' 
+
+# Priority Lane Configuration
+# Split requests into a fast lane for interactive uploads and a bulk lane for backfill jobs
+PRIORITY_LANES = os.getenv('PRIORITY_LANES', 'false').lower() == 'true'
+# Fast lane queue; the bulk lane is AI_SERVICE_QUEUE, so its existing backlog drains as bulk
+FAST_QUEUE = 'ai_service_image_processing_fast_queue'
+# Topic patterns: single-word routing keys (the backend publishes with '#') are interactive,
+# bulk producers publish with 'bulk.<source>'
+FAST_ROUTING_KEY = os.getenv('FAST_ROUTING_KEY', '*')
+BULK_ROUTING_KEY = os.getenv('BULK_ROUTING_KEY', 'bulk.#')
+# Share of the consumer's unacked deliveries given to each lane
+FAST_LANE_WEIGHT = int(os.getenv('FAST_LANE_WEIGHT', '3'))
+BULK_LANE_WEIGHT = int(os.getenv('BULK_LANE_WEIGHT', '1'))
+# Queues requests are consumed from
+REQUEST_QUEUES = [FAST_QUEUE, AI_SERVICE_QUEUE] if PRIORITY_LANES else [AI_SERVICE_QUEUE]
+
+# Consumer Configuration
+# 'single' processes one message at a time, 'batch' groups queued deliveries into one inference call,
+# 'pipeline' overlaps fetch/decode, inference and annotate/upload/publish on separate worker threads,
+# 'shm' moves fetch/decode and annotate/encode/upload into processes sharing frames through shared memory
+CONSUMER_MODE = os.getenv('CONSUMER_MODE', 'single')
+# Maximum number of deliveries gathered into one batch
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', '8'))
+# Maximum time to wait for a batch to fill up before processing what was gathered
+BATCH_TIMEOUT_MS = int(os.getenv('BATCH_TIMEOUT_MS', '50'))
+
+# Pipeline Configuration (CONSUMER_MODE=pipeline)
+# Capacity of the bounded queues between stages, in decoded images
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '4'))
+PIPELINE_FETCH_WORKERS = int(os.getenv('PIPELINE_FETCH_WORKERS', '2'))
+PIPELINE_UPLOAD_WORKERS = int(os.getenv('PIPELINE_UPLOAD_WORKERS', '2'))
+
+# Shared Memory Pipeline Configuration (CONSUMER_MODE=shm)
+SHM_DECODE_WORKERS = int(os.getenv('SHM_DECODE_WORKERS', '2'))
+SHM_ENCODE_WORKERS = int(os.getenv('SHM_ENCODE_WORKERS', '2'))
+# Frame slots in the ring; a decoded frame holds its slot until inference, or annotation, is done with it
+SHM_SLOTS = int(os.getenv('SHM_SLOTS', str(2 * BATCH_SIZE + 4)))
+# Size of one slot; larger frames are copied through the queue instead
+SHM_SLOT_MB = int(os.getenv('SHM_SLOT_MB', '24'))
+
+# Worker Pool Configuration (supervisor.py)
+# Number of worker processes; 0 sizes the pool from the available cores and CPUS_PER_WORKER
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '0'))
+# Cores pinned to each worker; also used as the worker's torch intra-op thread count
+CPUS_PER_WORKER = int(os.getenv('CPUS_PER_WORKER', '4'))
+# Delay before restarting a crashed worker
+WORKER_RESTART_DELAY = float(os.getenv('WORKER_RESTART_DELAY', '1.0'))
+
+# Result Cache Configuration
+# Reuse detection results for byte-identical images instead of re-running inference
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'false').lower() == 'true'
+# Size budget of the in-process LRU tier, in bytes of serialized results
+RESULT_CACHE_MEMORY_BYTES = int(os.getenv('RESULT_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+# Object prefix of the persistent tier inside MINIO_BUCKET
+RESULT_CACHE_PREFIX = os.getenv('RESULT_CACHE_PREFIX', 'cache/results/')
+
+# Metrics Configuration
+# Port of the Prometheus metrics endpoint (0 disables it); supervisor workers use METRICS_PORT + worker index
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+# How often the request queue backlog is sampled
+METRICS_QUEUE_SAMPLE_SECONDS = float(os.getenv('METRICS_QUEUE_SAMPLE_SECONDS', '5'))
+
+# Publisher Configuration
+# Publish results on a separate connection with publisher confirms; requests are acked only once their result is confirmed
+PUBLISHER_CONFIRMS = os.getenv('PUBLISHER_CONFIRMS', 'false').lower() == 'true'
+# How long completed results wait to be published together in one batch
+PUBLISH_LINGER_MS = float(os.getenv('PUBLISH_LINGER_MS', '5'))
+# Delay before reconnecting a lost publisher connection
+PUBLISHER_RECONNECT_DELAY = float(os.getenv('PUBLISHER_RECONNECT_DELAY', '2'))
+# Result wire format: 'json' (verbose, default), 'columnar' (JSON with per-field detection arrays)
+# or 'msgpack' (MessagePack with packed binary detection arrays); signalled in the AMQP content_type
+RESULT_ENCODING = os.getenv('RESULT_ENCODING', 'json').lower()
+
+# Video Configuration
+# Frames per second sampled from a video while people are in view
+VIDEO_SAMPLE_FPS = float(os.getenv('VIDEO_SAMPLE_FPS', '5'))
+# Longest gap between sampled frames while the scene is static and empty
+VIDEO_MAX_SAMPLE_INTERVAL = float(os.getenv('VIDEO_MAX_SAMPLE_INTERVAL', '2'))
+# Sampled frames tracked with optical flow before detection runs again
+VIDEO_KEYFRAME_INTERVAL = int(os.getenv('VIDEO_KEYFRAME_INTERVAL', '10'))
+# Fraction of the scene that changed since the last keyframe before detection runs again
+VIDEO_SCENE_CHANGE_THRESHOLD = float(os.getenv('VIDEO_SCENE_CHANGE_THRESHOLD', '0.02'))
+# Minimum IoU for a detection to continue a track
+VIDEO_TRACK_IOU = float(os.getenv('VIDEO_TRACK_IOU', '0.3'))
+# Keyframes a track must be detected on before it is reported
+VIDEO_TRACK_MIN_HITS = int(os.getenv('VIDEO_TRACK_MIN_HITS', '2'))
+# Keyframes a track may go undetected before it ends
+VIDEO_TRACK_MAX_MISSES = int(os.getenv('VIDEO_TRACK_MAX_MISSES', '3'))
+# Lifetime of the presigned URL a video is streamed from
+VIDEO_URL_EXPIRY_SECONDS = int(os.getenv('VIDEO_URL_EXPIRY_SECONDS', '3600'))
+
+# Tiling Configuration
+# Images above this many pixels are detected in overlapping tiles (0 disables tiling)
+TILE_PIXEL_THRESHOLD = int(os.getenv('TILE_PIXEL_THRESHOLD', '12000000'))
+# Tile side and overlap between neighbouring tiles, in image pixels
+TILE_SIZE = int(os.getenv('TILE_SIZE', '1280'))
+TILE_OVERLAP = int(os.getenv('TILE_OVERLAP', '256'))
+
+# Decode Configuration
+# Decode large JPEGs at 1/2, 1/4 or 1/8 size while their longer side stays at least this long.
+# Off by default (0): annotated images are then drawn at the reduced size
+REDUCED_DECODE_MIN_SIDE = int(os.getenv('REDUCED_DECODE_MIN_SIDE', '0'))
+
+# Annotation Configuration
+# eager: draw and upload annotated images while processing; lazy: store detections and render on first view; off: no annotated images
+ANNOTATION_MODE = os.getenv('ANNOTATION_MODE', 'eager').lower()
+# Object prefix of the detections stored for lazy rendering
+ANNOTATION_DETECTIONS_PREFIX = os.getenv('ANNOTATION_DETECTIONS_PREFIX', 'annotations/')
+# Port of the lazy render server (render_server.py) and the base URL published in results
+RENDER_PORT = int(os.getenv('RENDER_PORT', '8090'))
+RENDER_BASE_URL = os.getenv('RENDER_BASE_URL', f"http://localhost:{RENDER_PORT}").rstrip('/')
+# Secret shared with the backend, which signs short-lived render URLs (?expires=...&signature=...) with it
+RENDER_URL_SECRET = os.getenv('RENDER_URL_SECRET', '')
+
+# Startup Configuration
+# File created once the model is warmed up and the consumer is ready ('' disables)
+READINESS_FILE = os.getenv('READINESS_FILE', '/tmp/helmet-detection-ready')
+
+# Adaptive Quality Configuration
+# Step down inference size, annotation and batch size while the request queue is backed up
+ADAPTIVE_QUALITY = os.getenv('ADAPTIVE_QUALITY', 'false').lower() == 'true'
+# Backlog above which quality steps down, and below which it may step back up
+ADAPTIVE_BACKLOG_HIGH = int(os.getenv('ADAPTIVE_BACKLOG_HIGH', '100'))
+ADAPTIVE_BACKLOG_LOW = int(os.getenv('ADAPTIVE_BACKLOG_LOW', '10'))
+# Age of the oldest in-flight request above which quality steps down
+ADAPTIVE_LATENCY_SLO_MS = float(os.getenv('ADAPTIVE_LATENCY_SLO_MS', '2000'))
+# How often the controller evaluates, and the minimum time between tier changes
+ADAPTIVE_INTERVAL_SECONDS = float(os.getenv('ADAPTIVE_INTERVAL_SECONDS', '5'))
+ADAPTIVE_HOLD_SECONDS = float(os.getenv('ADAPTIVE_HOLD_SECONDS', '30'))
+# JSON list of tiers ({"image_size", "annotate", "batch_size"}) replacing the defaults
+ADAPTIVE_TIERS = os.getenv('ADAPTIVE_TIERS', '')
+
+# Memory Configuration
+# Largest image accepted, in pixels (0 disables). Checked from the file header before decoding.
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', '50000000'))
+# 'downscale' decodes oversized JPEGs at a reduced size that fits; 'reject' fails them. Other formats are rejected.
+OVERSIZE_IMAGE_POLICY = os.getenv('OVERSIZE_IMAGE_POLICY', 'downscale').lower()
+if MAX_IMAGE_PIXELS:
+    # OpenCV's own limit for formats without a header parser here; read when cv2 is first imported
+    os.environ.setdefault('OPENCV_IO_MAX_IMAGE_PIXELS', str(MAX_IMAGE_PIXELS))
+# Reuse preallocated buffers for colour conversion and model input, and enforce the worker memory budget
+MEMORY_BOUNDED = os.getenv('MEMORY_BOUNDED', 'false').lower() == 'true'
+# Most memory kept in free pooled buffers
+BUFFER_POOL_MB = int(os.getenv('BUFFER_POOL_MB', '256'))
+# Resident memory above which a worker stops taking requests and exits to be restarted (0 disables)
+WORKER_MEMORY_BUDGET_MB = int(os.getenv('WORKER_MEMORY_BUDGET_MB', '0'))
+
+# Backfill Configuration
+# Output directory of backfill.py partitions and its checkpoint
+BACKFILL_OUTPUT_DIR = os.getenv('BACKFILL_OUTPUT_DIR', './backfill')
+# 'jsonl' or 'parquet' (needs pyarrow)
+BACKFILL_FORMAT = os.getenv('BACKFILL_FORMAT', 'jsonl').lower()
+# Threads downloading and decoding images ahead of inference
+BACKFILL_DOWNLOAD_WORKERS = int(os.getenv('BACKFILL_DOWNLOAD_WORKERS', '16'))
+# Results per output partition; the checkpoint advances whenever a partition is complete
+BACKFILL_PARTITION_SIZE = int(os.getenv('BACKFILL_PARTITION_SIZE', '10000'))
+
+# Cascade Configuration
+# Screen every image with a fast model and run the full model only on uncertain images or violations
+CASCADE_MODE = os.getenv('CASCADE_MODE', 'false').lower() == 'true'
+# Screening model as registry 'name:version' ('' runs the main model at CASCADE_SCREENING_IMAGE_SIZE)
+CASCADE_SCREENING_MODEL = os.getenv('CASCADE_SCREENING_MODEL', '')
+CASCADE_SCREENING_IMAGE_SIZE = int(os.getenv('CASCADE_SCREENING_IMAGE_SIZE', '320'))
+# Screening detections of people within this distance of CONFIDENCE_THRESHOLD are uncertain and escalate the image
+CASCADE_UNCERTAIN_BAND = float(os.getenv('CASCADE_UNCERTAIN_BAND', '0.15'))
+# Images between escalation rate / agreement log lines
+CASCADE_REPORT_INTERVAL = int(os.getenv('CASCADE_REPORT_INTERVAL', '1000'))
+
+# Retry Configuration
+# Retry failed requests after an exponentially growing delay instead of requeueing them at once
+DELAYED_RETRIES = os.getenv('DELAYED_RETRIES', 'true').lower() == 'true'
+# Attempts before a request goes to the dead-letter queue (or, for image errors, gets a failed result)
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '5'))
+# Delay before the first retry, doubled for every further attempt up to the maximum
+RETRY_BASE_DELAY_MS = int(os.getenv('RETRY_BASE_DELAY_MS', '1000'))
+RETRY_MAX_DELAY_MS = int(os.getenv('RETRY_MAX_DELAY_MS', '300000'))
+# Requests that failed permanently or too often
+DEAD_LETTER_QUEUE = 'ai_service_image_processing_dead_letter_queue'
+
+# Profiling Configuration
+# Requests profiled after each activation, by SIGUSR1 or a command on the control exchange
+PROFILE_REQUESTS = int(os.getenv('PROFILE_REQUESTS', '50'))
+# 'cprofile' (deterministic, thread doing the processing), 'sampling' (stacks of all threads,
+# also covers pipeline mode) or 'torch' (operator trace of the torch backend)
+PROFILER = os.getenv('PROFILER', 'cprofile').lower()
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+# MinIO prefix for profile outputs
+PROFILE_PREFIX = os.getenv('PROFILE_PREFIX', 'profiles/')
+# Listen for commands such as {"command": "profile"} on a fanout exchange reaching every worker (opt-in)
+CONTROL_COMMANDS = os.getenv('CONTROL_COMMANDS', 'false').lower() == 'true'
+CONTROL_EXCHANGE = 'ai_service_control_exchange'
+
+# Region of Interest Configuration
+# JSON file mapping source ids to lists of polygons ([[x, y], ...] in original image pixels);
+# images from a listed source are cropped to the polygons before inference and only people inside count
+ROI_CONFIG_PATH = os.getenv('ROI_CONFIG_PATH', '')
+# Request message field holding the camera / source id
+ROI_SOURCE_FIELD = os.getenv('ROI_SOURCE_FIELD', 'source_id')
+# Context kept around the polygons' bounding box, so people on the boundary are still detected whole
+ROI_CROP_MARGIN = int(os.getenv('ROI_CROP_MARGIN', '32'))
+# Point of a box tested against the polygons: 'bottom' (where the person stands) or 'center'
+ROI_ANCHOR = os.getenv('ROI_ANCHOR', 'bottom').lower()
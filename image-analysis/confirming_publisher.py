@@ -0,0 +1,172 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Callable
+import pika
+from pika.spec import Basic
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ConfirmingPublisher(threading.Thread):
+    def __init__(self, connection_parameters: pika.ConnectionParameters):
+        """
+        Publisher on its own asynchronous connection with publisher confirms enabled.
+        Messages queued from any thread are sent in batches on the publisher's I/O loop,
+        and each message's callback receives True once the broker confirms it,
+        or False if the broker rejects it or the connection is lost first.
+        """
+        super().__init__(name="confirming-publisher", daemon=True)
+        self.connection_parameters = connection_parameters
+        self.connection = None
+        self.channel = None
+
+        self.pending = deque()
+        self.unconfirmed: "OrderedDict[int, Callable[[bool], None]]" = OrderedDict()
+        self.next_delivery_tag = 0
+
+        self.lock = threading.Lock()
+        self.flush_scheduled = False
+        self.stopping = False
+
+    def publish(self, exchange: str, routing_key: str, body: bytes, properties: pika.BasicProperties,
+                on_confirm: Callable[[bool], None]) -> None:
+        """
+        Queue a message for publishing. Safe to call from any thread.
+        """
+        self.pending.append((exchange, routing_key, body, properties, on_confirm))
+
+        with self.lock:
+            if self.flush_scheduled or self.connection is None:
+                return
+            self.flush_scheduled = True
+
+        try:
+            self.connection.ioloop.add_callback_threadsafe(self.schedule_flush)
+        except Exception as e:
+            # Reconnecting; the queued message is sent once the channel reopens
+            logger.warning(f"Publisher connection unavailable: {e}")
+
+    def run(self) -> None:
+        while not self.stopping:
+            self.connection = pika.SelectConnection(
+                self.connection_parameters,
+                on_open_callback=self.on_connection_open,
+                on_open_error_callback=self.on_connection_open_error,
+                on_close_callback=self.on_connection_closed
+            )
+            self.connection.ioloop.start()
+
+            if not self.stopping:
+                time.sleep(PUBLISHER_RECONNECT_DELAY)
+
+    def on_connection_open(self, connection) -> None:
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_open_error(self, connection, error) -> None:
+        logger.error(f"Failed to open publisher connection: {error}")
+        connection.ioloop.stop()
+
+    def on_connection_closed(self, connection, reason) -> None:
+        self.channel = None
+        self.fail_unconfirmed()
+        if not self.stopping:
+            logger.warning(f"Publisher connection closed: {reason}")
+        connection.ioloop.stop()
+
+    def on_channel_open(self, channel) -> None:
+        self.channel = channel
+        self.next_delivery_tag = 0
+        channel.add_on_close_callback(self.on_channel_closed)
+        channel.confirm_delivery(self.on_delivery_confirmation)
+        logger.info("Publisher channel opened with confirms enabled")
+
+        with self.lock:
+            self.flush_scheduled = False
+        self.flush()
+
+    def on_channel_closed(self, channel, reason) -> None:
+        """
+        The broker may close just the channel, e.g. on a publish to a missing exchange; its confirms
+        will never arrive, so fail the unconfirmed messages and reopen it on the same connection
+        """
+        if channel is not self.channel:
+            return
+        self.channel = None
+        self.fail_unconfirmed()
+        if self.stopping or not self.connection.is_open:
+            return
+        logger.warning(f"Publisher channel closed: {reason}; reopening")
+        self.connection.channel(on_open_callback=self.on_channel_open)
+
+    def schedule_flush(self) -> None:
+        """
+        Linger briefly so messages completed close together go out in one batch
+        """
+        if PUBLISH_LINGER_MS > 0:
+            self.connection.ioloop.call_later(PUBLISH_LINGER_MS / 1000.0, self.flush)
+        else:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Publish everything queued so far. Runs on the publisher I/O loop.
+        """
+        with self.lock:
+            self.flush_scheduled = False
+
+        if self.channel is None or not self.channel.is_open:
+            return
+
+        while self.pending:
+            exchange, routing_key, body, properties, on_confirm = self.pending.popleft()
+            self.next_delivery_tag += 1
+            self.unconfirmed[self.next_delivery_tag] = on_confirm
+            self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+
+    def on_delivery_confirmation(self, frame) -> None:
+        """
+        Resolve callbacks for acks/nacks, which the broker may send for several messages at once
+        """
+        method = frame.method
+        confirmed = isinstance(method, Basic.Ack)
+
+        if method.multiple:
+            delivery_tags = [tag for tag in self.unconfirmed if tag <= method.delivery_tag]
+        else:
+            delivery_tags = [method.delivery_tag]
+
+        for delivery_tag in delivery_tags:
+            on_confirm = self.unconfirmed.pop(delivery_tag, None)
+            if on_confirm is not None:
+                on_confirm(confirmed)
+
+    def fail_unconfirmed(self) -> None:
+        """
+        Report every message still waiting for a confirm as lost
+        """
+        unconfirmed = list(self.unconfirmed.values())
+        self.unconfirmed.clear()
+        for on_confirm in unconfirmed:
+            on_confirm(False)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Close the publisher connection and wait for the I/O loop to exit
+        """
+        self.stopping = True
+        if self.connection is not None:
+            try:
+                self.connection.ioloop.add_callback_threadsafe(self.close_connection)
+            except Exception:
+                pass
+        self.join(timeout)
+
+    def close_connection(self) -> None:
+        if self.connection.is_open:
+            self.connection.close()
+        else:
+            self.connection.ioloop.stop()
@@ -0,0 +1,111 @@
+import numpy as np
+from typing import Dict, List
+
+# Helmet status codes stored in detection arrays
+STATUS_WEARING_HELMET = 0
+STATUS_NO_HELMET = 1
+STATUS_NAMES = ('wearing_helmet', 'no_helmet')
+
+# Model class names mapped to helmet status codes; other classes are not counted as people
+CLASS_STATUS = {
+    'Hardhat': STATUS_WEARING_HELMET,
+    'NO-Hardhat': STATUS_NO_HELMET
+}
+
+# Compact per-image detection records, converted to JSON only when publishing
+DETECTION_DTYPE = np.dtype([
+    ('bbox', np.int32, (4,)),  # x, y, width, height
+    ('confidence', np.float32),
+    ('status', np.int8)
+])
+
+
+def empty_detections() -> np.ndarray:
+    return np.zeros(0, dtype=DETECTION_DTYPE)
+
+
+def count_with_helmets(detections: np.ndarray) -> int:
+    return int(np.count_nonzero(detections['status'] == STATUS_WEARING_HELMET))
+
+
+def scale_detections(detections: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    """
+    Copy of a detection array with boxes multiplied by an (x, y) scale
+    """
+    scaled = detections.copy()
+    scaled['bbox'] = np.rint(detections['bbox'] * np.tile(scale, 2)).astype(np.int32)
+    return scaled
+
+
+def detections_to_json(detections) -> List[Dict]:
+    """
+    Convert a detection array into the JSON-ready dicts of the result message.
+    Lists (e.g. results read back from the cache) are returned unchanged.
+    """
+    if not isinstance(detections, np.ndarray):
+        return detections
+
+    bboxes = detections['bbox'].tolist()
+    confidences = detections['confidence'].tolist()
+    statuses = detections['status'].tolist()
+
+    return [
+        {
+            'bbox': bbox,
+            'confidence': confidence,
+            'has_helmet': status == STATUS_WEARING_HELMET,
+            'helmet_confidence': confidence if status == STATUS_WEARING_HELMET else 0.0,
+            'status': STATUS_NAMES[status],
+            'detection_method': 'specialized_ppe_model'
+        }
+        for bbox, confidence, status in zip(bboxes, confidences, statuses)
+    ]
+
+
+def detections_from_json(detections: List[Dict]) -> np.ndarray:
+    """
+    Rebuild a detection array from the JSON dicts of a result message
+    """
+    array = np.zeros(len(detections), dtype=DETECTION_DTYPE)
+    for index, detection in enumerate(detections):
+        array[index] = (detection['bbox'], detection['confidence'], STATUS_NAMES.index(detection['status']))
+    return array
+
+
+def result_to_json(result: Dict) -> Dict:
+    """
+    Copy of a result dict with its detections converted for JSON serialization
+    """
+    if isinstance(result.get('detections'), np.ndarray):
+        result = dict(result, detections=detections_to_json(result['detections']))
+    return result
+
+
+def detections_to_columns(detections, binary: bool = False) -> Dict:
+    """
+    Compact columnar form of detections for the non-JSON result encodings: one list per field,
+    status as codes indexing status_names and confidences rounded to 4 decimals.
+    With binary, the columns are little-endian int32 / float32 / int8 bytes instead of lists.
+    """
+    if not isinstance(detections, np.ndarray):
+        detections = detections_from_json(detections)
+
+    columns = {'count': len(detections), 'status_names': list(STATUS_NAMES)}
+    if binary:
+        columns['bbox'] = detections['bbox'].astype('<i4').tobytes()
+        columns['confidence'] = detections['confidence'].astype('<f4').tobytes()
+        columns['status'] = detections['status'].astype(np.int8).tobytes()
+    else:
+        columns['bbox'] = detections['bbox'].tolist()
+        columns['confidence'] = np.round(detections['confidence'].astype(np.float64), 4).tolist()
+        columns['status'] = detections['status'].tolist()
+    return columns
+
+
+def result_to_columns(result: Dict, binary: bool = False) -> Dict:
+    """
+    Copy of a result dict with its detections in columnar form
+    """
+    if result.get('detections') is not None:
+        result = dict(result, detections=detections_to_columns(result['detections'], binary))
+    return result
@@ -1,235 +1,504 @@
 import cv2
 import numpy as np
-from ultralytics import YOLO
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import logging
-import requests
 import os
+import threading
+from detections import (
+    CLASS_STATUS, DETECTION_DTYPE, STATUS_NO_HELMET, count_with_helmets, empty_detections, scale_detections
+)
+from stage_timing import stage
+from metrics import CASCADE_AGREEMENT, CASCADE_IMAGES, INFERENCE_BATCH_SIZE
+from inference_backends import class_aware_nms, create_backend, exported_model_path
+from model_registry import ModelRegistry, file_checksum
+from tiling import crop_tiles, merge_tile_predictions, plan_tiles
+from annotation import draw_detections
+from image_decoding import REDUCED_DECODE_FLAGS, image_dimensions, oversize_decode_factor, reduced_decode_factor
+from memory_budget import acquire_buffer, release_buffer
+from roi import RegionOfInterest
+from config import *
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class HelmetDetector:
-    def __init__(self, model_path: str = None, confidence_threshold: float = 0.25, iou_threshold: float = 0.4):
+    def __init__(self, model_path: str = None, confidence_threshold: float = 0.25, iou_threshold: float = 0.4,
+                 inference_backend: str = 'torch', int8: bool = False):
         """
-        Initialize the helmet detector with specialized PPE detection model only
+        Initialize the helmet detector with specialized PPE detection model only.
+        inference_backend selects the runtime: 'torch', 'onnx' or 'openvino'.
         """
         self.confidence_threshold = confidence_threshold
         self.iou_threshold = iou_threshold
-        
-        # Use only specialized helmet detection model
-        self.helmet_model_path = './models/helmet_detection.pt'
+        # The predictors are not thread-safe; video analysis runs on its own thread next to image batches
+        self.inference_lock = threading.Lock()
+        # Model input size override (None = the backend's size) for callers that pass none per call
+        self.image_size = None
         
         # Load specialized PPE model
         try:
-            self.setup_helmet_model()
-            self.helmet_model = YOLO(self.helmet_model_path)
-            logger.info(f"Successfully loaded specialized PPE model from {self.helmet_model_path}")
+            # Weights come verified from the local model registry; nothing is downloaded at startup
+            self.helmet_model_path, weights_checksum = self.resolve_model(inference_backend, int8)
+            self.backend = create_backend(inference_backend, self.helmet_model_path, int8)
+            if weights_checksum is not None and self.backend.model_file == self.helmet_model_path:
+                self.model_checksum = weights_checksum
+            else:
+                self.model_checksum = self.compute_checksum(self.backend.model_file)
+
+            # Lookup table from class id to helmet status code (-1 for classes that are not people)
+            self.class_status = np.full(max(self.backend.names) + 1, -1, dtype=np.int8)
+            for class_id, class_name in self.backend.names.items():
+                self.class_status[class_id] = CLASS_STATUS.get(class_name, -1)
+
+            # Cascade screening model (None screens with the main model at a smaller input size)
+            self.cascade = CASCADE_MODE
+            self.screening_backend = None
+            self.screening_checksum = None
+            if self.cascade and CASCADE_SCREENING_MODEL:
+                self.screening_backend = self.load_screening_backend(inference_backend, int8)
+            self.cascade_stats = {'screened': 0, 'escalated': 0, 'agreed': 0}
+            logger.info(f"Successfully loaded specialized PPE model from {self.backend.model_file} ({inference_backend} backend)")
             logger.info(f"Using confidence threshold: {self.confidence_threshold}, IOU threshold: {self.iou_threshold}")
             
         except Exception as e:
             logger.error(f"Failed to load specialized PPE model: {e}")
             raise
 
-    def setup_helmet_model(self):
+    def resolve_model(self, inference_backend: str, int8: bool) -> Tuple[str, Optional[str]]:
         """
-        Download specialized helmet detection model if it doesn't exist
+        Locate the pinned PPE weights in the model registry and verify their checksum.
+        Returns the weights path and checksum (None when not verified).
         """
-        if not os.path.exists(self.helmet_model_path):
-            logger.info("Downloading specialized helmet detection model...")
-            try:
-                # Download specialized PPE detection model
-                model_url = "https://github.com/snehilsanyal/Construction-Site-Safety-PPE-Detection/raw/main/models/best.pt"
-                logger.info("Downloading specialized PPE detection model from GitHub...")
-                
-                response = requests.get(model_url, stream=True)
-                if response.status_code == 200:
-                    with open(self.helmet_model_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    logger.info("Specialized PPE detection model downloaded successfully!")
-                else:
-                    raise Exception(f"Failed to download PPE model, status code: {response.status_code}")
-                    
-            except Exception as e:
-                logger.error(f"Failed to download specialized PPE model: {e}")
-                raise Exception("Could not download required PPE detection model")
+        if not os.path.exists(MODEL_REGISTRY_PATH):
+            if not os.path.exists(HELMET_MODEL_PATH):
+                raise FileNotFoundError(f"No model registry at {MODEL_REGISTRY_PATH} and no weights at {HELMET_MODEL_PATH}")
+            logger.warning(f"No model registry at {MODEL_REGISTRY_PATH}, using unverified weights {HELMET_MODEL_PATH}")
+            return HELMET_MODEL_PATH, None
 
-    def preprocess_image(self, image_path: str) -> np.ndarray:
+        registry = ModelRegistry(MODEL_REGISTRY_PATH)
+        model_path = registry.model_path(MODEL_NAME, MODEL_VERSION)
+
+        # Torch-free images may ship only the exported graph
+        if inference_backend != 'torch' and not os.path.exists(model_path) and \
+                os.path.exists(exported_model_path(model_path, inference_backend, int8)):
+            return model_path, None
+
+        model_path, checksum = registry.resolve(MODEL_NAME, MODEL_VERSION)
+        logger.info(f"Using model {MODEL_NAME} version {MODEL_VERSION} ({checksum[:12]})")
+        return model_path, checksum
+
+    def load_screening_backend(self, inference_backend: str, int8: bool):
         """
-        Preprocess the image for detection
+        Load the cascade screening model given as registry 'name:version'. Its classes must match the main model's.
+        """
+        name, _, version = CASCADE_SCREENING_MODEL.partition(':')
+        model_path, _ = ModelRegistry(MODEL_REGISTRY_PATH).resolve(name, version or MODEL_VERSION)
+        backend = create_backend(inference_backend, model_path, int8)
+        if backend.names != self.backend.names:
+            raise ValueError(f"Screening model {CASCADE_SCREENING_MODEL} has different classes from the main model")
+        self.screening_checksum = self.compute_checksum(backend.model_file)
+        logger.info(f"Loaded cascade screening model {CASCADE_SCREENING_MODEL} from {backend.model_file}")
+        return backend
+
+    def configure_threads(self, threads: int) -> None:
+        """
+        Set the number of threads the inference runtime may use
+        """
+        self.backend.configure_threads(threads)
+        if self.screening_backend is not None:
+            self.screening_backend.configure_threads(threads)
+
+    def warmup(self, batch_sizes: List[int], image_sizes: List[int] = None) -> None:
+        """
+        Run inference on synthetic images so lazy graph initialization and allocations
+        happen before the first real request. Not recorded in stage metrics.
         """
-        image = cv2.imread(image_path)
+        image = np.full((INFERENCE_IMAGE_SIZE, INFERENCE_IMAGE_SIZE, 3), 114, dtype=np.uint8)
+        for image_size in sorted(set(image_sizes or [None]), key=lambda size: size or 0):
+            for batch_size in sorted(set(batch_sizes)):
+                self.backend.predict([image] * batch_size, self.confidence_threshold, self.iou_threshold, image_size)
+        if self.cascade:
+            for batch_size in sorted(set(batch_sizes)):
+                self.screening_predictor().predict([image] * batch_size, self.confidence_threshold, self.iou_threshold,
+                                                   CASCADE_SCREENING_IMAGE_SIZE)
+        logger.info(f"Warmed up inference for batch sizes {sorted(set(batch_sizes))}")
+
+    def compute_checksum(self, path: str) -> str:
+        """
+        SHA-256 of a model weights file, used to tie cached results to the exact model
+        """
+        return file_checksum(path)
+
+    def load_image(self, image_path: str) -> np.ndarray:
+        """
+        Decode an image file into a BGR array
+        """
+        with stage('decode'):
+            image = cv2.imread(image_path)
         if image is None:
             raise ValueError(f"Could not load image from {image_path}")
-        
+        return image
+
+    def decode_image(self, image_data) -> np.ndarray:
+        """
+        Decode encoded image bytes (bytes, bytearray or memoryview) into a BGR array
+        """
+        with stage('decode'):
+            image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode image data")
+        return image
+
+    def decode_image_scaled(self, image_data) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Decode encoded image bytes, directly at 1/2, 1/4 or 1/8 size when a JPEG is much larger
+        than the model needs or than MAX_IMAGE_PIXELS. Returns the BGR array and the (x, y) scale
+        from decoded to original coordinates, or None when decoded at full size.
+        """
+        # Oversized images are rejected or downscaled before anything is allocated for them
+        factor = max(oversize_decode_factor(image_data), reduced_decode_factor(image_data))
+        if factor == 1:
+            return self.decode_image(image_data), None
+
+        with stage('decode'):
+            image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), REDUCED_DECODE_FLAGS[factor])
+        if image is None:
+            raise ValueError("Could not decode image data")
+
+        width, height = image_dimensions(image_data)
+        decoded_height, decoded_width = image.shape[:2]
+        # EXIF orientation may have rotated the decoded image relative to the frame header
+        if (decoded_width > decoded_height) != (width > height):
+            width, height = height, width
+
+        return image, np.array([width / decoded_width, height / decoded_height], dtype=np.float32)
+
+    def encode_image(self, image: np.ndarray, extension: str = '.jpg') -> memoryview:
+        """
+        Encode a BGR array into image bytes in the format given by the file extension.
+        Returns a read-only view of the encoder's buffer rather than a copy.
+        """
+        with stage('encode'):
+            success, encoded = cv2.imencode(extension or '.jpg', image)
+        if not success:
+            raise ValueError(f"Could not encode image as {extension}")
+        return memoryview(encoded).toreadonly()
+
+    def load_image_scaled(self, image_path: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Load an image file, at reduced size when it is a large JPEG (see decode_image_scaled)
+        """
+        try:
+            with open(image_path, 'rb') as f:
+                image_data = f.read()
+        except OSError as e:
+            raise ValueError(f"Could not load image from {image_path}: {e}")
+        return self.decode_image_scaled(image_data)
+
+    def save_image(self, image: np.ndarray, output_path: str) -> None:
+        """
+        Write a BGR array to an image file
+        """
+        with stage('encode'):
+            written = cv2.imwrite(output_path, image)
+        if not written:
+            raise ValueError(f"Could not write image to {output_path}")
+
+    def preprocess_image(self, image_path: str) -> np.ndarray:
+        """
+        Preprocess the image for detection
+        """
+        return self.to_model_input(self.load_image(image_path))
+
+    def to_model_input(self, image: np.ndarray) -> np.ndarray:
+        """
+        Convert a decoded BGR image into the model input, in a buffer from the buffer pool
+        """
         # Convert BGR to RGB for YOLO
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        return image_rgb
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=acquire_buffer(image.shape))
 
-    def detect_with_ppe_model(self, image: np.ndarray) -> List[Dict]:
+    def detect_with_ppe_model(self, image: np.ndarray) -> np.ndarray:
         """
         Detect people and helmets using specialized PPE model
         """
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images: List[np.ndarray], image_size: Optional[int] = None) -> List[np.ndarray]:
+        """
+        Detect people and helmets on several images with a single batched forward pass,
+        at the given model input size (default: self.image_size).
+        Images above TILE_PIXEL_THRESHOLD pixels are detected tile by tile in the same batch.
+        In cascade mode only images the screening model is unsure about reach the full model.
+        """
+        image_size = self.image_size if image_size is None else image_size
         try:
-            results = self.helmet_model(image, conf=self.confidence_threshold, iou=self.iou_threshold)
-            
-            people_with_helmets = []
-            people_without_helmets = []
-            other_detections = []
-            all_raw_detections = []
-            
-            for result in results:
-                boxes = result.boxes
-                if boxes is not None:
-                    for i, box in enumerate(boxes):
-                        class_id = int(box.cls[0].cpu().numpy())
-                        class_name = self.helmet_model.names[class_id]
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        confidence = box.conf[0].cpu().numpy()
-                        
-                        detection = {
-                            'bbox': [int(x1), int(y1), int(x2), int(y2)],
-                            'confidence': float(confidence),
-                            'class_id': class_id,
-                            'class_name': class_name
-                        }
-                        
-                        all_raw_detections.append(detection)
-                        
-                        # Categorize detections
-                        if class_name == 'Hardhat':
-                            detection['helmet_status'] = 'wearing_helmet'
-                            people_with_helmets.append(detection)
-                        elif class_name == 'NO-Hardhat':
-                            detection['helmet_status'] = 'no_helmet'
-                            people_without_helmets.append(detection)
-                        else:
-                            # Other safety equipment or objects
-                            detection['helmet_status'] = 'other'
-                            other_detections.append(detection)
-            
-            # Debug logging
-            logger.info(f"Raw detections found: {len(all_raw_detections)}")
-            for det in all_raw_detections:
-                logger.info(f"  - {det['class_name']}: confidence={det['confidence']:.3f}")
-            
-            all_detections = people_with_helmets + people_without_helmets
-            logger.info(f"PPE Detection Results: {len(people_with_helmets)} with helmets, {len(people_without_helmets)} without helmets, {len(other_detections)} other objects")
-            
-            return all_detections
-            
+            with self.inference_lock:
+                if self.cascade:
+                    batch_data = self.detect_cascade(images, image_size)
+                else:
+                    with stage('inference'):
+                        batch_data = self.predict_images(self.backend, images, self.confidence_threshold, image_size)
+            with stage('postprocess'):
+                return [self.build_detections(data) for data in batch_data]
+
         except Exception as e:
             logger.error(f"PPE detection failed: {e}")
             raise
 
-    def analyze_helmet_compliance(self, detections: List[Dict]) -> List[Dict]:
+    def predict_images(self, backend, images: List[np.ndarray], confidence_threshold: float,
+                       image_size: Optional[int]) -> List[np.ndarray]:
         """
-        Analyze helmet compliance using PPE detection results
+        Run a backend on a batch of images and return the (N, 6) predictions of each image
         """
-        results = []
-        
-        for detection in detections:
-            x1, y1, x2, y2 = detection['bbox']
-            width = x2 - x1
-            height = y2 - y1
-            
-            # Determine helmet status
-            has_helmet = detection['helmet_status'] == 'wearing_helmet'
-            
-            result = {
-                'bbox': [x1, y1, width, height],
-                'confidence': detection['confidence'],
-                'has_helmet': has_helmet,
-                'helmet_confidence': detection['confidence'] if has_helmet else 0.0,
-                'status': detection['helmet_status'],
-                'detection_method': 'specialized_ppe_model'
-            }
-            results.append(result)
-        
-        return results
+        if not images:
+            return []
+
+        # Large images are split into overlapping tiles; all tiles of all images form one batch
+        tile_plans = [plan_tiles(image.shape) for image in images]
+        inputs = [tile for image, tiles in zip(images, tile_plans) for tile in crop_tiles(image, tiles)]
+
+        INFERENCE_BATCH_SIZE.observe(len(inputs))
+        tile_data = backend.predict(inputs, confidence_threshold, self.iou_threshold, image_size)
 
-    def draw_annotations(self, image_path: str, analysis_results: List[Dict], output_path: str) -> None:
+        batch_data = []
+        start = 0
+        for image, tiles in zip(images, tile_plans):
+            batch_data.append(merge_tile_predictions(
+                tile_data[start:start + len(tiles)], tiles, image.shape, confidence_threshold, self.iou_threshold
+            ))
+            start += len(tiles)
+        return batch_data
+
+    def screening_predictor(self):
+        return self.screening_backend if self.screening_backend is not None else self.backend
+
+    def detect_cascade(self, images: List[np.ndarray], image_size: Optional[int]) -> List[np.ndarray]:
         """
-        Draw bounding boxes and annotations on the image
+        Screen every image with the fast model, below the confidence threshold by CASCADE_UNCERTAIN_BAND,
+        and escalate images with an uncertain person or any violation to the full model
         """
-        image = cv2.imread(image_path)
-        
-        for result in analysis_results:
-            # Convert bbox from [x, y, width, height] to [x1, y1, x2, y2] for drawing
-            x, y, width, height = result['bbox']
-            x1, y1, x2, y2 = x, y, x + width, y + height
-            
-            # Choose color based on helmet status
-            if result['has_helmet']:
-                color = (0, 255, 0)  # Green for wearing helmet
-                label = f"Helmet ({result['helmet_confidence']:.2f})"
-            else:
-                color = (0, 0, 255)  # Red for no helmet
-                label = "No Helmet"
-            
-            # Draw bounding box
-            cv2.rectangle(image, (x1, y1), (x2, y2), color, 3)
-            
-            # Draw label
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 0.7
-            thickness = 2
-            (text_width, text_height), baseline = cv2.getTextSize(label, font, font_scale, thickness)
-            
-            # Draw background for text
-            cv2.rectangle(image, (x1, y1 - text_height - baseline - 10), 
-                         (x1 + text_width, y1), color, -1)
-            
-            # Draw text
-            cv2.putText(image, label, (x1, y1 - baseline - 5), 
-                       font, font_scale, (255, 255, 255), thickness)
-        
+        screening_threshold = max(self.confidence_threshold - CASCADE_UNCERTAIN_BAND, 0.01)
+        with stage('screening'):
+            screened = self.predict_images(self.screening_predictor(), images, screening_threshold,
+                                           CASCADE_SCREENING_IMAGE_SIZE)
+
+        escalated = [index for index, data in enumerate(screened) if self.needs_escalation(data)]
+        with stage('inference'):
+            full = self.predict_images(self.backend, [images[index] for index in escalated],
+                                       self.confidence_threshold, image_size)
+
+        # Images the screening model is sure about keep its confident detections
+        batch_data = [data[data[:, 4] >= self.confidence_threshold] for data in screened]
+        for index, data in zip(escalated, full):
+            self.record_agreement(batch_data[index], data)
+            batch_data[index] = self.merge_cascade(data, batch_data[index], images[index].shape)
+
+        self.record_escalations(len(images), len(escalated))
+        return batch_data
+
+    def needs_escalation(self, data: np.ndarray) -> bool:
+        """
+        Whether screening predictions hold a person near the confidence threshold or a person without a helmet
+        """
+        statuses = self.class_status[data[:, 5].astype(np.intp)]
+        uncertain = (statuses >= 0) & (data[:, 4] < self.confidence_threshold + CASCADE_UNCERTAIN_BAND)
+        return bool(np.any(uncertain | (statuses == STATUS_NO_HELMET)))
+
+    def merge_cascade(self, full: np.ndarray, screened: np.ndarray, image_shape) -> np.ndarray:
+        """
+        Full-model predictions plus confident screening detections the full model did not find
+        """
+        confident = screened[screened[:, 4] >= self.confidence_threshold + CASCADE_UNCERTAIN_BAND]
+        if not len(confident):
+            return full
+
+        merged = np.concatenate([full, confident])
+        # The full model wins ties, so equal boxes keep its coordinates
+        priority = merged[:, 4] + np.r_[np.ones(len(full)), np.zeros(len(confident))]
+        height, width = image_shape[:2]
+        indices = class_aware_nms(merged[:, :4], priority, merged[:, 5].astype(np.intp), 0.0, self.iou_threshold,
+                                  class_offset=max(height, width) + 1)
+        return merged[indices]
+
+    def record_agreement(self, screened: np.ndarray, full: np.ndarray) -> None:
+        """
+        Count whether screening and full model found the same people and violations on an escalated image
+        """
+        screened_statuses = self.class_status[screened[:, 5].astype(np.intp)]
+        full_statuses = self.class_status[full[:, 5].astype(np.intp)]
+        agreed = (np.count_nonzero(screened_statuses >= 0) == np.count_nonzero(full_statuses >= 0) and
+                  np.count_nonzero(screened_statuses == STATUS_NO_HELMET) == np.count_nonzero(full_statuses == STATUS_NO_HELMET))
+        CASCADE_AGREEMENT.labels('true' if agreed else 'false').inc()
+        self.cascade_stats['agreed'] += int(agreed)
+
+    def record_escalations(self, screened: int, escalated: int) -> None:
+        CASCADE_IMAGES.labels('true').inc(escalated)
+        CASCADE_IMAGES.labels('false').inc(screened - escalated)
+
+        stats = self.cascade_stats
+        before = stats['screened']
+        stats['screened'] += screened
+        stats['escalated'] += escalated
+        if stats['screened'] // CASCADE_REPORT_INTERVAL > before // CASCADE_REPORT_INTERVAL:
+            logger.info(f"Cascade: {stats['escalated'] / stats['screened']:.1%} of {stats['screened']} images escalated, "
+                        f"screening agreed with the full model on {stats['agreed'] / max(stats['escalated'], 1):.1%} of them")
+
+    def build_detections(self, data: np.ndarray) -> np.ndarray:
+        """
+        Turn the (N, 6) x1, y1, x2, y2, confidence, class_id rows of one image into a
+        detection array: people with helmets first, then people without, other classes dropped
+        """
+        statuses = self.class_status[data[:, 5].astype(np.intp)]
+        people = np.flatnonzero(statuses >= 0)
+        people = people[np.argsort(statuses[people], kind='stable')]
+
+        detections = np.empty(len(people), dtype=DETECTION_DTYPE)
+        xyxy = data[people, :4].astype(np.int32)
+        detections['bbox'][:, :2] = xyxy[:, :2]
+        detections['bbox'][:, 2:] = xyxy[:, 2:] - xyxy[:, :2]
+        detections['confidence'] = data[people, 4]
+        detections['status'] = statuses[people]
+
+        with_helmets = count_with_helmets(detections)
+        logger.debug(f"PPE Detection Results: {with_helmets} with helmets, {len(people) - with_helmets} without helmets, {len(data) - len(people)} other objects")
+
+        return detections
+
+    def draw_annotations(self, image_path: str, detections: np.ndarray, output_path: str) -> None:
+        """
+        Draw bounding boxes and annotations on the image file
+        """
+        image = self.annotate_image(self.load_image(image_path), detections)
+
         # Save annotated image
         cv2.imwrite(output_path, image)
         logger.info(f"Annotated image saved to {output_path}")
 
+    def annotate_image(self, image: np.ndarray, detections: np.ndarray, scale: np.ndarray = None) -> np.ndarray:
+        """
+        Draw bounding boxes and annotations in place on a decoded BGR image.
+        scale maps the image to the coordinates of the detections when it was decoded at reduced size.
+        """
+        with stage('annotate'):
+            return draw_detections(image, detections, scale)
+
     def process_image(self, image_path: str, output_path: str) -> Dict:
         """
         Main processing pipeline using only specialized PPE model
         """
+        return self.process_images([image_path], [output_path])[0]
+
+    def process_images(self, image_paths: List[str], output_paths: List[str]) -> List[Dict]:
+        """
+        Process several image files with one batched inference call.
+        Each image is decoded once and the same array is used for inference and drawing.
+        """
+        processing_results: List[Dict] = [None] * len(image_paths)
+        images = []
+        scales = []
+        batch_indices = []
+
+        # Load images
+        for index, image_path in enumerate(image_paths):
+            try:
+                image, scale = self.load_image_scaled(image_path)
+                images.append(image)
+                scales.append(scale)
+                batch_indices.append(index)
+            except Exception as e:
+                logger.error(f"Error processing image: {e}")
+                processing_results[index] = self.failed_result(e)
+
+        for index, image, scale, processing_result in zip(batch_indices, images, scales, self.analyze_images(images, scales)):
+            if processing_result['success']:
+                try:
+                    # Draw annotations on the already decoded image
+                    self.annotate_image(image, processing_result['detections'], scale)
+                    self.save_image(image, output_paths[index])
+                    logger.info(f"Annotated image saved to {output_paths[index]}")
+                except Exception as e:
+                    logger.error(f"Error processing image: {e}")
+                    processing_result = self.failed_result(e)
+            processing_results[index] = processing_result
+
+        return processing_results
+
+    def analyze_images(self, images: List[np.ndarray], scales: List[Optional[np.ndarray]] = None,
+                       regions: List[Optional[RegionOfInterest]] = None, image_size: Optional[int] = None) -> List[Dict]:
+        """
+        Run batched detection and compliance analysis on decoded BGR images at the given model input size.
+        Detections of images decoded at reduced size are mapped back to original coordinates with their scale.
+        Images with a region of interest are cropped to it before inference and only people inside it count.
+        """
+        if not images:
+            return []
+
+        windows = [None] * len(images)
+        if regions is not None:
+            windows = [
+                None if region is None else region.crop_window(image.shape, None if scales is None else scales[index])
+                for index, (image, region) in enumerate(zip(images, regions))
+            ]
+            images = [image if window is None else image[window[1]:window[3], window[0]:window[2]]
+                      for image, window in zip(images, windows)]
+
+        model_inputs = []
         try:
-            # Load and preprocess image
-            image = self.preprocess_image(image_path)
-            
-            # Use specialized PPE detection model
-            detections = self.detect_with_ppe_model(image)
-            
-            # Analyze helmet compliance
-            analysis_results = self.analyze_helmet_compliance(detections)
-            
-            logger.info(f"Analyzed {len(analysis_results)} people for helmet compliance")
-            
-            # Draw annotations
-            self.draw_annotations(image_path, analysis_results, output_path)
-            
-            # Compile results
-            total_people = len(analysis_results)
-            people_with_helmets = sum(1 for r in analysis_results if r['has_helmet'])
-            
-            processing_result = {
-                'success': True,
-                'total_people': total_people,
-                'people_with_helmets': people_with_helmets,
-                'compliance_rate': people_with_helmets / total_people if total_people > 0 else 0,
-                'detections': analysis_results
-            }
-            
-            logger.info(f"Processing complete: {people_with_helmets}/{total_people} people wearing helmets")
-            return processing_result
-            
+            # Use specialized PPE detection model on the whole batch
+            model_inputs = [self.to_model_input(image) for image in images]
+            batch_detections = self.detect_batch(model_inputs, image_size)
         except Exception as e:
             logger.error(f"Error processing image: {e}")
-            return {
-                'success': False,
-                'error': str(e),
-                'total_people': 0,
-                'people_with_helmets': 0,
-                'compliance_rate': 0,
-                'detections': []
-            } 
\ No newline at end of file
+            return [self.failed_result(e) for _ in images]
+        finally:
+            for model_input in model_inputs:
+                release_buffer(model_input)
+
+        # Crop offsets are in decoded pixels, so they are added before scaling
+        for detections, window in zip(batch_detections, windows):
+            if window is not None:
+                detections['bbox'][:, :2] += window[:2]
+
+        if scales is not None:
+            batch_detections = [
+                detections if scale is None else scale_detections(detections, scale)
+                for detections, scale in zip(batch_detections, scales)
+            ]
+
+        if regions is not None:
+            batch_detections = [
+                detections if region is None else region.filter(detections)
+                for detections, region in zip(batch_detections, regions)
+            ]
+
+        return [self.compile_result(detections) for detections in batch_detections]
+
+    def compile_result(self, detections: np.ndarray) -> Dict:
+        """
+        Compile the processing result for one image
+        """
+        total_people = len(detections)
+        people_with_helmets = count_with_helmets(detections)
+
+        logger.info(f"Processing complete: {people_with_helmets}/{total_people} people wearing helmets")
+
+        return {
+            'success': True,
+            'total_people': total_people,
+            'people_with_helmets': people_with_helmets,
+            'compliance_rate': people_with_helmets / total_people if total_people > 0 else 0,
+            'detections': detections
+        }
+
+    def failed_result(self, error: Exception) -> Dict:
+        """
+        Build the processing result returned when an image could not be processed
+        """
+        return {
+            'success': False,
+            'error': str(error),
+            'total_people': 0,
+            'people_with_helmets': 0,
+            'compliance_rate': 0,
+            'detections': empty_detections()
+        }
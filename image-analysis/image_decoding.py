@@ -0,0 +1,119 @@
+import struct
+from typing import Optional, Tuple
+import cv2
+from tiling import plan_tiles
+from config import *
+
+# imdecode flags decoding a JPEG directly at 1/2, 1/4 or 1/8 size with libjpeg DCT scaling
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# Start-of-frame markers carrying the image dimensions (C4, C8 and CC are other segment types)
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def jpeg_dimensions(data) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) from the frame header of JPEG bytes, or None if the data is not a JPEG
+    """
+    data = memoryview(data)
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+
+        # Fill bytes and standalone markers carry no length
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+
+        length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if marker in SOF_MARKERS:
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        if marker == 0xDA:
+            # Start of scan without a frame header
+            return None
+        offset += 2 + length
+
+    return None
+
+
+def png_dimensions(data) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) from the IHDR chunk of PNG bytes, or None if the data is not a PNG
+    """
+    data = memoryview(data)
+    if len(data) < 24 or data[:8] != PNG_SIGNATURE or data[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', data[16:24])
+    return width, height
+
+
+def image_dimensions(data) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) of JPEG or PNG bytes read from the header, or None for other data
+    """
+    return jpeg_dimensions(data) or png_dimensions(data)
+
+
+def oversize_decode_factor(data) -> int:
+    """
+    DCT scale factor (1, 2, 4 or 8) needed to decode an image within MAX_IMAGE_PIXELS.
+    Raises ValueError for an oversized image that is not a JPEG, does not fit even at 1/8 size,
+    or when OVERSIZE_IMAGE_POLICY is 'reject'.
+    """
+    if not MAX_IMAGE_PIXELS:
+        return 1
+
+    dimensions = image_dimensions(data)
+    if dimensions is None:
+        # Other formats are limited by OpenCV itself (OPENCV_IO_MAX_IMAGE_PIXELS)
+        return 1
+
+    width, height = dimensions
+    if width * height <= MAX_IMAGE_PIXELS:
+        return 1
+
+    if OVERSIZE_IMAGE_POLICY == 'downscale' and jpeg_dimensions(data) is not None:
+        for factor in (2, 4, 8):
+            if -(-width // factor) * -(-height // factor) <= MAX_IMAGE_PIXELS:
+                return factor
+
+    raise ValueError(f"Image of {width}x{height} pixels exceeds the limit of {MAX_IMAGE_PIXELS} pixels")
+
+
+def reduced_decode_factor(data) -> int:
+    """
+    Largest DCT scale factor (1, 2, 4 or 8) that keeps the longer side of a JPEG at or above
+    REDUCED_DECODE_MIN_SIDE. Images detected in tiles are always decoded at full size.
+    """
+    if not REDUCED_DECODE_MIN_SIDE:
+        return 1
+
+    dimensions = jpeg_dimensions(data)
+    if dimensions is None:
+        return 1
+
+    width, height = dimensions
+    if len(plan_tiles((height, width))) > 1:
+        return 1
+
+    for factor in (8, 4, 2):
+        if max(width, height) / factor >= REDUCED_DECODE_MIN_SIDE:
+            return factor
+    return 1
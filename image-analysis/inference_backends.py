@@ -0,0 +1,288 @@
+import os
+import json
+import logging
+from typing import Dict, List, Tuple
+import cv2
+import numpy as np
+from memory_budget import acquire_buffer, release_buffer
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Maximum detections kept per image, same as the ultralytics predictor
+MAX_DETECTIONS = 300
+# Class offset applied to boxes so a single NMS call never suppresses across classes
+NMS_CLASS_OFFSET = 7680
+
+
+def exported_model_path(model_path: str, backend: str, int8: bool = False) -> str:
+    """
+    Location of the exported artifact for a weights file and backend
+    """
+    base = os.path.splitext(os.path.basename(model_path))[0]
+    suffix = '_int8' if int8 else ''
+
+    if backend == 'onnx':
+        return os.path.join(EXPORTED_MODEL_DIR, f"{base}{suffix}.onnx")
+    if backend == 'openvino':
+        return os.path.join(EXPORTED_MODEL_DIR, f"{base}{suffix}_openvino_model", f"{base}.xml")
+
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+
+def class_names_path(model_path: str) -> str:
+    """
+    Location of the class names sidecar written at export time
+    """
+    base = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(EXPORTED_MODEL_DIR, f"{base}.names.json")
+
+
+def letterbox(image: np.ndarray, size: int) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    Resize keeping aspect ratio and pad to a size x size square.
+    Returns the padded image, the resize ratio and the (left, top) padding.
+    The padded image comes from the buffer pool; release it when done.
+    """
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+
+    resized = None
+    if (new_width, new_height) != (width, height):
+        resized = cv2.resize(image, (new_width, new_height), dst=acquire_buffer((new_height, new_width, image.shape[2])),
+                             interpolation=cv2.INTER_LINEAR)
+        image = resized
+
+    pad_width = (size - new_width) / 2
+    pad_height = (size - new_height) / 2
+    top, bottom = int(round(pad_height - 0.1)), int(round(pad_height + 0.1))
+    left, right = int(round(pad_width - 0.1)), int(round(pad_width + 0.1))
+
+    padded = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                                dst=acquire_buffer((size, size, image.shape[2])), value=(114, 114, 114))
+    if resized is not None:
+        release_buffer(resized)
+    return padded, ratio, (left, top)
+
+
+def make_input_blob(image: np.ndarray, size: int, blob: np.ndarray = None) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    Build the NCHW float input for one image, written into blob (3, size, size) when given.
+    Channels are swapped the same way the ultralytics predictor swaps numpy inputs.
+    """
+    padded, ratio, padding = letterbox(image, size)
+    if blob is None:
+        blob = np.empty((3, size, size), dtype=np.float32)
+    blob[...] = padded[..., ::-1].transpose(2, 0, 1)
+    blob *= 1.0 / 255.0
+    release_buffer(padded)
+    return blob, ratio, padding
+
+
+def class_aware_nms(boxes: np.ndarray, confidences: np.ndarray, class_ids: np.ndarray, conf: float, iou: float,
+                    class_offset: float = NMS_CLASS_OFFSET) -> np.ndarray:
+    """
+    Indices of the x1, y1, x2, y2 boxes kept by per-class NMS, highest confidence first.
+    class_offset must exceed the largest coordinate so boxes of different classes never overlap.
+    """
+    offset_boxes = boxes + (class_ids * class_offset)[:, None]
+    nms_boxes = np.column_stack([offset_boxes[:, :2], offset_boxes[:, 2:] - offset_boxes[:, :2]])
+    indices = np.asarray(cv2.dnn.NMSBoxes(nms_boxes.tolist(), confidences.tolist(), conf, iou), dtype=np.intp).reshape(-1)
+    return indices[np.argsort(-confidences[indices])][:MAX_DETECTIONS]
+
+
+class TorchBackend:
+    def __init__(self, model_path: str):
+        """
+        Run the weights with the PyTorch ultralytics runtime
+        """
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path)
+        self.names: Dict[int, str] = self.model.names
+        self.model_file = model_path
+
+    def predict(self, images: List[np.ndarray], conf: float, iou: float, image_size: int = None) -> List[np.ndarray]:
+        """
+        Returns one (N, 6) float32 array per image with x1, y1, x2, y2, confidence, class_id rows.
+        image_size overrides the model input size.
+        """
+        if image_size:
+            results = self.model(images, conf=conf, iou=iou, imgsz=image_size)
+        else:
+            results = self.model(images, conf=conf, iou=iou)
+        return [
+            result.boxes.data.cpu().numpy() if result.boxes is not None else np.zeros((0, 6), dtype=np.float32)
+            for result in results
+        ]
+
+    def configure_threads(self, threads: int) -> None:
+        """
+        Set the intra-op thread count used for inference
+        """
+        import torch
+
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set once per process; the intra-op count is what matters here
+            pass
+
+
+class ExportedModelBackend:
+    def __init__(self, model_file: str, names: Dict[int, str]):
+        """
+        Shared pre/post-processing for exported YOLO graphs with a dynamic batch dimension
+        and a (batch, 4 + classes, anchors) output
+        """
+        self.model_file = model_file
+        self.names = names
+        self.image_size = INFERENCE_IMAGE_SIZE
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Run the graph on an NCHW batch and return the raw output
+        """
+        raise NotImplementedError
+
+    def predict(self, images: List[np.ndarray], conf: float, iou: float, image_size: int = None) -> List[np.ndarray]:
+        """
+        Returns one (N, 6) float32 array per image with x1, y1, x2, y2, confidence, class_id rows.
+        image_size overrides the input size (the graph is exported with dynamic dimensions).
+        """
+        if not images:
+            return []
+
+        size = image_size or self.image_size
+        # Each input is written straight into its slot of the batch
+        batch = acquire_buffer((len(images), 3, size, size), np.float32)
+        try:
+            _, ratios, paddings = zip(*(make_input_blob(image, size, blob) for image, blob in zip(images, batch)))
+            outputs = self.run(batch)
+        finally:
+            release_buffer(batch)
+
+        return [
+            self.postprocess(output, conf, iou, ratio, padding, image.shape[:2])
+            for output, ratio, padding, image in zip(outputs, ratios, paddings, images)
+        ]
+
+    def postprocess(self, output: np.ndarray, conf: float, iou: float, ratio: float,
+                    padding: Tuple[int, int], image_shape: Tuple[int, int]) -> np.ndarray:
+        """
+        Confidence filter, class-aware NMS and mapping back to original image coordinates
+        """
+        predictions = output.T
+        scores = predictions[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+
+        keep = confidences > conf
+        if not keep.any():
+            return np.zeros((0, 6), dtype=np.float32)
+
+        predictions, class_ids, confidences = predictions[keep], class_ids[keep], confidences[keep]
+
+        # cx, cy, w, h -> x1, y1, x2, y2
+        boxes = np.empty((len(predictions), 4), dtype=np.float32)
+        boxes[:, :2] = predictions[:, :2] - predictions[:, 2:4] / 2
+        boxes[:, 2:] = predictions[:, :2] + predictions[:, 2:4] / 2
+
+        indices = class_aware_nms(boxes, confidences, class_ids, conf, iou)
+
+        boxes = boxes[indices]
+        left, top = padding
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - left) / ratio).clip(0, image_shape[1])
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - top) / ratio).clip(0, image_shape[0])
+
+        return np.column_stack([boxes, confidences[indices], class_ids[indices]]).astype(np.float32)
+
+    def configure_threads(self, threads: int) -> None:
+        """
+        Set the inference thread count
+        """
+        raise NotImplementedError
+
+
+class OnnxRuntimeBackend(ExportedModelBackend):
+    def __init__(self, model_file: str, names: Dict[int, str], threads: int = 0):
+        """
+        Run an exported ONNX graph with ONNX Runtime on CPU
+        """
+        super().__init__(model_file, names)
+        self.configure_threads(threads)
+
+    def configure_threads(self, threads: int) -> None:
+        """
+        (Re)create the session with the given intra-op thread count (0 = runtime default)
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+
+        self.session = ort.InferenceSession(self.model_file, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVinoBackend(ExportedModelBackend):
+    def __init__(self, model_file: str, names: Dict[int, str], threads: int = 0):
+        """
+        Run an exported OpenVINO IR model on CPU
+        """
+        super().__init__(model_file, names)
+        self.configure_threads(threads)
+
+    def configure_threads(self, threads: int) -> None:
+        """
+        (Re)compile the model with the given inference thread count (0 = runtime default)
+        """
+        import openvino as ov
+
+        core = ov.Core()
+        config = {'INFERENCE_NUM_THREADS': threads} if threads else {}
+        self.compiled_model = core.compile_model(core.read_model(self.model_file), 'CPU', config)
+        self.output = self.compiled_model.output(0)
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        return self.compiled_model(batch)[self.output]
+
+
+def load_class_names(model_path: str) -> Dict[int, str]:
+    """
+    Read the class names written next to the exported artifacts
+    """
+    with open(class_names_path(model_path)) as f:
+        return {int(class_id): name for class_id, name in json.load(f).items()}
+
+
+def create_backend(backend: str, model_path: str, int8: bool = False):
+    """
+    Create the configured inference backend, exporting the weights on first use
+    """
+    if backend == 'torch':
+        return TorchBackend(model_path)
+
+    model_file = exported_model_path(model_path, backend, int8)
+    if not os.path.exists(model_file):
+        logger.info(f"No exported {backend} model at {model_file}, exporting from {model_path}")
+        from model_export import export_model
+        export_model(model_path, backend, int8, CALIBRATION_IMAGE_DIR)
+
+    names = load_class_names(model_path)
+    logger.info(f"Loading {backend} model from {model_file}")
+
+    if backend == 'onnx':
+        return OnnxRuntimeBackend(model_file, names, INFERENCE_THREADS)
+    if backend == 'openvino':
+        return OpenVinoBackend(model_file, names, INFERENCE_THREADS)
+
+    raise ValueError(f"Unknown inference backend: {backend}")
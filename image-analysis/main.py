@@ -1,25 +1,84 @@
 import os
+import time
 import logging
 import signal
 import sys
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from startup import PROCESS_START, StartupTimer, clear_ready, mark_ready
+from typing import Dict, List, Optional, Union
+from urllib.parse import quote
+import numpy as np
 from helmet_detector import HelmetDetector
 from message_handler import MessageHandler
 from storage_service import StorageService
+from pipeline import ProcessingPipeline
+from shm_pipeline import SharedMemoryPipeline
+from result_cache import ResultCache
+from video_analyzer import VideoAnalyzer
+from detections import detections_from_json, detections_to_json
+from annotation import annotation_object_name
+from stage_timing import stage
+from metrics import QUALITY_TIER, start_metrics_server
+from adaptive_controller import AdaptiveController, quality_tiers
+from memory_budget import MemoryBudget
+from roi import load_regions
+from retry_policy import TransientError, is_transient
+from profiling import RequestProfiler
 from config import *
 from datetime import datetime, UTC
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Time spent importing the service and its runtime dependencies
+IMPORT_SECONDS = time.perf_counter() - PROCESS_START
+
+def create_detector() -> HelmetDetector:
+    """
+    Load the helmet detector with the configured model and thresholds
+    """
+    return HelmetDetector(
+        model_path=MODEL_PATH,
+        confidence_threshold=CONFIDENCE_THRESHOLD,
+        iou_threshold=IOU_THRESHOLD,
+        inference_backend=INFERENCE_BACKEND,
+        int8=INT8_QUANTIZATION
+    )
+
 class HelmetDetectionService:
-    def __init__(self):
+    def __init__(self, detector: HelmetDetector = None, storage_service: StorageService = None,
+                 message_handler: MessageHandler = None, metrics_port: int = METRICS_PORT,
+                 readiness_file: str = READINESS_FILE):
         """
-        Initialize the helmet detection service
+        Initialize the helmet detection service.
+        Already created components can be passed in, e.g. to share one loaded model between services.
+        metrics_port 0 disables the metrics endpoint; readiness_file '' disables the readiness file.
         """
-        self.detector = None
-        self.message_handler = None
-        self.storage_service = None
+        self.metrics_port = metrics_port
+        self.readiness_file = readiness_file
+        self.queue_sampler = None
+        self.detector = detector
+        self.message_handler = message_handler
+        self.storage_service = storage_service
+        self.pipeline = None
+        self.result_cache = None
+        self.video_analyzer = None
+        # Analyzes video requests off the connection thread and the image stages
+        self.video_executor = None
+        # Adaptive quality: tiers from full quality down, and the one in use
+        self.quality_tiers = quality_tiers()
+        self.quality_tier = 0
+        self.adaptive_controller = None
+        # Worker memory budget; once over it the worker stops consuming and exits to be restarted
+        self.memory_budget = MemoryBudget(WORKER_MEMORY_BUDGET_MB * 1024 * 1024) \
+            if MEMORY_BOUNDED and WORKER_MEMORY_BUDGET_MB else None
+        self.recycling = False
+        # Regions of interest by source id
+        self.regions = {}
+        # Profiles the next requests when armed by SIGUSR1 or a control command
+        self.profiler = None
+        self.startup_timer = StartupTimer()
+        self.startup_timer.record('imports', IMPORT_SECONDS)
         self.setup_services()
 
     def setup_services(self):
@@ -28,20 +87,40 @@ class HelmetDetectionService:
         """
         try:
             # Initialize storage service
-            self.storage_service = StorageService()
-            logger.info("Storage service initialized")
+            if self.storage_service is None:
+                with self.startup_timer.phase('storage'):
+                    self.storage_service = StorageService()
+                logger.info("Storage service initialized")
 
-            # Initialize message handler
-            self.message_handler = MessageHandler()
-            logger.info("Message handler initialized")
-            
             # Initialize helmet detector
-            self.detector = HelmetDetector(
-                model_path=MODEL_PATH,
-                confidence_threshold=CONFIDENCE_THRESHOLD,
-                iou_threshold=IOU_THRESHOLD
-            )
-            logger.info("Helmet detector initialized")
+            if self.detector is None:
+                with self.startup_timer.phase('model'):
+                    self.detector = create_detector()
+                logger.info("Helmet detector initialized")
+
+            self.video_analyzer = VideoAnalyzer(self.detector)
+
+            # Initialize result cache
+            if RESULT_CACHE_ENABLED:
+                self.result_cache = ResultCache(self.storage_service, self.detector)
+                logger.info("Result cache initialized")
+
+            if ROI_CONFIG_PATH:
+                self.regions = load_regions(ROI_CONFIG_PATH)
+
+            self.profiler = RequestProfiler(self.storage_service)
+
+            # Fork the shared memory pipeline's processes while this process has no threads or
+            # broker connections yet, so they inherit neither locks held by a thread nor sockets
+            if CONSUMER_MODE == 'shm':
+                self.pipeline = SharedMemoryPipeline(self)
+                self.pipeline.start_processes()
+
+            # Initialize message handler
+            if self.message_handler is None:
+                with self.startup_timer.phase('messaging'):
+                    self.message_handler = MessageHandler()
+                logger.info("Message handler initialized")
 
         except Exception as e:
             logger.error(f"Failed to setup services: {e}")
@@ -51,83 +130,431 @@ class HelmetDetectionService:
         """
         Process image detection request
         """
-        try:
-            image_filename = message.get('image_filename')
-            image_id = message.get('image_id')
-            timestamp = message.get('timestamp')
-            
-            if not image_filename:
-                raise ValueError("No image filename provided in message")
+        return self.process_image_batch([message])[0]
 
-            logger.info(f"Processing image: {image_filename}")
+    def process_image_batch(self, messages: List[Dict]) -> List[Union[Dict, Exception]]:
+        """
+        Process several image detection requests with one batched inference call.
+        Requests that failed transiently get their error instead of a result, to be retried.
+        """
+        self.check_memory_budget()
+        if self.profiler.active:
+            self.profiler.begin()
+        results: List[Dict] = [None] * len(messages)
+        jobs = []
 
-            # Download image from MinIO
-            local_image_path = self.storage_service.download_image(image_filename)
-            
+        for index, message in enumerate(messages):
+            if message.get('video_filename'):
+                results[index] = self.process_video_request(message)
+                continue
+
+            try:
+                job = self.prepare_image_request(message)
+                if job['cached_result'] is not None:
+                    results[index] = self.complete_cached_request(job)
+                else:
+                    jobs.append((index, job))
+
+            except Exception as e:
+                logger.error(f"Error processing image request: {e}")
+                results[index] = self.handle_request_error(message, e)
+
+        # Process images with helmet detection
+        processing_results = self.analyze_jobs([job for _, job in jobs], [job['image'] for _, job in jobs])
+
+        for (index, job), processing_result in zip(jobs, processing_results):
+            try:
+                results[index] = self.complete_image_request(job, processing_result)
+            except Exception as e:
+                logger.error(f"Error processing image request: {e}")
+                results[index] = self.handle_request_error(job['message'], e)
+
+        if self.profiler.active:
+            self.profiler.end(len(messages))
+        return results
+
+    def analyze_jobs(self, jobs: List[Dict], images: List[np.ndarray]) -> List[Dict]:
+        """
+        Analyze the decoded images of jobs, one batch per model input size, as a tier change
+        can leave jobs of two tiers in one batch
+        """
+        results: List[Dict] = [None] * len(jobs)
+        for image_size in dict.fromkeys(job['image_size'] for job in jobs):
+            indices = [index for index, job in enumerate(jobs) if job['image_size'] == image_size]
+            processing_results = self.detector.analyze_images(
+                [images[index] for index in indices], [jobs[index]['image_scale'] for index in indices],
+                [jobs[index]['region'] for index in indices], image_size
+            )
+            for index, processing_result in zip(indices, processing_results):
+                results[index] = processing_result
+        return results
+
+    def can_retry(self, message: Dict) -> bool:
+        """
+        Whether a request has delayed retry attempts left
+        """
+        return DELAYED_RETRIES and message.get('retry_attempt', 1) < RETRY_MAX_ATTEMPTS
+
+    def handle_request_error(self, message: Dict, error: Exception) -> Union[Dict, Exception]:
+        """
+        The error itself when the request should be retried later, else its failed result
+        """
+        if is_transient(error) and self.can_retry(message):
+            return error
+        return self.build_failed_result(message, str(error))
+
+    def prepare_image_request(self, message: Dict) -> Dict:
+        """
+        Validate a request and download its image. The image is decoded unless
+        the result cache or an earlier attempt already holds its result.
+        """
+        job = self.create_image_job(message)
+        image_filename = job['image_filename']
+
+        if message.get('known_result') is not None:
+            # An earlier attempt ran inference but failed to store the annotation
+            job['cached_result'] = message['known_result']
+            if not self.expects_annotated_image(job):
+                return job
+
+        # Download image from MinIO
+        image_data = self.fetch_image_data(image_filename)
+
+        if self.result_cache and job['cached_result'] is None:
+            job['cache_key'] = self.result_cache.make_key(image_data, job['region'], job['image_size'])
+            job['cached_result'] = self.result_cache.get(job['cache_key'])
+            if job['cached_result'] is not None:
+                return job
+
+        # Decode once; the same array is used for inference and annotation
+        job['image'], job['image_scale'] = self.detector.decode_image_scaled(image_data)
+        return job
+
+    def create_image_job(self, message: Dict) -> Dict:
+        """
+        Validate a request and build the job tracking it through processing
+        """
+        image_filename = message.get('image_filename')
+
+        if not image_filename:
+            raise ValueError("No image filename provided in message")
+
+        logger.info(f"Processing image: {image_filename}")
+
+        return {
+            'message': message,
+            'image_filename': image_filename,
             # Generate annotated filename
-            annotated_filename = self.storage_service.generate_annotated_filename(image_filename)
-            annotated_local_path = local_image_path.replace(image_filename, annotated_filename)
-            
-            # Process image with helmet detection
-            processing_result = self.detector.process_image(local_image_path, annotated_local_path)
-            
-            if processing_result['success']:
-                # Upload annotated image to MinIO
-                upload_success = self.storage_service.upload_image(annotated_local_path, annotated_filename)
-                
-                if not upload_success:
-                    logger.warning(f"Failed to upload annotated image: {annotated_filename}")
-
-                # Prepare result message according to integration guide format
-                result = {
-                    'image_id': image_id,
-                    'image_filename': image_filename,
-                    'annotated_filename': annotated_filename if upload_success else None,
-                    'processing_status': 'completed',
+            'annotated_filename': self.storage_service.generate_annotated_filename(image_filename),
+            'quality_tier': self.quality_tier,
+            # Model input size of the tier, fixed with it when the job is created
+            'image_size': self.quality_tiers[self.quality_tier]['image_size'] if self.quality_tier else None,
+            'image': None,
+            # Decoded to original coordinates, None unless decoded at reduced size
+            'image_scale': None,
+            'cache_key': None,
+            'cached_result': None,
+            # Zones of the request's camera, None to analyze the whole image
+            'region': self.regions.get(str(message.get(ROI_SOURCE_FIELD))) if self.regions else None
+        }
+
+    def fetch_image_data(self, image_filename: str):
+        """
+        Download the encoded image bytes from MinIO
+        """
+        with stage('download'):
+            if IN_MEMORY_IO:
+                return self.storage_service.download_image_bytes(image_filename)
+
+            local_image_path = self.storage_service.download_image(image_filename)
+        try:
+            with open(local_image_path, 'rb') as f:
+                return f.read()
+        finally:
+            # Cleanup temporary files
+            self.storage_service.cleanup_temp_file(local_image_path)
+
+    def store_annotated_image(self, image: np.ndarray, annotated_filename: str) -> bool:
+        """
+        Encode an annotated image and upload it to MinIO
+        """
+        if IN_MEMORY_IO:
+            extension = os.path.splitext(annotated_filename)[1]
+            encoded = self.detector.encode_image(image, extension)
+            with stage('upload'):
+                return self.storage_service.upload_image_bytes(encoded, annotated_filename)
+
+        annotated_local_path = self.storage_service.create_temp_path(annotated_filename)
+        try:
+            self.detector.save_image(image, annotated_local_path)
+            with stage('upload'):
+                return self.storage_service.upload_image(annotated_local_path, annotated_filename)
+        finally:
+            # Cleanup temporary files
+            self.storage_service.cleanup_temp_file(annotated_local_path)
+
+    def complete_image_request(self, job: Dict, processing_result: Dict) -> Dict:
+        """
+        Annotate and upload a processed image and build its result message
+        """
+        if not processing_result['success']:
+            # Handle processing failure
+            return self.build_failed_result(job['message'], processing_result.get('error', 'Unknown error'))
+
+        annotated_filename = self.store_annotation_or_retry(job, processing_result)
+
+        if annotated_filename is None and self.expects_annotated_image(job):
+            logger.warning(f"Failed to upload annotated image: {job['annotated_filename']}")
+        elif self.result_cache and job['cache_key'] and job['quality_tier'] == 0:
+            # Only full-quality results are cached
+            self.result_cache.put(job['cache_key'], {
+                'annotated_filename': annotated_filename,
+                'total_people': processing_result['total_people'],
+                'people_with_helmets': processing_result['people_with_helmets'],
+                'compliance_rate': processing_result['compliance_rate'],
+                'detections': detections_to_json(processing_result['detections'])
+            })
+
+        logger.info(f"Completed processing for image: {job['image_filename']}")
+        return self.build_completed_result(job['message'], processing_result, annotated_filename, job['quality_tier'])
+
+    def expects_annotated_image(self, job: Dict) -> bool:
+        """
+        Whether an annotated image is uploaded for a request
+        """
+        return ANNOTATION_MODE == 'eager' and self.quality_tiers[job['quality_tier']]['annotate']
+
+    def store_annotation_or_retry(self, job: Dict, processing_result: Dict) -> Optional[str]:
+        """
+        Store the annotation of a processed image. If a transient storage failure loses it while
+        the request has attempts left, raise TransientError carrying the detection result, so the
+        retry only redoes the annotation instead of inference.
+        """
+        try:
+            annotated_filename = self.store_annotation(job, processing_result['detections'])
+            if annotated_filename is not None or not self.expects_annotated_image(job):
+                return annotated_filename
+            error = None
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            error = e
+
+        if self.can_retry(job['message']):
+            raise TransientError(
+                f"Failed to store annotation for {job['image_filename']}: {error or 'upload failed'}",
+                known_result={
                     'total_people': processing_result['total_people'],
                     'people_with_helmets': processing_result['people_with_helmets'],
                     'compliance_rate': processing_result['compliance_rate'],
-                    'detections': processing_result['detections'],
-                    'timestamp': datetime.now(UTC).isoformat()
+                    'detections': detections_to_json(processing_result['detections']),
+                    'quality_tier': processing_result.get('quality_tier', job['quality_tier'])
                 }
+            )
+        if error is not None:
+            raise error
+        return None
 
-            else:
-                # Handle processing failure
-                result = {
-                    'image_id': image_id,
-                    'image_filename': image_filename,
-                    'annotated_filename': None,
-                    'processing_status': 'failed',
-                    'error': processing_result.get('error', 'Unknown error'),
-                    'total_people': 0,
-                    'people_with_helmets': 0,
-                    'compliance_rate': 0,
-                    'detections': [],
-                    'timestamp': datetime.now(UTC).isoformat()
-                }
+    def store_annotation(self, job: Dict, detections) -> Optional[str]:
+        """
+        Handle the annotated image according to ANNOTATION_MODE and return the annotated filename
+        to publish: eager draws and uploads it now, lazy stores the detections for the render
+        server to draw it on first view, off skips it
+        """
+        if ANNOTATION_MODE == 'off' or not self.quality_tiers[job['quality_tier']]['annotate']:
+            return None
 
-            # Cleanup temporary files
-            self.storage_service.cleanup_temp_file(local_image_path)
-            if os.path.exists(annotated_local_path):
-                self.storage_service.cleanup_temp_file(annotated_local_path)
+        if ANNOTATION_MODE == 'lazy':
+            self.storage_service.put_json(annotation_object_name(job['annotated_filename']), {
+                'image_filename': job['image_filename'],
+                'detections': detections_to_json(detections)
+            })
+            return None
+
+        if 'annotation_uploaded' in job:
+            # Drawn and uploaded by an encoder process (CONSUMER_MODE=shm)
+            return job['annotated_filename'] if job['annotation_uploaded'] else None
 
-            logger.info(f"Completed processing for image: {image_filename}")
-            return result
+        # Draw annotations on the decoded image and upload it to MinIO
+        self.detector.annotate_image(job['image'], detections, job['image_scale'])
+        if not self.store_annotated_image(job['image'], job['annotated_filename']):
+            return None
+        return job['annotated_filename']
 
+    def complete_cached_request(self, job: Dict) -> Dict:
+        """
+        Build the result message for an image whose result was found in the cache
+        """
+        # Cached results are full quality; results of earlier attempts carry their tier
+        cached_result = dict(job['cached_result'], quality_tier=job['cached_result'].get('quality_tier', 0))
+        annotated_filename = cached_result.get('annotated_filename')
+
+        if ANNOTATION_MODE == 'lazy':
+            self.store_annotation_or_retry(job, cached_result)
+            annotated_filename = None
+        elif ANNOTATION_MODE == 'off':
+            annotated_filename = None
+        # Retry of a request whose annotated image was lost; draw it again from the known detections
+        elif job['image'] is not None and not annotated_filename:
+            annotated_filename = self.store_annotation_or_retry(
+                job, dict(cached_result, detections=detections_from_json(cached_result['detections']))
+            )
+        # Give this upload its own annotated object with a server-side copy instead of re-rendering
+        elif annotated_filename and annotated_filename != job['annotated_filename']:
+            if self.storage_service.copy_object(annotated_filename, job['annotated_filename']):
+                annotated_filename = job['annotated_filename']
+
+        logger.info(f"Result cache hit for image: {job['image_filename']}")
+        return self.build_completed_result(
+            job['message'], cached_result, annotated_filename, cached_result['quality_tier']
+        )
+
+    def submit_video_request(self, message: Dict, delivery_tag: int) -> None:
+        """
+        Analyze a video on the video thread, so the connection thread keeps serving heartbeats
+        and image requests meanwhile; the delivery stays unacked until its result is published
+        """
+        # Videos take minutes by design; keep them out of the latency the adaptive controller reacts to
+        self.message_handler.long_running.add(delivery_tag)
+        self.video_executor.submit(self.run_video_request, message, delivery_tag)
+
+    def run_video_request(self, message: Dict, delivery_tag: int) -> None:
+        try:
+            result = self.process_video_request(message)
+        except Exception as e:
+            logger.error(f"Error processing video request: {e}")
+            self.message_handler.fail_threadsafe(delivery_tag, e)
+            return
+        self.message_handler.complete_threadsafe(delivery_tag, result)
+
+    def process_video_request(self, message: Dict) -> Dict:
+        """
+        Stream a video from MinIO and build a result with its per-track compliance events
+        """
+        video_filename = message['video_filename']
+        logger.info(f"Processing video: {video_filename}")
+
+        try:
+            url = self.storage_service.presigned_url(video_filename)
+            events = list(self.video_analyzer.analyze(url, video_filename))
         except Exception as e:
-            logger.error(f"Error processing image request: {e}")
-            return {
-                'image_id': message.get('image_id'),
-                'image_filename': message.get('image_filename'),
-                'annotated_filename': None,
-                'processing_status': 'failed',
-                'error': str(e),
-                'total_people': 0,
-                'people_with_helmets': 0,
-                'compliance_rate': 0,
-                'detections': [],
-                'timestamp': datetime.now(UTC).isoformat()
-            }
+            logger.error(f"Error processing video request: {e}")
+            return self.build_failed_video_result(message, str(e))
+
+        # Every confirmed track ends with a track_ended event carrying its final status
+        tracks = [event for event in events if event['event'] == 'track_ended']
+        people_with_helmets = sum(1 for event in tracks if event['has_helmet'])
+
+        logger.info(f"Completed processing for video: {video_filename}")
+        return {
+            'video_id': message.get('video_id'),
+            'video_filename': video_filename,
+            'processing_status': 'completed',
+            'total_people': len(tracks),
+            'people_with_helmets': people_with_helmets,
+            'compliance_rate': people_with_helmets / len(tracks) if tracks else 0,
+            'events': events,
+            'frames_read': self.video_analyzer.stats['frames_read'],
+            'keyframes': self.video_analyzer.stats['keyframes'],
+            'timestamp': datetime.now(UTC).isoformat()
+        }
+
+    def build_failed_video_result(self, message: Dict, error: str) -> Dict:
+        """
+        Build the result message published when a video request fails
+        """
+        return {
+            'video_id': message.get('video_id'),
+            'video_filename': message.get('video_filename'),
+            'processing_status': 'failed',
+            'error': error,
+            'total_people': 0,
+            'people_with_helmets': 0,
+            'compliance_rate': 0,
+            'events': [],
+            'timestamp': datetime.now(UTC).isoformat()
+        }
+
+    def build_completed_result(self, message: Dict, processing_result: Dict, annotated_filename: str,
+                               quality_tier: int = 0) -> Dict:
+        """
+        Build the result message published for a successfully processed image
+        """
+        # Prepare result message according to integration guide format
+        result = {
+            'image_id': message.get('image_id'),
+            'image_filename': message.get('image_filename'),
+            'annotated_filename': annotated_filename,
+            'processing_status': 'completed',
+            'total_people': processing_result['total_people'],
+            'people_with_helmets': processing_result['people_with_helmets'],
+            'compliance_rate': processing_result['compliance_rate'],
+            'detections': processing_result['detections'],
+            'quality_tier': quality_tier,
+            'timestamp': datetime.now(UTC).isoformat()
+        }
+
+        if ANNOTATION_MODE == 'lazy':
+            # Rendered and cached by render_server.py on first request
+            annotated_name = self.storage_service.generate_annotated_filename(message.get('image_filename'))
+            result['annotation_url'] = f"{RENDER_BASE_URL}/annotated/{quote(annotated_name)}"
+
+        return result
+
+    def build_failed_result(self, message: Dict, error: str) -> Dict:
+        """
+        Build the result message published when an image request fails
+        """
+        return {
+            'image_id': message.get('image_id'),
+            'image_filename': message.get('image_filename'),
+            'annotated_filename': None,
+            'processing_status': 'failed',
+            'error': error,
+            'total_people': 0,
+            'people_with_helmets': 0,
+            'compliance_rate': 0,
+            'detections': [],
+            'timestamp': datetime.now(UTC).isoformat()
+        }
+
+    def check_memory_budget(self) -> None:
+        """
+        Stop taking requests once the worker is over its memory budget. Requests already received
+        are finished or requeued and the worker exits, to be restarted with a fresh heap.
+        Safe to call from any thread.
+        """
+        if self.memory_budget is None or self.recycling or not self.memory_budget.exceeded():
+            return
+        self.recycle("Worker is over its memory budget")
+
+    def recycle(self, reason: str) -> None:
+        """
+        Stop consuming so run() exits with an error and the worker is restarted. Safe to call from any thread.
+        """
+        if self.recycling:
+            return
+        self.recycling = True
+        logger.error(f"{reason}, stopping to restart")
+        self.message_handler.stop_consuming_threadsafe()
+
+    def apply_quality_tier(self, tier: int) -> None:
+        """
+        Switch inference size, annotation and batch size to a quality tier.
+        Size and batch size apply from the next inference call; annotation follows
+        the tier a request was received in.
+        """
+        settings = self.quality_tiers[tier]
+        # Jobs take the tier's image size when created, so batches in flight keep theirs
+        self.quality_tier = tier
+
+        if CONSUMER_MODE == 'batch':
+            self.message_handler.set_batch_size(settings['batch_size'])
+        elif self.pipeline:
+            self.pipeline.batch_size = settings['batch_size']
+
+        QUALITY_TIER.set(tier)
+        logger.info(f"Quality tier {tier}: {settings}")
 
     def run(self):
         """
@@ -143,14 +570,57 @@ class HelmetDetectionService:
         
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
+        # Profile the next PROFILE_REQUESTS requests
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.profiler.arm())
 
         try:
+            # Serve metrics and sample the request queue backlog
+            if self.metrics_port:
+                with self.startup_timer.phase('metrics'):
+                    self.queue_sampler = start_metrics_server(
+                        self.metrics_port, MessageHandler.connection_parameters(), REQUEST_QUEUES
+                    )
+
+            # Initialize the inference runtime before the first real request
+            with self.startup_timer.phase('warmup'):
+                if ADAPTIVE_QUALITY:
+                    self.detector.warmup(
+                        [1] if CONSUMER_MODE == 'single' else [1] + [tier['batch_size'] for tier in self.quality_tiers],
+                        [tier['image_size'] for tier in self.quality_tiers]
+                    )
+                else:
+                    self.detector.warmup([1] if CONSUMER_MODE == 'single' else [1, BATCH_SIZE])
+
             # Setup message consumer
-            self.message_handler.setup_consumer(self.process_image_request)
+            with self.startup_timer.phase('consumer'):
+                self.video_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='video')
+
+                if CONSUMER_MODE == 'batch':
+                    self.message_handler.setup_batch_consumer(self.process_image_batch, self.submit_video_request)
+                elif CONSUMER_MODE in ('pipeline', 'shm'):
+                    if self.pipeline is None:
+                        self.pipeline = ProcessingPipeline(self)
+                    self.pipeline.start()
+                    self.message_handler.setup_async_consumer(self.pipeline.submit, self.pipeline.prefetch_count)
+                else:
+                    self.message_handler.setup_consumer(self.process_image_request, self.submit_video_request)
+
+                if CONTROL_COMMANDS:
+                    self.message_handler.setup_control_consumer(self.profiler.handle_command)
             
+            # Adapt quality to the backlog and in-flight latency
+            if ADAPTIVE_QUALITY:
+                self.adaptive_controller = AdaptiveController(self, self.queue_sampler)
+                self.adaptive_controller.start()
+
             # Start consuming messages
+            mark_ready(self.readiness_file, self.startup_timer)
             logger.info("Service ready - waiting for image processing requests...")
             self.message_handler.start_consuming()
+
+            if self.recycling:
+                self.shutdown()
+                sys.exit(1)
             
         except Exception as e:
             logger.error(f"Error running service: {e}")
@@ -162,7 +632,21 @@ class HelmetDetectionService:
         Graceful shutdown of the service
         """
         logger.info("Shutting down Helmet Detection Service...")
+        clear_ready(self.readiness_file)
         
+        if self.pipeline:
+            self.pipeline.stop()
+
+        if self.video_executor:
+            # An unfinished video stays unacked and is redelivered
+            self.video_executor.shutdown(wait=False, cancel_futures=True)
+
+        if self.adaptive_controller:
+            self.adaptive_controller.stop()
+
+        if self.queue_sampler:
+            self.queue_sampler.stop()
+
         if self.message_handler:
             self.message_handler.close()
 
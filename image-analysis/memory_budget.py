@@ -0,0 +1,136 @@
+import os
+import gc
+import ctypes
+import logging
+import resource
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pooled buffers are allocated in whole multiples of this, so similar image sizes share buffers
+POOL_ALIGNMENT = 1024 * 1024
+# A free buffer is reused for a request at most this many times its size
+POOL_MAX_WASTE = 2
+
+
+class BufferPool:
+    def __init__(self, max_bytes: int):
+        """
+        Free list of flat byte buffers handed out as arrays of any shape and dtype.
+        Released buffers are kept for reuse while the pool holds at most max_bytes.
+        """
+        self.max_bytes = max_bytes
+        self.free: List[np.ndarray] = []
+        self.free_bytes = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """
+        Uninitialized array backed by the smallest free buffer that fits, or a new one
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+
+        buffer = None
+        with self.lock:
+            for index, candidate in enumerate(self.free):
+                if nbytes <= candidate.nbytes <= max(nbytes * POOL_MAX_WASTE, POOL_ALIGNMENT):
+                    buffer = self.free.pop(index)
+                    self.free_bytes -= buffer.nbytes
+                    break
+
+        if buffer is None:
+            buffer = np.empty(-(-max(nbytes, 1) // POOL_ALIGNMENT) * POOL_ALIGNMENT, dtype=np.uint8)
+
+        return buffer[:nbytes].view(dtype).reshape(shape)
+
+    def release(self, array: np.ndarray) -> None:
+        """
+        Return an array from acquire to the pool. It must not be used afterwards.
+        """
+        buffer = array.base if array.base is not None else array
+        with self.lock:
+            if self.free_bytes + buffer.nbytes > self.max_bytes:
+                return
+            # Kept sorted by size so acquire finds the best fit first
+            index = 0
+            while index < len(self.free) and self.free[index].nbytes < buffer.nbytes:
+                index += 1
+            self.free.insert(index, buffer)
+            self.free_bytes += buffer.nbytes
+
+    def clear(self) -> None:
+        with self.lock:
+            self.free = []
+            self.free_bytes = 0
+
+
+# Process-wide pool, only in memory-bounded mode
+buffer_pool: Optional[BufferPool] = BufferPool(BUFFER_POOL_MB * 1024 * 1024) if MEMORY_BOUNDED else None
+
+
+def acquire_buffer(shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+    """
+    Array from the buffer pool, or a newly allocated one when the pool is disabled
+    """
+    if buffer_pool is None:
+        return np.empty(shape, dtype=dtype)
+    return buffer_pool.acquire(shape, dtype)
+
+
+def release_buffer(array: np.ndarray) -> None:
+    if buffer_pool is not None:
+        buffer_pool.release(array)
+
+
+def rss_bytes() -> int:
+    """
+    Current resident set size of this process
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak rather than current outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def trim_memory() -> None:
+    """
+    Drop pooled buffers, collect garbage and return freed heap pages to the system
+    """
+    if buffer_pool is not None:
+        buffer_pool.clear()
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        # Not glibc
+        pass
+
+
+class MemoryBudget:
+    def __init__(self, budget_bytes: int):
+        """
+        Resident memory limit of one worker process
+        """
+        self.budget_bytes = budget_bytes
+
+    def exceeded(self) -> bool:
+        """
+        Whether the worker is over budget, even after trimming memory
+        """
+        if rss_bytes() <= self.budget_bytes:
+            return False
+
+        trim_memory()
+        rss = rss_bytes()
+        if rss <= self.budget_bytes:
+            return False
+
+        logger.error(f"Worker uses {rss / 2 ** 20:.0f} MiB, over its budget of {self.budget_bytes / 2 ** 20:.0f} MiB")
+        return True
@@ -1,31 +1,95 @@
 import json
+import time
+import functools
+import threading
 import pika
 import logging
-from typing import Dict, Callable
+from typing import Dict, List, Optional, Tuple, Union, Callable
 from datetime import datetime
+from detections import result_to_columns, result_to_json
+from stage_timing import stage
+from metrics import IN_FLIGHT, MESSAGES, REQUEST_LATENCY
+from confirming_publisher import ConfirmingPublisher
+from retry_policy import (
+    ATTEMPT_HEADER, ERROR_HEADER, ERROR_HEADER_LENGTH, KNOWN_RESULT_HEADER, ORIGIN_QUEUE_HEADER, RESULT_HEADER,
+    TransientError, delay_queue_name, is_transient, retry_delay_ms
+)
 from config import *
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# AMQP content_type of each result encoding, so consumers can tell the formats apart
+RESULT_CONTENT_TYPES = {
+    'json': 'application/json',
+    'columnar': 'application/vnd.helmet-detection.columnar+json',
+    'msgpack': 'application/vnd.helmet-detection.columnar+msgpack'
+}
+
+
+def lane_prefetch(capacity: int) -> Tuple[int, int]:
+    """
+    Split a capacity of at least two between the fast and bulk lanes by weight, at least one each,
+    so that the lanes together never hold more than the capacity
+    """
+    fast = round(capacity * FAST_LANE_WEIGHT / (FAST_LANE_WEIGHT + BULK_LANE_WEIGHT))
+    fast = min(capacity - 1, max(1, fast))
+    return fast, capacity - fast
+
+
 class MessageHandler:
     def __init__(self):
         self.connection = None
         self.channel = None
+        # Receive time of unacknowledged deliveries, used for metrics
+        self.received_at: Dict[int, float] = {}
+        # Deliveries expected to take long (videos), left out of the adaptive controller's latency signal
+        self.long_running = set()
+        # Source queue, properties and body of unacknowledged deliveries, for delayed retries
+        self.deliveries: Dict[int, Tuple[str, pika.BasicProperties, bytes]] = {}
+        self.delay_queues = set()
+        # Outcomes of deliveries whose results the broker has confirmed but are not yet acked
+        self.confirmed: Dict[int, str] = {}
+        self.newly_confirmed: List[Tuple[int, str]] = []
+        self.confirm_lock = threading.Lock()
+        self.ack_scheduled = False
+        self.publisher = None
+        # Deliveries gathered per batch by the batch consumer; adjustable at runtime with set_batch_size
+        self.batch_size = BATCH_SIZE
+        self.result_encoding = RESULT_ENCODING
+        if self.result_encoding not in RESULT_CONTENT_TYPES:
+            raise ValueError(f"Unknown result encoding: {self.result_encoding}")
+        if self.result_encoding == 'msgpack':
+            # Fail at startup rather than on the first result
+            import msgpack
+        # Message callback and consumer tags (with their queues) of the running consumers
+        self.on_message = None
+        self.consumer_tags: List[str] = []
+        self.consumer_queues: Dict[str, str] = {}
         self.connect()
 
+        if PUBLISHER_CONFIRMS:
+            self.publisher = ConfirmingPublisher(self.connection_parameters())
+            self.publisher.start()
+
+    @staticmethod
+    def connection_parameters() -> pika.ConnectionParameters:
+        """
+        RabbitMQ connection parameters from configuration
+        """
+        credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+        return pika.ConnectionParameters(
+            host=RABBITMQ_HOST,
+            port=RABBITMQ_PORT,
+            credentials=credentials
+        )
+
     def connect(self):
         """
         Establish connection to RabbitMQ and setup exchanges
         """
         try:
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-            parameters = pika.ConnectionParameters(
-                host=RABBITMQ_HOST,
-                port=RABBITMQ_PORT,
-                credentials=credentials
-            )
-            self.connection = pika.BlockingConnection(parameters)
+            self.connection = pika.BlockingConnection(self.connection_parameters())
             self.channel = self.connection.channel()
             
             # Declare exchanges as topic exchanges with durable=True
@@ -43,12 +107,18 @@ class MessageHandler:
             # Declare our own queue for consuming processing requests
             self.channel.queue_declare(queue=AI_SERVICE_QUEUE, durable=True)
             
-            # Bind our queue to the image processing exchange with catch-all routing key
-            self.channel.queue_bind(
-                exchange=IMAGE_PROCESSING_EXCHANGE,
-                queue=AI_SERVICE_QUEUE,
-                routing_key=ROUTING_KEY
-            )
+            if PRIORITY_LANES:
+                self.bind_priority_lanes()
+            else:
+                # Bind our queue to the image processing exchange with catch-all routing key
+                self.channel.queue_bind(
+                    exchange=IMAGE_PROCESSING_EXCHANGE,
+                    queue=AI_SERVICE_QUEUE,
+                    routing_key=ROUTING_KEY
+                )
+
+            if DELAYED_RETRIES:
+                self.channel.queue_declare(queue=DEAD_LETTER_QUEUE, durable=True)
             
             logger.info("Successfully connected to RabbitMQ and setup exchanges")
             
@@ -56,69 +126,512 @@ class MessageHandler:
             logger.error(f"Failed to connect to RabbitMQ: {e}")
             raise
 
+    def bind_priority_lanes(self) -> None:
+        """
+        Route interactive requests to the fast queue and bulk requests to AI_SERVICE_QUEUE
+        """
+        self.channel.queue_declare(queue=FAST_QUEUE, durable=True)
+        self.channel.queue_bind(
+            exchange=IMAGE_PROCESSING_EXCHANGE,
+            queue=FAST_QUEUE,
+            routing_key=FAST_ROUTING_KEY
+        )
+        self.channel.queue_bind(
+            exchange=IMAGE_PROCESSING_EXCHANGE,
+            queue=AI_SERVICE_QUEUE,
+            routing_key=BULK_ROUTING_KEY
+        )
+        # Drop the catch-all binding, which would also copy every interactive request into the bulk lane
+        self.channel.queue_unbind(
+            exchange=IMAGE_PROCESSING_EXCHANGE,
+            queue=AI_SERVICE_QUEUE,
+            routing_key=ROUTING_KEY
+        )
+        logger.info(f"Priority lanes: '{FAST_ROUTING_KEY}' to {FAST_QUEUE}, '{BULK_ROUTING_KEY}' to {AI_SERVICE_QUEUE}")
+
+    def build_result_message(self, result: Dict) -> Tuple[bytes, pika.BasicProperties]:
+        """
+        Serialize a processing result wrapped in the required data field, in RESULT_ENCODING
+        """
+        properties = pika.BasicProperties(
+            content_type=RESULT_CONTENT_TYPES[self.result_encoding],
+            delivery_mode=2,  # Make message persistent
+        )
+
+        if self.result_encoding == 'msgpack':
+            import msgpack
+
+            return msgpack.packb({"data": result_to_columns(result, binary=True)}), properties
+
+        if self.result_encoding == 'columnar':
+            message = {"data": result_to_columns(result)}
+        else:
+            message = {"data": result_to_json(result)}
+        return json.dumps(message, separators=(',', ':')).encode('utf-8'), properties
+
+    @staticmethod
+    def parse_result_message(body: bytes, content_type: str = None) -> Dict:
+        """
+        Deserialize a result message in any of the result encodings
+        """
+        if content_type == RESULT_CONTENT_TYPES['msgpack']:
+            import msgpack
+
+            return msgpack.unpackb(body)
+        return json.loads(body)
+
     def publish_result(self, result: Dict) -> None:
         """
         Publish processing result to the results exchange with proper message wrapping
         """
         try:
-            # Wrap payload in required format with data field
-            message = {
-                "data": result
-            }
-            
-            message_body = json.dumps(message)
-            self.channel.basic_publish(
-                exchange=PROCESSING_RESULTS_EXCHANGE,
-                routing_key=ROUTING_KEY,  # Using catch-all routing key
-                body=message_body,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Make message persistent
+            with stage('publish'):
+                message_body, properties = self.build_result_message(result)
+                self.channel.basic_publish(
+                    exchange=PROCESSING_RESULTS_EXCHANGE,
+                    routing_key=ROUTING_KEY,  # Using catch-all routing key
+                    body=message_body,
+                    properties=properties
                 )
-            )
             logger.info(f"Published result for image: {result.get('image_filename', 'unknown')}")
             
         except Exception as e:
             logger.error(f"Failed to publish result: {e}")
             raise
 
-    def setup_consumer(self, processing_callback: Callable[[Dict], Dict]) -> None:
+    def parse_message(self, body: bytes) -> Dict:
+        """
+        Parse message body and extract the data payload
+        """
+        message = json.loads(body.decode('utf-8'))
+
+        # Extract the actual payload from the data field
+        if 'data' in message:
+            return message['data']
+
+        # Fallback for messages not wrapped in data field
+        return message
+
+    def parse_delivery(self, properties: pika.BasicProperties, body: bytes) -> Dict:
         """
-        Setup consumer for image processing requests
+        Parse a request and attach what earlier attempts recorded in its headers:
+        retry_attempt, and known_result when its detections are already known
+        """
+        data = self.parse_message(body)
+        headers = properties.headers or {}
+        if ATTEMPT_HEADER in headers:
+            data['retry_attempt'] = int(headers[ATTEMPT_HEADER])
+        if KNOWN_RESULT_HEADER in headers:
+            data['known_result'] = json.loads(headers[KNOWN_RESULT_HEADER])
+        return data
+
+    def setup_consumer(self, processing_callback: Callable[[Dict], Dict],
+                       video_callback: Callable[[Dict, int], None] = None) -> None:
+        """
+        Setup consumer for image processing requests. Video requests, if video_callback is given,
+        are handed to it with their delivery tag and completed later with complete_threadsafe.
         """
         def process_message(ch, method, properties, body):
             try:
-                # Parse message and extract data payload
-                message = json.loads(body.decode('utf-8'))
-                
-                # Extract the actual payload from the data field
-                if 'data' in message:
-                    data = message['data']
-                else:
-                    # Fallback for messages not wrapped in data field
-                    data = message
-                
+                data = self.parse_delivery(properties, body)
+
                 logger.info(f"Received processing request: {data}")
+
+                if video_callback and data.get('video_filename'):
+                    video_callback(data, method.delivery_tag)
+                    return
                 
                 # Process the image
                 result = processing_callback(data)
                 
-                # Publish result
-                self.publish_result(result)
-                
-                # Acknowledge message
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                
             except Exception as e:
                 logger.error(f"Error processing message: {e}")
-                # Reject message and requeue
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                # Reject message and retry it later
+                self.requeue(method.delivery_tag, e)
+                return
+
+            # Publish result and acknowledge message
+            self.complete_delivery(method.delivery_tag, result)
 
         # Configure consumer
-        self.channel.basic_qos(prefetch_count=1)
-        self.channel.basic_consume(
-            queue=AI_SERVICE_QUEUE,
-            on_message_callback=process_message
+        self.consume(process_message, 1)
+
+    def setup_batch_consumer(self, batch_callback: Callable[[List[Dict]], List[Dict]],
+                             video_callback: Callable[[Dict, int], None] = None) -> None:
+        """
+        Setup consumer that gathers up to batch_size deliveries, or whatever arrived
+        within BATCH_TIMEOUT_MS, and processes them with a single callback invocation.
+        Video requests go to video_callback as in setup_consumer.
+        """
+        pending: List[Tuple[int, pika.BasicProperties, bytes]] = []
+        flush_timer = None
+
+        def flush_batch():
+            nonlocal flush_timer
+            if flush_timer is not None:
+                self.connection.remove_timeout(flush_timer)
+                flush_timer = None
+
+            batch = pending[:]
+            pending.clear()
+
+            delivery_tags = []
+            messages = []
+            for delivery_tag, properties, body in batch:
+                try:
+                    message = self.parse_delivery(properties, body)
+                    if video_callback and message.get('video_filename'):
+                        video_callback(message, delivery_tag)
+                        continue
+                    messages.append(message)
+                    delivery_tags.append(delivery_tag)
+                except Exception as e:
+                    logger.error(f"Error processing message: {e}")
+                    self.requeue(delivery_tag, e)
+
+            if not messages:
+                return
+
+            logger.info(f"Processing batch of {len(messages)} requests")
+
+            try:
+                results = batch_callback(messages)
+            except Exception as e:
+                logger.error(f"Error processing batch: {e}")
+                for delivery_tag in delivery_tags:
+                    self.requeue(delivery_tag, e)
+                return
+
+            for delivery_tag, result in zip(delivery_tags, results):
+                self.complete_delivery(delivery_tag, result)
+
+        def process_message(ch, method, properties, body):
+            nonlocal flush_timer
+            pending.append((method.delivery_tag, properties, body))
+
+            if len(pending) >= self.batch_size:
+                flush_batch()
+            elif flush_timer is None:
+                flush_timer = self.connection.call_later(BATCH_TIMEOUT_MS / 1000.0, flush_batch)
+
+        # Prefetch a full batch so the broker can fill it without waiting for acks
+        self.consume(process_message, self.batch_size)
+
+    def setup_async_consumer(self, submit_callback: Callable[[Dict, int], None], prefetch_count: int) -> None:
+        """
+        Setup consumer that hands parsed requests to worker threads.
+        Workers report back with complete_threadsafe / fail_threadsafe.
+        """
+        def process_message(ch, method, properties, body):
+            try:
+                data = self.parse_delivery(properties, body)
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+                self.requeue(method.delivery_tag, e)
+                return
+
+            logger.info(f"Received processing request: {data}")
+            submit_callback(data, method.delivery_tag)
+
+        # Configure consumer
+        self.consume(process_message, prefetch_count)
+
+    def setup_control_consumer(self, command_callback: Callable[[Dict], None]) -> None:
+        """
+        Receive commands broadcast to every worker on the control exchange, through an exclusive
+        queue of this connection. Commands are not acknowledged and are lost while no worker runs.
+        """
+        try:
+            self.channel.exchange_declare(exchange=CONTROL_EXCHANGE, exchange_type='fanout', durable=True)
+            queue = self.channel.queue_declare(queue='', exclusive=True).method.queue
+            self.channel.queue_bind(exchange=CONTROL_EXCHANGE, queue=queue)
+        except Exception as e:
+            logger.error(f"Failed to set up control consumer: {e}")
+            raise
+
+        def process_command(ch, method, properties, body):
+            try:
+                command_callback(json.loads(body))
+            except Exception as e:
+                logger.error(f"Error handling control command: {e}")
+
+        self.channel.basic_consume(queue=queue, on_message_callback=process_command, auto_ack=True)
+
+    def consume(self, on_message: Callable, capacity: int) -> None:
+        """
+        Start consuming requests with up to capacity unacknowledged deliveries.
+        With priority lanes the capacity is split by weight between a consumer on each lane,
+        so bulk deliveries never hold the slots reserved for interactive ones.
+        """
+        self.on_message = on_message
+
+        def dispatch(ch, method, properties, body):
+            self.track_delivery(method, properties, body)
+            headers = properties.headers or {}
+            if RESULT_HEADER in headers:
+                # Processed by an earlier attempt whose publish failed; only the publish is left
+                self.complete_delivery(method.delivery_tag, json.loads(headers[RESULT_HEADER]))
+                return
+            on_message(ch, method, properties, body)
+
+        shared_prefetch = 0
+        if PRIORITY_LANES and capacity >= 2:
+            lanes = list(zip(REQUEST_QUEUES, lane_prefetch(capacity)))
+        elif PRIORITY_LANES:
+            # Too small to split: both lanes share one channel-wide limit instead of one slot each
+            lanes = [(queue, 0) for queue in REQUEST_QUEUES]
+            shared_prefetch = capacity
+        else:
+            lanes = [(AI_SERVICE_QUEUE, capacity)]
+
+        # Channel-wide limit across all consumers (0 = none), reset on every restart
+        self.channel.basic_qos(prefetch_count=shared_prefetch, global_qos=True)
+        for queue, prefetch_count in lanes:
+            # The prefetch limit applies to each consumer started after it is set
+            self.channel.basic_qos(prefetch_count=prefetch_count)
+            consumer_tag = self.channel.basic_consume(queue=queue, on_message_callback=dispatch)
+            self.consumer_tags.append(consumer_tag)
+            self.consumer_queues[consumer_tag] = queue
+
+    def restart_consumers(self, capacity: int) -> None:
+        """
+        Restart the consumers with a new capacity, since a consumer's prefetch limit is fixed
+        when it starts. Deliveries already received stay unacked on the channel and are settled
+        as usual. Must run on the connection thread.
+        """
+        for consumer_tag in self.consumer_tags:
+            self.channel.basic_cancel(consumer_tag)
+        self.consumer_tags = []
+        self.consumer_queues = {}
+        self.consume(self.on_message, capacity)
+
+    def set_batch_size(self, batch_size: int) -> None:
+        """
+        Change the batch consumer's batch size and prefetch window. Safe to call from any thread.
+        """
+        if batch_size == self.batch_size:
+            return
+        self.batch_size = batch_size
+        if self.on_message is not None:
+            self.connection.add_callback_threadsafe(
+                functools.partial(self.restart_consumers, batch_size)
+            )
+
+    def complete_delivery(self, delivery_tag: int, result: Union[Dict, Exception]) -> None:
+        """
+        Publish the result for a delivery and acknowledge it, retrying on failure.
+        A transient processing error in place of the result schedules a retry.
+        With publisher confirms the ack is deferred until the broker confirms the result.
+        Must run on the connection thread.
+        """
+        if isinstance(result, Exception):
+            self.requeue(delivery_tag, result)
+            return
+
+        outcome = 'processed' if result.get('processing_status') == 'completed' else 'failed'
+
+        if self.publisher is not None:
+            self.publish_confirmed(delivery_tag, result, outcome)
+            return
+
+        try:
+            self.publish_result(result)
+            self.channel.basic_ack(delivery_tag=delivery_tag)
+            self.release_delivery(delivery_tag, outcome)
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            self.requeue(delivery_tag, e, result)
+
+    def publish_confirmed(self, delivery_tag: int, result: Dict, outcome: str) -> None:
+        """
+        Hand a result to the confirming publisher; the delivery is settled on confirm
+        """
+        try:
+            with stage('publish'):
+                message_body, properties = self.build_result_message(result)
+                self.publisher.publish(
+                    PROCESSING_RESULTS_EXCHANGE,
+                    ROUTING_KEY,
+                    message_body,
+                    properties,
+                    functools.partial(self.on_result_confirmed, delivery_tag, outcome, result)
+                )
+        except Exception as e:
+            logger.error(f"Failed to publish result: {e}")
+            self.requeue(delivery_tag, e, result)
+
+    def on_result_confirmed(self, delivery_tag: int, outcome: str, result: Dict, confirmed: bool) -> None:
+        """
+        Publisher thread callback; settles the delivery on the connection thread
+        """
+        if not confirmed:
+            logger.error(f"Result for delivery {delivery_tag} was not confirmed by the broker, retrying")
+            self.fail_threadsafe(delivery_tag, TransientError("Result was not confirmed by the broker"), result)
+            return
+
+        # Confirms usually arrive several at a time; collect them and ack in one callback
+        with self.confirm_lock:
+            self.newly_confirmed.append((delivery_tag, outcome))
+            if self.ack_scheduled:
+                return
+            self.ack_scheduled = True
+        self.connection.add_callback_threadsafe(self.ack_confirmed)
+
+    def ack_confirmed(self) -> None:
+        """
+        Ack deliveries whose results are confirmed. When the oldest unacked deliveries are all
+        confirmed they are acked with a single multiple ack; the rest are acked individually.
+        Must run on the connection thread.
+        """
+        with self.confirm_lock:
+            newly_confirmed = self.newly_confirmed
+            self.newly_confirmed = []
+            self.ack_scheduled = False
+
+        for delivery_tag, outcome in newly_confirmed:
+            if delivery_tag in self.received_at:
+                self.confirmed[delivery_tag] = outcome
+
+        # received_at holds unacked deliveries in delivery tag order
+        prefix = []
+        for delivery_tag in self.received_at:
+            if delivery_tag not in self.confirmed:
+                break
+            prefix.append(delivery_tag)
+
+        try:
+            if len(prefix) > 1:
+                self.channel.basic_ack(delivery_tag=prefix[-1], multiple=True)
+                for delivery_tag in prefix:
+                    self.release_delivery(delivery_tag, self.confirmed.pop(delivery_tag))
+
+            for delivery_tag in list(self.confirmed):
+                self.channel.basic_ack(delivery_tag=delivery_tag)
+                self.release_delivery(delivery_tag, self.confirmed.pop(delivery_tag))
+        except Exception as e:
+            logger.error(f"Failed to acknowledge message: {e}")
+
+    def requeue(self, delivery_tag: int, error: Exception = None, result: Dict = None) -> None:
+        """
+        Settle a delivery that could not be completed. With delayed retries it is republished
+        to a delay queue, or to the dead-letter queue once it is out of attempts, and acked;
+        otherwise, or if that fails, it is rejected and returned to its queue.
+        Must run on the connection thread.
+        """
+        self.confirmed.pop(delivery_tag, None)
+
+        if DELAYED_RETRIES and delivery_tag in self.deliveries:
+            try:
+                outcome = self.schedule_retry(delivery_tag, error, result)
+                self.channel.basic_ack(delivery_tag=delivery_tag)
+                self.release_delivery(delivery_tag, outcome)
+                return
+            except Exception as e:
+                logger.error(f"Failed to schedule retry of delivery {delivery_tag}: {e}")
+
+        self.channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        self.release_delivery(delivery_tag, 'requeued')
+
+    def schedule_retry(self, delivery_tag: int, error: Optional[Exception], result: Optional[Dict]) -> str:
+        """
+        Republish a delivery for its next attempt and return the outcome, 'retried' or 'dead_lettered'.
+        A known result is carried in the headers so the retry skips the work already done.
+        """
+        queue, properties, body = self.deliveries[delivery_tag]
+        headers = dict(properties.headers or {})
+        attempt = int(headers.get(ATTEMPT_HEADER, 1))
+        origin_queue = headers.get(ORIGIN_QUEUE_HEADER, queue)
+
+        headers[ORIGIN_QUEUE_HEADER] = origin_queue
+        headers[ERROR_HEADER] = str(error or "Unknown error")[:ERROR_HEADER_LENGTH]
+        if result is not None:
+            headers[RESULT_HEADER] = json.dumps(result_to_json(result), separators=(',', ':'))
+        elif getattr(error, 'known_result', None) is not None:
+            headers[KNOWN_RESULT_HEADER] = json.dumps(error.known_result, separators=(',', ':'))
+
+        if (error is not None and not is_transient(error)) or attempt >= RETRY_MAX_ATTEMPTS:
+            target_queue = DEAD_LETTER_QUEUE
+            outcome = 'dead_lettered'
+            logger.error(f"Dead-lettering delivery {delivery_tag} after {attempt} attempts: {headers[ERROR_HEADER]}")
+        else:
+            delay_ms = retry_delay_ms(attempt)
+            target_queue = self.declare_delay_queue(origin_queue, delay_ms)
+            headers[ATTEMPT_HEADER] = attempt + 1
+            outcome = 'retried'
+            logger.warning(f"Retrying delivery {delivery_tag} in {delay_ms} ms (attempt {attempt + 1})")
+
+        # Published on the consumer channel before the ack, so a crash in between can only duplicate
+        self.channel.basic_publish(
+            exchange='',
+            routing_key=target_queue,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,
+                content_type=properties.content_type,
+                headers=headers
+            )
         )
+        return outcome
+
+    def declare_delay_queue(self, origin_queue: str, delay_ms: int) -> str:
+        """
+        Queue whose messages return to the origin queue after delay_ms, declared on first use
+        """
+        queue = delay_queue_name(origin_queue, delay_ms)
+        if queue not in self.delay_queues:
+            self.channel.queue_declare(
+                queue=queue,
+                durable=True,
+                arguments={
+                    'x-message-ttl': delay_ms,
+                    'x-dead-letter-exchange': '',
+                    'x-dead-letter-routing-key': origin_queue
+                }
+            )
+            self.delay_queues.add(queue)
+        return queue
+
+    def track_delivery(self, method, properties: pika.BasicProperties, body: bytes) -> None:
+        """
+        Record a received delivery for in-flight and latency metrics and for retries
+        """
+        self.received_at[method.delivery_tag] = time.monotonic()
+        self.deliveries[method.delivery_tag] = (
+            self.consumer_queues.get(method.consumer_tag, AI_SERVICE_QUEUE), properties, body
+        )
+        IN_FLIGHT.inc()
+
+    def release_delivery(self, delivery_tag: int, outcome: str) -> None:
+        """
+        Record that a delivery was acked or rejected
+        """
+        self.deliveries.pop(delivery_tag, None)
+        self.long_running.discard(delivery_tag)
+        received_at = self.received_at.pop(delivery_tag, None)
+        if received_at is not None:
+            IN_FLIGHT.dec()
+            REQUEST_LATENCY.observe(time.monotonic() - received_at)
+        MESSAGES.labels(outcome).inc()
+
+    def complete_threadsafe(self, delivery_tag: int, result: Dict) -> None:
+        """
+        Schedule publish and ack of a delivery on the connection thread from a worker thread
+        """
+        self.connection.add_callback_threadsafe(functools.partial(self.complete_delivery, delivery_tag, result))
+
+    def fail_threadsafe(self, delivery_tag: int, error: Exception = None, result: Dict = None) -> None:
+        """
+        Schedule a retry of a delivery on the connection thread from a worker thread
+        """
+        self.connection.add_callback_threadsafe(
+            functools.partial(self.requeue, delivery_tag, error, result)
+        )
+
+    def stop_consuming_threadsafe(self) -> None:
+        """
+        Cancel the consumers from any thread; start_consuming returns once they are cancelled
+        """
+        self.connection.add_callback_threadsafe(self.channel.stop_consuming)
 
     def start_consuming(self) -> None:
         """
@@ -136,6 +649,8 @@ class MessageHandler:
         """
         Close connection to RabbitMQ
         """
+        if self.publisher is not None:
+            self.publisher.stop()
         if self.connection and not self.connection.is_closed:
             self.connection.close()
             logger.info("RabbitMQ connection closed") 
\ No newline at end of file
@@ -0,0 +1,135 @@
+import logging
+import threading
+from typing import Dict, List
+import pika
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+import stage_timing
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_LATENCY = Histogram(
+    'helmet_detection_stage_seconds',
+    'Duration of each processing stage',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_LATENCY = Histogram(
+    'helmet_detection_request_seconds',
+    'Time from receiving a request to acknowledging it',
+    buckets=LATENCY_BUCKETS
+)
+INFERENCE_BATCH_SIZE = Histogram(
+    'helmet_detection_inference_batch_size',
+    'Images per inference call',
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+MESSAGES = Counter(
+    'helmet_detection_messages_total',
+    'Request messages by outcome (processed, failed, requeued, retried, dead_lettered)',
+    ['outcome']
+)
+IN_FLIGHT = Gauge(
+    'helmet_detection_in_flight_requests',
+    'Requests received and not yet acknowledged'
+)
+QUEUE_BACKLOG = Gauge(
+    'helmet_detection_queue_backlog_messages',
+    'Ready messages in a queue, sampled with a passive queue_declare',
+    ['queue']
+)
+QUEUE_CONSUMERS = Gauge(
+    'helmet_detection_queue_consumers',
+    'Consumers attached to a queue',
+    ['queue']
+)
+
+STARTUP_PHASE = Gauge(
+    'helmet_detection_startup_phase_seconds',
+    'Duration of each startup phase of this process',
+    ['phase']
+)
+READY = Gauge(
+    'helmet_detection_ready',
+    '1 once the model is warmed up and the consumer is ready'
+)
+
+CASCADE_IMAGES = Counter(
+    'helmet_detection_cascade_images_total',
+    'Images screened by the cascade, by whether they were escalated to the full model',
+    ['escalated']
+)
+CASCADE_AGREEMENT = Counter(
+    'helmet_detection_cascade_agreement_total',
+    'Escalated images by whether the screening model agreed with the full model on people and violations',
+    ['agreed']
+)
+
+QUALITY_TIER = Gauge(
+    'helmet_detection_quality_tier',
+    'Current adaptive quality tier (0 = full quality)'
+)
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_LATENCY.labels(stage).observe(seconds)
+
+
+class QueueDepthSampler(threading.Thread):
+    def __init__(self, connection_parameters: pika.ConnectionParameters, queue_names: List[str], interval: float):
+        """
+        Background thread sampling queue backlogs over its own connection,
+        so sampling never touches the consumer's connection thread
+        """
+        super().__init__(name="queue-depth-sampler", daemon=True)
+        self.connection_parameters = connection_parameters
+        self.queue_names = queue_names
+        self.interval = interval
+        self.backlog: Dict[str, int] = {}
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        connection = None
+        channel = None
+
+        while not self.stopped.is_set():
+            try:
+                if connection is None or connection.is_closed:
+                    connection = pika.BlockingConnection(self.connection_parameters)
+                    channel = connection.channel()
+
+                for queue_name in self.queue_names:
+                    frame = channel.queue_declare(queue=queue_name, passive=True)
+                    self.backlog[queue_name] = frame.method.message_count
+                    QUEUE_BACKLOG.labels(queue_name).set(frame.method.message_count)
+                    QUEUE_CONSUMERS.labels(queue_name).set(frame.method.consumer_count)
+
+                # Service heartbeats while waiting for the next sample
+                connection.process_data_events(time_limit=self.interval)
+
+            except Exception as e:
+                logger.warning(f"Failed to sample queue depth: {e}")
+                connection = None
+                self.stopped.wait(self.interval)
+
+        if connection is not None and connection.is_open:
+            connection.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+def start_metrics_server(port: int, connection_parameters: pika.ConnectionParameters, queue_names: List[str]) -> QueueDepthSampler:
+    """
+    Serve metrics on a local HTTP port, record stage timings and start sampling queue depth
+    """
+    start_http_server(port)
+    stage_timing.add_observer(observe_stage)
+
+    sampler = QueueDepthSampler(connection_parameters, queue_names, METRICS_QUEUE_SAMPLE_SECONDS)
+    sampler.start()
+
+    logger.info(f"Metrics available on port {port}")
+    return sampler
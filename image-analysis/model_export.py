@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import glob
+import shutil
+import logging
+import argparse
+from typing import Dict, List
+import cv2
+import numpy as np
+from inference_backends import (
+    TorchBackend, create_backend, exported_model_path, class_names_path, make_input_blob
+)
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def list_images(image_dir: str) -> List[str]:
+    """
+    Image files in a folder, sorted by name
+    """
+    return sorted(
+        path for path in glob.glob(os.path.join(image_dir, '*'))
+        if path.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def load_model_input(path: str) -> np.ndarray:
+    """
+    Load an image the way HelmetDetector prepares model input
+    """
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"Could not load image from {path}")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def calibration_blobs(calibration_dir: str, limit: int = 300) -> List[np.ndarray]:
+    """
+    Preprocessed (1, 3, H, W) inputs for post-training quantization
+    """
+    paths = list_images(calibration_dir)[:limit]
+    if not paths:
+        raise ValueError(f"No calibration images found in {calibration_dir}")
+
+    logger.info(f"Using {len(paths)} calibration images from {calibration_dir}")
+    return [make_input_blob(load_model_input(path), INFERENCE_IMAGE_SIZE)[0][None] for path in paths]
+
+
+def quantize_onnx(model_file: str, output_file: str, calibration_dir: str) -> None:
+    """
+    INT8 static quantization of an ONNX graph with ONNX Runtime
+    """
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = ort.InferenceSession(model_file, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class CalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.inputs = iter({input_name: blob} for blob in calibration_blobs(calibration_dir))
+
+        def get_next(self):
+            return next(self.inputs, None)
+
+    quantize_static(
+        model_file,
+        output_file,
+        CalibrationReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8
+    )
+
+
+def quantize_openvino(model_file: str, output_file: str, calibration_dir: str) -> None:
+    """
+    INT8 post-training quantization of an OpenVINO IR model with NNCF
+    """
+    import nncf
+    import openvino as ov
+
+    model = ov.Core().read_model(model_file)
+    quantized = nncf.quantize(model, nncf.Dataset(calibration_blobs(calibration_dir)), preset=nncf.QuantizationPreset.MIXED)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    ov.save_model(quantized, output_file)
+
+
+def export_model(model_path: str, backend: str, int8: bool = False, calibration_dir: str = None) -> str:
+    """
+    Export PyTorch weights for an inference backend, optionally INT8-quantized.
+    Needs ultralytics/torch; the exported artifacts do not.
+    """
+    from ultralytics import YOLO
+
+    if int8 and not calibration_dir:
+        raise ValueError("INT8 quantization needs a calibration image folder")
+
+    os.makedirs(EXPORTED_MODEL_DIR, exist_ok=True)
+    model = YOLO(model_path)
+
+    with open(class_names_path(model_path), 'w') as f:
+        json.dump({str(class_id): name for class_id, name in model.names.items()}, f)
+
+    fp32_file = exported_model_path(model_path, backend)
+    if not os.path.exists(fp32_file):
+        logger.info(f"Exporting {model_path} to {backend}")
+        exported = model.export(format=backend, dynamic=True, imgsz=INFERENCE_IMAGE_SIZE)
+
+        # ultralytics writes next to the weights; move the artifact into EXPORTED_MODEL_DIR
+        if backend == 'onnx':
+            shutil.move(exported, fp32_file)
+        else:
+            if os.path.exists(os.path.dirname(fp32_file)):
+                shutil.rmtree(os.path.dirname(fp32_file))
+            shutil.move(exported, os.path.dirname(fp32_file))
+
+    if not int8:
+        logger.info(f"Exported model written to {fp32_file}")
+        return fp32_file
+
+    int8_file = exported_model_path(model_path, backend, int8=True)
+    logger.info(f"Quantizing {fp32_file} to INT8")
+    if backend == 'onnx':
+        quantize_onnx(fp32_file, int8_file, calibration_dir)
+    else:
+        quantize_openvino(fp32_file, int8_file, calibration_dir)
+
+    logger.info(f"Quantized model written to {int8_file}")
+    return int8_file
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    IoU of one x1, y1, x2, y2 box against many
+    """
+    top_left = np.maximum(box[:2], boxes[:, :2])
+    bottom_right = np.minimum(box[2:4], boxes[:, 2:4])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=1)
+    area = np.prod(box[2:4] - box[:2])
+    areas = np.prod(boxes[:, 2:4] - boxes[:, :2], axis=1)
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+
+def check_parity(model_path: str, backend: str, int8: bool, image_dir: str,
+                 iou_tolerance: float, confidence_tolerance: float) -> Dict:
+    """
+    Compare detections of an exported backend against the torch backend.
+    A torch detection matches when the exported backend has a box of the same class
+    with IoU >= iou_tolerance and confidence within confidence_tolerance.
+    """
+    paths = list_images(image_dir)
+    if not paths:
+        raise ValueError(f"No images found in {image_dir}")
+
+    reference = TorchBackend(model_path)
+    candidate = create_backend(backend, model_path, int8)
+
+    reference_count = 0
+    candidate_count = 0
+    matched = 0
+    max_confidence_delta = 0.0
+
+    for path in paths:
+        image = load_model_input(path)
+        expected = reference.predict([image], CONFIDENCE_THRESHOLD, IOU_THRESHOLD)[0]
+        actual = candidate.predict([image], CONFIDENCE_THRESHOLD, IOU_THRESHOLD)[0]
+        reference_count += len(expected)
+        candidate_count += len(actual)
+
+        unused = np.ones(len(actual), dtype=bool)
+        for detection in expected:
+            candidates = np.flatnonzero(unused & (actual[:, 5] == detection[5])) if len(actual) else []
+            if len(candidates) == 0:
+                continue
+
+            ious = box_iou(detection, actual[candidates])
+            best = int(np.argmax(ious))
+            confidence_delta = abs(float(actual[candidates[best], 4] - detection[4]))
+            if ious[best] >= iou_tolerance and confidence_delta <= confidence_tolerance:
+                unused[candidates[best]] = False
+                matched += 1
+                max_confidence_delta = max(max_confidence_delta, confidence_delta)
+
+    report = {
+        'images': len(paths),
+        'reference_detections': reference_count,
+        'candidate_detections': candidate_count,
+        'matched': matched,
+        'recall': matched / reference_count if reference_count else 1.0,
+        'precision': matched / candidate_count if candidate_count else 1.0,
+        'max_confidence_delta': max_confidence_delta
+    }
+    logger.info(f"Parity report for {backend}{' int8' if int8 else ''}: {report}")
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export the PPE model for ONNX Runtime / OpenVINO and check parity")
+    parser.add_argument('--backend', choices=['onnx', 'openvino'], default=INFERENCE_BACKEND if INFERENCE_BACKEND != 'torch' else 'onnx')
+    parser.add_argument('--model', default=HELMET_MODEL_PATH)
+    parser.add_argument('--int8', action='store_true', default=INT8_QUANTIZATION)
+    parser.add_argument('--calibration-dir', default=CALIBRATION_IMAGE_DIR)
+    parser.add_argument('--check-parity', metavar='IMAGE_DIR', help="Compare against the torch backend on these images")
+    parser.add_argument('--iou-tolerance', type=float, default=0.9)
+    parser.add_argument('--confidence-tolerance', type=float, default=0.05)
+    parser.add_argument('--min-recall', type=float, default=0.95)
+    args = parser.parse_args()
+
+    export_model(args.model, args.backend, args.int8, args.calibration_dir)
+
+    if args.check_parity:
+        report = check_parity(args.model, args.backend, args.int8, args.check_parity,
+                              args.iou_tolerance, args.confidence_tolerance)
+        if report['recall'] < args.min_recall or report['precision'] < args.min_recall:
+            logger.error("Exported model does not match the torch backend within tolerance")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
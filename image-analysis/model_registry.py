@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+from typing import Dict, Tuple
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def file_checksum(path: str) -> str:
+    """
+    SHA-256 of a file, read in 1 MiB chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, registry_path: str = MODEL_REGISTRY_PATH):
+        """
+        Local manifest of model versions: for every name and version the weights file
+        (relative to the manifest), its source URL and its pinned SHA-256.
+        Resolving a model never touches the network; downloads happen only through fetch.
+        """
+        self.registry_path = registry_path
+        self.model_dir = os.path.dirname(os.path.abspath(registry_path))
+        with open(registry_path) as f:
+            self.models: Dict[str, Dict[str, Dict]] = json.load(f)
+
+    def entry(self, name: str, version: str) -> Dict:
+        try:
+            return self.models[name][version]
+        except KeyError:
+            raise ValueError(f"Model {name} version {version} is not in the registry {self.registry_path}")
+
+    def model_path(self, name: str, version: str) -> str:
+        return os.path.join(self.model_dir, self.entry(name, version)['file'])
+
+    def recorded_checksum_path(self, name: str, version: str) -> str:
+        """
+        Checksum of an unpinned version's file, recorded next to it when first fetched
+        """
+        return f"{self.model_path(name, version)}.sha256"
+
+    def expected_checksum(self, name: str, version: str, checksum: str) -> str:
+        """
+        Checksum a model version's file must have: the pinned one, or for an unpinned version the
+        one recorded when the file was first seen (recording the given checksum if none was)
+        """
+        entry = self.entry(name, version)
+        if entry.get('sha256'):
+            return entry['sha256']
+
+        recorded_path = self.recorded_checksum_path(name, version)
+        if os.path.exists(recorded_path):
+            with open(recorded_path) as f:
+                recorded = f.read().strip()
+        else:
+            recorded = checksum
+            with open(recorded_path, 'w') as f:
+                f.write(f"{checksum}\n")
+        logger.warning(
+            f"Model {name} version {version} has no pinned checksum; using sha256 {recorded} recorded at {recorded_path}. "
+            f"Pin it with `python model_registry.py fetch --pin` and commit {self.registry_path}"
+        )
+        return recorded
+
+    def resolve(self, name: str, version: str) -> Tuple[str, str]:
+        """
+        Path and checksum of a present and intact model version
+        """
+        path = self.model_path(name, version)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Model {name} version {version} is missing at {path}; run `python model_registry.py fetch`")
+
+        checksum = file_checksum(path)
+        expected = self.expected_checksum(name, version, checksum)
+        if checksum != expected:
+            raise ValueError(f"Checksum mismatch for {path}: expected {expected}, found {checksum}")
+
+        return path, checksum
+
+    def fetch(self, name: str, version: str, pin: bool = False) -> str:
+        """
+        Make sure a model version is present locally, downloading it if needed, and verify it.
+        A version without a pinned checksum gets the fetched file's checksum recorded next to it,
+        with a warning, and is only pinned in the registry when pin is set, after the file has been
+        checked by hand; never pin in automated builds.
+        """
+        entry = self.entry(name, version)
+        path = self.model_path(name, version)
+
+        if not os.path.exists(path):
+            self.download(entry['url'], path)
+
+        checksum = file_checksum(path)
+        if not entry.get('sha256') and pin:
+            entry['sha256'] = checksum
+            self.save()
+            logger.warning(f"Pinned {name} version {version} to sha256 {checksum}; commit {self.registry_path} to keep it")
+
+        expected = self.expected_checksum(name, version, checksum)
+        if checksum != expected:
+            os.remove(path)
+            raise ValueError(f"Checksum mismatch for {path}: expected {expected}, found {checksum}; removed")
+
+        logger.info(f"Model {name} version {version} ready at {path}")
+        return path
+
+    def download(self, url: str, path: str) -> None:
+        """
+        Download to a temporary file and move it into place once complete
+        """
+        import requests
+
+        logger.info(f"Downloading {url}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f"{path}.part"
+
+        response = requests.get(url, stream=True, timeout=60)
+        if response.status_code != 200:
+            raise Exception(f"Failed to download {url}, status code: {response.status_code}")
+
+        with open(partial_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+        os.replace(partial_path, path)
+
+    def save(self) -> None:
+        temporary_path = f"{self.registry_path}.tmp"
+        with open(temporary_path, 'w') as f:
+            json.dump(self.models, f, indent=2)
+            f.write('\n')
+        os.replace(temporary_path, self.registry_path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Manage the local model registry")
+    parser.add_argument('command', choices=['fetch', 'verify', 'list'])
+    parser.add_argument('--name', default=MODEL_NAME)
+    parser.add_argument('--version', default=MODEL_VERSION)
+    parser.add_argument('--export', choices=['onnx', 'openvino'], help="Also export the fetched weights for this backend")
+    parser.add_argument('--int8', action='store_true', default=INT8_QUANTIZATION)
+    parser.add_argument('--pin', action='store_true',
+                        help="Pin an unpinned version to the fetched file's checksum (only after checking the file)")
+    args = parser.parse_args()
+
+    try:
+        registry = ModelRegistry()
+
+        if args.command == 'list':
+            for name, versions in registry.models.items():
+                for version, entry in versions.items():
+                    pinned = "pinned" if entry.get('sha256') else "unpinned"
+                    print(f"{name} {version} {entry['file']} ({pinned})")
+            return 0
+
+        if args.command == 'verify':
+            path, checksum = registry.resolve(args.name, args.version)
+            print(f"{path} {checksum}")
+            return 0
+
+        path = registry.fetch(args.name, args.version, args.pin)
+        if args.export:
+            from model_export import export_model
+            export_model(path, args.export, args.int8, CALIBRATION_IMAGE_DIR)
+        return 0
+
+    except Exception as e:
+        logger.error(f"Model registry {args.command} failed: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import queue
+import threading
+import logging
+from typing import Dict, List, Union
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Marker passed down the stage queues to stop worker threads
+STOP = object()
+
+
+class ProcessingPipeline:
+    def __init__(self, service):
+        """
+        Initialize a staged pipeline that overlaps fetch/decode, inference and
+        annotate/encode/upload/publish for an initialized HelmetDetectionService.
+        Stages are joined by bounded queues, so a slow stage backs up the ones
+        before it instead of letting decoded images pile up in memory.
+        """
+        self.service = service
+        self.message_handler = service.message_handler
+        # Largest inference batch; raised by the adaptive quality controller
+        self.batch_size = BATCH_SIZE
+
+        # Undecoded requests are cheap, so intake is sized to hold the whole prefetch window
+        # and submitting from the connection thread never blocks
+        self.intake_queue = queue.Queue(maxsize=self.prefetch_count)
+        self.decoded_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.output_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+        self.fetch_threads: List[threading.Thread] = []
+        self.inference_thread = None
+        self.output_threads: List[threading.Thread] = []
+
+    @property
+    def prefetch_count(self) -> int:
+        """
+        Number of unacknowledged deliveries the pipeline can hold across all stages
+        """
+        return 2 * PIPELINE_QUEUE_SIZE + PIPELINE_FETCH_WORKERS + BATCH_SIZE + PIPELINE_UPLOAD_WORKERS
+
+    def start(self) -> None:
+        """
+        Start the stage worker threads
+        """
+        self.fetch_threads = [
+            threading.Thread(target=self.fetch_worker, name=f"pipeline-fetch-{i}", daemon=True)
+            for i in range(PIPELINE_FETCH_WORKERS)
+        ]
+        self.inference_thread = threading.Thread(target=self.inference_worker, name="pipeline-inference", daemon=True)
+        self.output_threads = [
+            threading.Thread(target=self.output_worker, name=f"pipeline-output-{i}", daemon=True)
+            for i in range(PIPELINE_UPLOAD_WORKERS)
+        ]
+
+        for thread in self.fetch_threads + [self.inference_thread] + self.output_threads:
+            thread.start()
+
+        logger.info(
+            f"Pipeline started: {PIPELINE_FETCH_WORKERS} fetch workers, 1 inference worker, "
+            f"{PIPELINE_UPLOAD_WORKERS} output workers, stage queue size {PIPELINE_QUEUE_SIZE}"
+        )
+
+    def submit(self, message: Dict, delivery_tag: int) -> None:
+        """
+        Hand a parsed request to the fetch stage. Called on the connection thread.
+        """
+        self.intake_queue.put((message, delivery_tag))
+
+    def fetch_worker(self) -> None:
+        """
+        Download and decode images
+        """
+        while True:
+            item = self.intake_queue.get()
+            if item is STOP:
+                break
+
+            message, delivery_tag = item
+            if message.get('video_filename'):
+                # Analyzed on the service's video thread, which completes the delivery itself
+                self.service.submit_video_request(message, delivery_tag)
+                continue
+
+            try:
+                job = self.service.prepare_image_request(message)
+                if job['cached_result'] is not None:
+                    # Cache hits skip inference and upload entirely
+                    self.finish(delivery_tag, self.service.complete_cached_request(job))
+                    continue
+            except Exception as e:
+                logger.error(f"Error processing image request: {e}")
+                self.finish(delivery_tag, self.service.handle_request_error(message, e))
+                continue
+
+            self.decoded_queue.put((delivery_tag, job))
+
+    def inference_worker(self) -> None:
+        """
+        Run detection on whatever decoded images are ready, up to batch_size at a time
+        """
+        running = True
+        while running:
+            batch = [self.decoded_queue.get()]
+
+            # Take what is already decoded instead of waiting for a full batch,
+            # so the model never sits idle while images are available
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.decoded_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if any(item is STOP for item in batch):
+                running = False
+                batch = [item for item in batch if item is not STOP]
+            if not batch:
+                continue
+
+            self.service.check_memory_budget()
+            profiler = self.service.profiler
+            if profiler.active:
+                profiler.begin()
+            try:
+                processing_results = self.service.analyze_jobs([job for _, job in batch], [job['image'] for _, job in batch])
+            except Exception as e:
+                logger.error(f"Error processing batch: {e}")
+                for delivery_tag, _ in batch:
+                    self.fail(delivery_tag, e)
+                continue
+            finally:
+                if profiler.active:
+                    profiler.end(len(batch))
+
+            for item, processing_result in zip(batch, processing_results):
+                self.output_queue.put(item + (processing_result,))
+
+    def output_worker(self) -> None:
+        """
+        Annotate, encode and upload images, then publish and ack on the connection thread
+        """
+        while True:
+            item = self.output_queue.get()
+            if item is STOP:
+                break
+
+            delivery_tag, job, processing_result = item
+            try:
+                result = self.service.complete_image_request(job, processing_result)
+            except Exception as e:
+                logger.error(f"Error processing image request: {e}")
+                result = self.service.handle_request_error(job['message'], e)
+
+            self.finish(delivery_tag, result)
+
+    def finish(self, delivery_tag: int, result: Union[Dict, Exception]) -> None:
+        """
+        Hand a result, or a transient error to retry, back to the connection thread
+        for publishing and acknowledgement
+        """
+        try:
+            self.message_handler.complete_threadsafe(delivery_tag, result)
+        except Exception as e:
+            # The connection is gone; the broker will redeliver the request
+            logger.error(f"Failed to schedule result for delivery {delivery_tag}: {e}")
+
+    def fail(self, delivery_tag: int, error: Exception = None) -> None:
+        """
+        Hand a failed delivery back to the connection thread to be retried
+        """
+        try:
+            self.message_handler.fail_threadsafe(delivery_tag, error)
+        except Exception as e:
+            logger.error(f"Failed to schedule requeue for delivery {delivery_tag}: {e}")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stop the stages in order, letting each drain into the next.
+        Requests still in flight when the connection closes are redelivered by the broker.
+        """
+        for _ in self.fetch_threads:
+            self.intake_queue.put(STOP)
+        for thread in self.fetch_threads:
+            thread.join(timeout)
+
+        if self.inference_thread:
+            self.decoded_queue.put(STOP)
+            self.inference_thread.join(timeout)
+
+        for _ in self.output_threads:
+            self.output_queue.put(STOP)
+        for thread in self.output_threads:
+            thread.join(timeout)
+
+        logger.info("Pipeline stopped")
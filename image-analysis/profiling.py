@@ -0,0 +1,273 @@
+import io
+import os
+import sys
+import time
+import pstats
+import marshal
+import socket
+import cProfile
+import logging
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, UTC
+from typing import Dict, Optional
+import stage_timing
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILERS = ('cprofile', 'sampling', 'torch')
+# Rows of the text summaries
+PROFILE_TOP_FUNCTIONS = 50
+
+
+class CProfileSession:
+    def __init__(self):
+        """
+        Deterministic profile of the thread that starts and stops the session
+        """
+        self.profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+
+    def outputs(self) -> Dict[str, bytes]:
+        """
+        Stats loadable with pstats.Stats and a summary sorted by cumulative time
+        """
+        self.profile.create_stats()
+        # Dumped first, since loading the profile into Stats takes its stats away
+        stats = marshal.dumps(self.profile.stats)
+        summary = io.StringIO()
+        pstats.Stats(self.profile, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        return {'profile.pstats': stats, 'profile.txt': summary.getvalue().encode('utf-8')}
+
+
+class SamplingSession:
+    def __init__(self):
+        """
+        Samples the stacks of all threads every PROFILE_SAMPLE_INTERVAL_MS on a background thread
+        """
+        self.samples: Counter = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name='profile-sampler', daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def sample(self) -> None:
+        interval = PROFILE_SAMPLE_INTERVAL_MS / 1000
+        own_id = threading.get_ident()
+        while not self.stopped.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def outputs(self) -> Dict[str, bytes]:
+        """
+        Stacks in the collapsed format read by flame graph tools
+        """
+        lines = [f"{stack} {count}" for stack, count in self.samples.most_common()]
+        return {'stacks.txt': '\n'.join(lines).encode('utf-8')}
+
+
+class TorchSession:
+    def __init__(self):
+        """
+        torch.profiler trace of the operators run while the session is active
+        """
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self.profile = profile(activities=activities, record_shapes=True)
+
+    def start(self) -> None:
+        self.profile.__enter__()
+
+    def stop(self) -> None:
+        self.profile.__exit__(None, None, None)
+
+    def outputs(self) -> Dict[str, bytes]:
+        """
+        Chrome trace (chrome://tracing, Perfetto) and an operator summary
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            self.profile.export_chrome_trace(path)
+            with open(path, 'rb') as f:
+                trace = f.read()
+        summary = self.profile.key_averages().table(sort_by='self_cpu_time_total', row_limit=PROFILE_TOP_FUNCTIONS)
+        return {'trace.json': trace, 'profile.txt': summary.encode('utf-8')}
+
+
+class StageTotals:
+    def __init__(self):
+        """
+        Stage timing breakdown of the profiled requests, collected as a stage_timing observer
+        """
+        self.lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def __call__(self, name: str, seconds: float) -> None:
+        with self.lock:
+            totals = self.stages.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            totals['count'] += 1
+            totals['total_ms'] += seconds * 1000
+            totals['max_ms'] = max(totals['max_ms'], seconds * 1000)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {
+                name: dict(totals, mean_ms=totals['total_ms'] / totals['count'])
+                for name, totals in self.stages.items()
+            }
+
+
+class RequestProfiler:
+    def __init__(self, storage_service):
+        """
+        Profiles the next N requests once armed and uploads the profile with a stage timing
+        breakdown to MinIO under PROFILE_PREFIX. While not armed, the processing path only
+        reads the active flag.
+        """
+        self.storage_service = storage_service
+        self.active = False
+        self.requests = PROFILE_REQUESTS
+        self.profiler = PROFILER
+        self.lock = threading.Lock()
+        self.session = None
+        self.stage_totals: Optional[StageTotals] = None
+        self.remaining = 0
+        self.profiled = 0
+        self.started_at = 0.0
+
+    def arm(self, requests: int = None, profiler: str = None) -> bool:
+        """
+        Profile the next requests. Only sets flags, so it can be called from a signal handler;
+        the session starts with the next request.
+        """
+        if self.active:
+            logger.warning("Profiling is already running")
+            return False
+
+        profiler = profiler or PROFILER
+        if profiler not in PROFILERS:
+            logger.error(f"Unknown profiler: {profiler}")
+            return False
+
+        self.requests = max(1, requests or PROFILE_REQUESTS)
+        self.profiler = profiler
+        self.active = True
+        return True
+
+    def handle_command(self, command: Dict) -> None:
+        """
+        Control exchange command: {"command": "profile", "requests": N, "profiler": "...", "worker": "..."}.
+        worker, if given, is the hostname or hostname:pid of the worker to profile.
+        """
+        if command.get('command') != 'profile':
+            logger.warning(f"Unknown control command: {command.get('command')}")
+            return
+
+        worker = command.get('worker')
+        if worker and worker not in (socket.gethostname(), f"{socket.gethostname()}:{os.getpid()}"):
+            return
+
+        if self.arm(command.get('requests'), command.get('profiler')):
+            logger.info(f"Profiling the next {self.requests} requests with {self.profiler}")
+
+    def begin(self) -> None:
+        """
+        Start the session before the first profiled request, in the processing thread
+        """
+        with self.lock:
+            if self.session is not None or not self.active:
+                return
+            try:
+                if self.profiler == 'torch':
+                    self.session = TorchSession()
+                elif self.profiler == 'sampling':
+                    self.session = SamplingSession()
+                else:
+                    self.session = CProfileSession()
+            except ImportError as e:
+                logger.error(f"Profiler {self.profiler} is not available: {e}")
+                self.active = False
+                return
+
+            self.stage_totals = StageTotals()
+            stage_timing.add_observer(self.stage_totals)
+            self.remaining = self.requests
+            self.profiled = 0
+            self.started_at = time.perf_counter()
+            self.session.start()
+
+    def end(self, count: int) -> None:
+        """
+        Count requests finished by the processing thread; stop and upload after the last one
+        """
+        with self.lock:
+            if self.session is None:
+                return
+            self.profiled += count
+            self.remaining -= count
+            if self.remaining > 0:
+                return
+
+            self.session.stop()
+            stage_timing.remove_observer(self.stage_totals)
+            session, profiler, stage_totals = self.session, self.profiler, self.stage_totals
+            seconds = time.perf_counter() - self.started_at
+            profiled = self.profiled
+            self.session = None
+            self.stage_totals = None
+            self.active = False
+
+        # Serializing and uploading can take a while; keep it off the processing thread
+        threading.Thread(
+            target=self.upload, args=(session, profiler, stage_totals, profiled, seconds),
+            name='profile-upload', daemon=True
+        ).start()
+
+    def upload(self, session, profiler: str, stage_totals: StageTotals, profiled: int, seconds: float) -> None:
+        """
+        Write the profile files and stages.json under PROFILE_PREFIX/<host>-<pid>-<time>/
+        """
+        try:
+            finished = datetime.now(UTC).strftime('%Y%m%dT%H%M%S')
+            prefix = f"{PROFILE_PREFIX}{socket.gethostname()}-{os.getpid()}-{finished}/"
+
+            for name, data in session.outputs().items():
+                self.storage_service.upload_image_bytes(data, prefix + name)
+
+            self.storage_service.put_json(prefix + 'stages.json', {
+                'profiler': profiler,
+                'requests': profiled,
+                'seconds': seconds,
+                'requests_per_second': profiled / seconds if seconds else 0.0,
+                'stages': stage_totals.summary()
+            })
+            logger.info(f"Profile of {profiled} requests uploaded to {prefix}")
+
+        except Exception as e:
+            logger.error(f"Failed to upload profile: {e}")
@@ -0,0 +1,165 @@
+import os
+import re
+import sys
+import hmac
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+import cv2
+import numpy as np
+from storage_service import StorageService
+from annotation import annotation_object_name, draw_detections
+from detections import detections_from_json
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RENDER_PATH_PREFIX = '/annotated/'
+# Only annotated copies are served, never originals or other objects in the bucket
+ANNOTATED_NAME = re.compile(r'^[^/]+(/[^/]+)*_annotated\.[A-Za-z0-9]+$')
+# Renders of the same image serialize on one of these locks, so concurrent first views render once
+RENDER_LOCK_STRIPES = 64
+
+
+class AnnotationRenderer:
+    def __init__(self, storage_service: StorageService):
+        """
+        Renders annotated images on first request from the detections stored by
+        lazy-mode workers, and caches them in MinIO under their annotated filename
+        """
+        self.storage_service = storage_service
+        self.locks = [threading.Lock() for _ in range(RENDER_LOCK_STRIPES)]
+
+    def get(self, annotated_filename: str) -> Optional[bytes]:
+        """
+        Encoded annotated image, or None unless it is an annotated copy with a stored annotation record
+        """
+        if not ANNOTATED_NAME.match(annotated_filename):
+            return None
+        annotation = self.storage_service.get_json(annotation_object_name(annotated_filename))
+        if annotation is None or \
+                self.storage_service.generate_annotated_filename(annotation['image_filename']) != annotated_filename:
+            return None
+
+        if self.storage_service.file_exists(annotated_filename):
+            return bytes(self.storage_service.download_image_bytes(annotated_filename))
+
+        with self.locks[hash(annotated_filename) % RENDER_LOCK_STRIPES]:
+            # Another request may have rendered it while we waited
+            if self.storage_service.file_exists(annotated_filename):
+                return bytes(self.storage_service.download_image_bytes(annotated_filename))
+            return self.render(annotated_filename, annotation)
+
+    def render(self, annotated_filename: str, annotation: Dict) -> bytes:
+        """
+        Draw the stored detections on the original image and upload the result
+        """
+        image_data = self.storage_service.download_image_bytes(annotation['image_filename'])
+        image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not decode {annotation['image_filename']}")
+
+        draw_detections(image, detections_from_json(annotation['detections']))
+
+        success, encoded = cv2.imencode(os.path.splitext(annotated_filename)[1] or '.jpg', image)
+        if not success:
+            raise ValueError(f"Could not encode {annotated_filename}")
+        encoded = encoded.tobytes()
+
+        if not self.storage_service.upload_image_bytes(encoded, annotated_filename):
+            logger.warning(f"Failed to cache rendered image: {annotated_filename}")
+
+        logger.info(f"Rendered annotated image: {annotated_filename}")
+        return encoded
+
+
+def render_url_signature(annotated_filename: str, expires: int, secret: str = RENDER_URL_SECRET) -> str:
+    """
+    HMAC-SHA256 over the annotated filename and expiry time; the backend signs the same way
+    """
+    message = f"{annotated_filename}:{expires}".encode('utf-8')
+    return hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def valid_signature(annotated_filename: str, query: str) -> bool:
+    """
+    Whether the request carries an unexpired signature for the filename
+    """
+    params = parse_qs(query)
+    try:
+        expires = int(params['expires'][0])
+        signature = params['signature'][0]
+    except (KeyError, IndexError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(signature, render_url_signature(annotated_filename, expires))
+
+
+def make_handler(renderer: AnnotationRenderer):
+    class RenderRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            path = unquote(url.path)
+            annotated_filename = path[len(RENDER_PATH_PREFIX):]
+
+            if not path.startswith(RENDER_PATH_PREFIX) or not annotated_filename or '..' in annotated_filename.split('/'):
+                self.send_error(404)
+                return
+
+            if not valid_signature(annotated_filename, url.query):
+                self.send_error(403)
+                return
+
+            try:
+                body = renderer.get(annotated_filename)
+            except Exception as e:
+                logger.error(f"Error rendering {annotated_filename}: {e}")
+                self.send_error(500)
+                return
+
+            if body is None:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', mimetypes.guess_type(annotated_filename)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'private, max-age=300')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return RenderRequestHandler
+
+
+def main() -> int:
+    if not RENDER_URL_SECRET:
+        logger.error("RENDER_URL_SECRET is not set; refusing to serve annotated images without signed URLs")
+        return 1
+
+    try:
+        renderer = AnnotationRenderer(StorageService())
+        server = ThreadingHTTPServer(('', RENDER_PORT), make_handler(renderer))
+    except Exception as e:
+        logger.error(f"Failed to start render server: {e}")
+        return 1
+
+    logger.info(f"Rendering annotated images on port {RENDER_PORT} under {RENDER_PATH_PREFIX}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
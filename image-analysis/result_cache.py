@@ -0,0 +1,102 @@
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    def __init__(self, storage_service, detector):
+        """
+        Two-tier cache of detection results keyed by image content:
+        an in-process LRU bounded by serialized size, backed by small JSON objects in MinIO
+        """
+        self.storage_service = storage_service
+
+        # Anything that changes the detections must be part of the key
+        self.fingerprint = ':'.join(str(part) for part in (
+            detector.model_checksum, detector.confidence_threshold, detector.iou_threshold,
+            # Runtime and full-quality model input size
+            INFERENCE_BACKEND, INT8_QUANTIZATION, INFERENCE_IMAGE_SIZE,
+            # Tiling of large images
+            TILE_PIXEL_THRESHOLD, TILE_SIZE, TILE_OVERLAP,
+            # Reduced-size decoding of large and oversized images
+            REDUCED_DECODE_MIN_SIDE, MAX_IMAGE_PIXELS, OVERSIZE_IMAGE_POLICY,
+            # Cascade screening model and escalation band
+            f"cascade={detector.screening_checksum}:{CASCADE_SCREENING_IMAGE_SIZE}:{CASCADE_UNCERTAIN_BAND}"
+            if detector.cascade else 'cascade=off'
+        ))
+
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+
+    def make_key(self, image_data, region=None, image_size: Optional[int] = None) -> str:
+        """
+        Build the cache key from the image bytes, the model fingerprint, the region of interest
+        and the model input size the detections are computed at (None = full quality)
+        """
+        image_digest = hashlib.sha256(image_data).hexdigest()
+        if region is not None:
+            # The crop margin and anchor point change what is detected and counted inside the zones
+            fingerprint = f"{self.fingerprint}:{region.fingerprint}:{ROI_CROP_MARGIN}:{ROI_ANCHOR}"
+        else:
+            fingerprint = self.fingerprint
+        if image_size is not None:
+            fingerprint = f"{fingerprint}:size={image_size}"
+        return hashlib.sha256(f"{image_digest}:{fingerprint}".encode('utf-8')).hexdigest()
+
+    def object_name(self, key: str) -> str:
+        """
+        MinIO object holding the persistent copy of a cached result
+        """
+        return f"{RESULT_CACHE_PREFIX}{key}.json"
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Look up a result in memory first, then in MinIO
+        """
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry[0]
+
+        result = self.storage_service.get_json(self.object_name(key))
+        if result is not None:
+            self.remember(key, result, len(json.dumps(result)))
+        return result
+
+    def put(self, key: str, result: Dict) -> None:
+        """
+        Store a result in both tiers
+        """
+        body = json.dumps(result)
+        self.remember(key, result, len(body))
+
+        if not self.storage_service.put_json(self.object_name(key), result):
+            logger.warning(f"Failed to persist cached result {key}")
+
+    def remember(self, key: str, result: Dict, size: int) -> None:
+        """
+        Insert into the in-memory tier, evicting least recently used entries over the size budget
+        """
+        if size > RESULT_CACHE_MEMORY_BYTES:
+            return
+
+        with self.lock:
+            previous = self.memory.pop(key, None)
+            if previous is not None:
+                self.memory_bytes -= previous[1]
+
+            self.memory[key] = (result, size)
+            self.memory_bytes += size
+
+            while self.memory_bytes > RESULT_CACHE_MEMORY_BYTES:
+                _, (_, evicted_size) = self.memory.popitem(last=False)
+                self.memory_bytes -= evicted_size
@@ -0,0 +1,56 @@
+from typing import Dict, Optional
+from minio.error import S3Error
+from config import *
+
+# Message headers used by delayed retries
+ATTEMPT_HEADER = 'x-attempt'
+ERROR_HEADER = 'x-last-error'
+ORIGIN_QUEUE_HEADER = 'x-origin-queue'
+# Detection result of an earlier attempt, so the retry skips inference
+KNOWN_RESULT_HEADER = 'x-known-result'
+# Complete result message of an earlier attempt whose publish failed, so the retry only publishes
+RESULT_HEADER = 'x-result'
+
+# Longest error text kept in a header
+ERROR_HEADER_LENGTH = 500
+
+# MinIO error codes that do not go away by retrying
+PERMANENT_S3_ERRORS = frozenset({'NoSuchKey', 'NoSuchBucket', 'AccessDenied', 'InvalidObjectName', 'InvalidArgument'})
+
+
+class TransientError(Exception):
+    def __init__(self, message: str, known_result: Optional[Dict] = None):
+        """
+        A failure worth retrying later. known_result carries what the attempt already computed,
+        so the retry does not repeat it.
+        """
+        super().__init__(message)
+        self.known_result = known_result
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Whether a failure may succeed when retried: storage, broker and network errors are,
+    malformed requests and undecodable or missing images are not
+    """
+    if isinstance(error, TransientError):
+        return True
+    if isinstance(error, S3Error):
+        return error.code not in PERMANENT_S3_ERRORS
+    if isinstance(error, (ValueError, KeyError, TypeError, FileNotFoundError)):
+        return False
+    return True
+
+
+def retry_delay_ms(attempt: int) -> int:
+    """
+    Delay before retrying after the given failed attempt (1 for the first)
+    """
+    return min(RETRY_BASE_DELAY_MS * 2 ** (attempt - 1), RETRY_MAX_DELAY_MS)
+
+
+def delay_queue_name(queue: str, delay_ms: int) -> str:
+    """
+    Queue holding retries of a request queue for delay_ms before they return to it
+    """
+    return f"{queue}.retry.{delay_ms}ms"
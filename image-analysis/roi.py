@@ -0,0 +1,86 @@
+import json
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class RegionOfInterest:
+    def __init__(self, polygons: List[List[List[float]]]):
+        """
+        Zones of one camera as polygons in original image pixels. A detection counts
+        when its anchor point (ROI_ANCHOR) lies inside any of them.
+        """
+        self.polygons = [np.asarray(polygon, dtype=np.float64).reshape(-1, 2) for polygon in polygons]
+        if not self.polygons or any(len(polygon) < 3 for polygon in self.polygons):
+            raise ValueError("A region of interest needs at least one polygon of three or more points")
+
+        points = np.concatenate(self.polygons)
+        self.bounds = tuple(float(value) for value in (*points.min(axis=0), *points.max(axis=0)))
+
+        # Cached results depend on the zones
+        canonical = json.dumps([polygon.tolist() for polygon in self.polygons], separators=(',', ':'))
+        self.fingerprint = hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+    def crop_window(self, shape: Tuple[int, ...], scale: Optional[np.ndarray] = None) -> Tuple[int, int, int, int]:
+        """
+        x0, y0, x1, y1 of the polygons' bounding box plus ROI_CROP_MARGIN, in the pixels of an
+        image of the given shape; scale maps those pixels to original coordinates
+        """
+        sx, sy = (1.0, 1.0) if scale is None else scale
+        left, top, right, bottom = self.bounds
+        height, width = shape[:2]
+        x0 = max(0, int(np.floor((left - ROI_CROP_MARGIN) / sx)))
+        y0 = max(0, int(np.floor((top - ROI_CROP_MARGIN) / sy)))
+        x1 = min(width, int(np.ceil((right + ROI_CROP_MARGIN) / sx)))
+        y1 = min(height, int(np.ceil((bottom + ROI_CROP_MARGIN) / sy)))
+        return x0, y0, max(x1, x0 + 1), max(y1, y0 + 1)
+
+    def contains(self, points: np.ndarray) -> np.ndarray:
+        """
+        Which of the (N, 2) points lie inside any polygon, by even-odd ray casting
+        over all points and edges at once
+        """
+        inside = np.zeros(len(points), dtype=bool)
+        if not len(points):
+            return inside
+
+        x = points[:, 0:1]
+        y = points[:, 1:2]
+        for polygon in self.polygons:
+            start = polygon
+            end = np.roll(polygon, -1, axis=0)
+            dy = end[:, 1] - start[:, 1]
+            # Edges whose y span crosses the point's horizontal ray
+            spans = (start[:, 1] > y) != (end[:, 1] > y)
+            # x where each edge meets the ray; horizontal edges never span, so their value is unused
+            crossing_x = start[:, 0] + (y - start[:, 1]) * (end[:, 0] - start[:, 0]) / np.where(dy == 0, 1, dy)
+            inside |= np.count_nonzero(spans & (x < crossing_x), axis=1) % 2 == 1
+        return inside
+
+    def filter(self, detections: np.ndarray) -> np.ndarray:
+        """
+        Detections (in original coordinates) whose anchor point lies inside the region
+        """
+        bbox = detections['bbox'].astype(np.float64)
+        anchors = bbox[:, :2] + bbox[:, 2:] * ([0.5, 1.0] if ROI_ANCHOR == 'bottom' else [0.5, 0.5])
+        return detections[self.contains(anchors)]
+
+
+def load_regions(path: str) -> Dict[str, RegionOfInterest]:
+    """
+    Regions of interest by source id from a JSON file: {"<source id>": [[[x, y], ...], ...]}
+    """
+    try:
+        with open(path) as f:
+            config = json.load(f)
+        regions = {str(source): RegionOfInterest(polygons) for source, polygons in config.items()}
+        logger.info(f"Loaded regions of interest for {len(regions)} sources from {path}")
+        return regions
+    except Exception as e:
+        logger.error(f"Failed to load regions of interest from {path}: {e}")
+        raise
@@ -0,0 +1,418 @@
+import queue
+import signal
+import logging
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+from pipeline import STOP, ProcessingPipeline
+from storage_service import StorageService
+from retry_policy import TransientError, is_transient
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Worker processes are forked from the service after the model is loaded, like supervisor.py workers,
+# and before the service opens broker connections or starts threads
+context = multiprocessing.get_context('fork')
+
+# A frame in the ring (slot, shape), or a copy of one too large for a slot
+Frame = Union[Tuple[int, Tuple[int, ...]], np.ndarray]
+# Error text and whether it is transient; exceptions are not sent between processes as they may not pickle
+ErrorInfo = Tuple[str, bool]
+# Seconds the inference thread waits for frames before checking that the worker processes are alive
+LIVENESS_INTERVAL = 1.0
+
+
+def describe_error(error: Exception) -> ErrorInfo:
+    return str(error), is_transient(error)
+
+
+def rebuild_error(error: ErrorInfo) -> Exception:
+    """
+    Exception standing in for one raised in a worker process, transient or not like the original
+    """
+    message, transient = error
+    return TransientError(message) if transient else ValueError(message)
+
+
+class FrameRing:
+    def __init__(self, slots: int, slot_bytes: int):
+        """
+        Fixed-size frame slots in one shared memory block, with a queue of free slot numbers.
+        Writers block on a free slot, which is the backpressure from inference and encoding
+        back to decoding; whoever is done with a frame last releases its slot.
+        """
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.free = context.Queue()
+
+    def open(self) -> None:
+        """
+        Mark every slot free. Called once the processes sharing the ring are forked, since the
+        first put starts the queue's feeder thread.
+        """
+        for slot in range(self.slots):
+            self.free.put(slot)
+
+    def view(self, slot: int, shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        uint8 array over a slot, without copying
+        """
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.memory.buf, offset=slot * self.slot_bytes)
+
+    def write(self, image: np.ndarray) -> Frame:
+        """
+        Copy a frame into the next free slot, waiting for one. Frames larger than a slot are returned as is.
+        """
+        if image.nbytes > self.slot_bytes:
+            return image
+        slot = self.free.get()
+        self.view(slot, image.shape)[...] = image
+        return slot, image.shape
+
+    def read(self, frame: Frame) -> np.ndarray:
+        return self.view(*frame) if isinstance(frame, tuple) else frame
+
+    def release(self, frame: Frame) -> None:
+        if isinstance(frame, tuple):
+            self.free.put(frame[0])
+
+    def close(self) -> None:
+        try:
+            self.memory.close()
+        except BufferError:
+            # A view is still alive somewhere in this process; the block goes away with the process
+            logger.warning("Shared frame memory still in use at shutdown")
+        self.memory.unlink()
+
+
+class SharedMemoryPipeline(ProcessingPipeline):
+    def __init__(self, service):
+        """
+        Pipeline whose CPU-heavy stages run in separate processes: decoder processes download and
+        decode images into a FrameRing, the model runs on the frames in place on the inference thread
+        of this process, and encoder processes draw, encode and upload annotated images from the same
+        slots. Frames never pass through pickling unless they are too large for a slot, so decode and
+        encode scale across cores independently of the model process.
+        Stage timings of the worker processes are not exported, as each process has its own metrics.
+        """
+        super().__init__(service)
+        self.ring = None
+        self.decode_tasks = context.Queue()
+        self.decoded = context.Queue()
+        self.encode_tasks = context.Queue()
+        self.encoded = context.Queue()
+        self.processes: List[multiprocessing.Process] = []
+        # Jobs between submission and the end of inference, and then waiting for their encoder
+        self.jobs: Dict[int, Dict] = {}
+        self.awaiting_annotation: Dict[int, Tuple[Dict, Dict]] = {}
+        self.collector_thread = None
+        self.stopping = False
+
+    @property
+    def prefetch_count(self) -> int:
+        """
+        Number of unacknowledged deliveries the pipeline can hold across all stages
+        """
+        return SHM_SLOTS + 2 * SHM_DECODE_WORKERS + PIPELINE_UPLOAD_WORKERS
+
+    def start_processes(self) -> None:
+        """
+        Create the frame ring and fork the worker processes. Must run before the service starts
+        any thread or opens its broker connection: a forked child gets copies of the locks other
+        threads hold and of every open socket.
+        """
+        running = [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()]
+        if running:
+            logger.warning(f"Forking pipeline processes while threads are running: {', '.join(running)}")
+
+        self.ring = FrameRing(SHM_SLOTS, SHM_SLOT_MB * 1024 * 1024)
+        self.processes = [
+            context.Process(target=self.run_process, args=(self.decode_process,), name=f"shm-decode-{i}", daemon=True)
+            for i in range(SHM_DECODE_WORKERS)
+        ] + [
+            context.Process(target=self.run_process, args=(self.encode_process,), name=f"shm-encode-{i}", daemon=True)
+            for i in range(SHM_ENCODE_WORKERS)
+        ]
+        for process in self.processes:
+            process.start()
+        self.ring.open()
+
+    def start(self) -> None:
+        """
+        Start the threads of this process once the worker processes run and the service is connected
+        """
+        self.message_handler = self.service.message_handler
+        self.fetch_threads = [threading.Thread(target=self.fetch_worker, name="shm-dispatch", daemon=True)]
+        self.inference_thread = threading.Thread(target=self.inference_worker, name="shm-inference", daemon=True)
+        self.collector_thread = threading.Thread(target=self.collector_worker, name="shm-collector", daemon=True)
+        self.output_threads = [
+            threading.Thread(target=self.output_worker, name=f"shm-output-{i}", daemon=True)
+            for i in range(PIPELINE_UPLOAD_WORKERS)
+        ]
+        for thread in self.fetch_threads + [self.inference_thread, self.collector_thread] + self.output_threads:
+            thread.start()
+
+        logger.info(
+            f"Shared memory pipeline started: {SHM_DECODE_WORKERS} decode processes, {SHM_ENCODE_WORKERS} encode "
+            f"processes, {SHM_SLOTS} frame slots of {SHM_SLOT_MB} MiB"
+        )
+
+    def run_process(self, body) -> None:
+        """
+        Worker process entry point. Signals are left to the service process, which stops the workers,
+        and the inherited MinIO client is replaced, as its connections belong to the parent.
+        """
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        self.service.storage_service = StorageService()
+        if self.service.result_cache:
+            self.service.result_cache.storage_service = self.service.storage_service
+        body()
+
+    def decode_process(self) -> None:
+        """
+        Download images, look them up in the result cache, and decode the misses into ring slots.
+        Cache hits go to the inference thread without a frame, so they never wait on a slot or the model.
+        """
+        while True:
+            task = self.decode_tasks.get()
+            if task is None:
+                break
+
+            delivery_tag, image_filename, region, image_size = task
+            try:
+                image_data = self.service.fetch_image_data(image_filename)
+                cache_key, cached_result = None, None
+                if self.service.result_cache:
+                    cache_key = self.service.result_cache.make_key(image_data, region, image_size)
+                    cached_result = self.service.result_cache.get(cache_key)
+                if cached_result is not None:
+                    self.decoded.put((delivery_tag, None, None, cache_key, cached_result, None))
+                    continue
+                image, scale = self.service.detector.decode_image_scaled(image_data)
+            except Exception as e:
+                self.decoded.put((delivery_tag, None, None, None, None, describe_error(e)))
+                continue
+
+            self.decoded.put((delivery_tag, self.ring.write(image), scale, cache_key, None, None))
+
+    def encode_process(self) -> None:
+        """
+        Draw, encode and upload annotated images from ring slots, then free the slots
+        """
+        while True:
+            task = self.encode_tasks.get()
+            if task is None:
+                break
+
+            delivery_tag, frame, scale, detections, annotated_filename = task
+            uploaded, error = False, None
+            try:
+                image = self.ring.read(frame)
+                self.service.detector.annotate_image(image, detections, scale)
+                uploaded = self.service.store_annotated_image(image, annotated_filename)
+                del image
+            except Exception as e:
+                error = describe_error(e)
+            finally:
+                self.ring.release(frame)
+
+            self.encoded.put((delivery_tag, uploaded, error))
+
+    def fetch_worker(self) -> None:
+        """
+        Validate requests and hand them to the decoder processes
+        """
+        while True:
+            item = self.intake_queue.get()
+            if item is STOP:
+                break
+
+            message, delivery_tag = item
+            if message.get('video_filename'):
+                self.service.submit_video_request(message, delivery_tag)
+                continue
+
+            try:
+                if message.get('known_result') is not None:
+                    # Retries with a known result skip inference; handled here like any cache hit
+                    job = self.service.prepare_image_request(message)
+                    self.finish(delivery_tag, self.service.complete_cached_request(job))
+                    continue
+                job = self.service.create_image_job(message)
+            except Exception as e:
+                logger.error(f"Error processing image request: {e}")
+                self.finish(delivery_tag, self.service.handle_request_error(message, e))
+                continue
+
+            self.jobs[delivery_tag] = job
+            self.decode_tasks.put((delivery_tag, job['image_filename'], job['region'], job['image_size']))
+
+    def next_decoded(self) -> Optional[tuple]:
+        """
+        Wait for the next decoded frame, recycling the worker if a worker process has died,
+        since frames and slots it held are lost
+        """
+        while True:
+            try:
+                return self.decoded.get(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                dead = [process.name for process in self.processes if not process.is_alive()]
+                if dead and not self.stopping:
+                    self.service.recycle(f"Pipeline processes {', '.join(dead)} exited")
+
+    def inference_worker(self) -> None:
+        """
+        Run detection on the decoded frames in place, up to batch_size at a time
+        """
+        running = True
+        while running:
+            items = [self.next_decoded()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.decoded.get_nowait())
+                except queue.Empty:
+                    break
+
+            if any(item is None for item in items):
+                running = False
+                items = [item for item in items if item is not None]
+
+            batch = []
+            for delivery_tag, frame, scale, cache_key, cached_result, error in items:
+                job = self.jobs.pop(delivery_tag)
+                if error is not None:
+                    logger.error(f"Error processing image request: {error[0]}")
+                    self.finish(delivery_tag, self.service.handle_request_error(job['message'], rebuild_error(error)))
+                    continue
+
+                job['image_scale'] = scale
+                job['cache_key'] = cache_key
+                if cached_result is not None:
+                    # Looked up by the decoder; no frame was decoded
+                    job['cached_result'] = cached_result
+                    self.output_queue.put((delivery_tag, job, None))
+                    continue
+                batch.append((delivery_tag, job, frame))
+            if not batch:
+                continue
+
+            self.service.check_memory_budget()
+            profiler = self.service.profiler
+            if profiler.active:
+                profiler.begin()
+            try:
+                images = [self.ring.read(frame) for _, _, frame in batch]
+                processing_results = self.service.analyze_jobs([job for _, job, _ in batch], images)
+                del images
+            except Exception as e:
+                logger.error(f"Error processing batch: {e}")
+                for delivery_tag, _, frame in batch:
+                    self.ring.release(frame)
+                    self.fail(delivery_tag, e)
+                continue
+            finally:
+                if profiler.active:
+                    profiler.end(len(batch))
+
+            for (delivery_tag, job, frame), processing_result in zip(batch, processing_results):
+                if processing_result['success'] and self.service.expects_annotated_image(job):
+                    # The encoder frees the slot once the annotated image is uploaded
+                    self.awaiting_annotation[delivery_tag] = (job, processing_result)
+                    self.encode_tasks.put((
+                        delivery_tag, frame, job['image_scale'], processing_result['detections'], job['annotated_filename']
+                    ))
+                else:
+                    self.ring.release(frame)
+                    self.output_queue.put((delivery_tag, job, processing_result))
+
+    def collector_worker(self) -> None:
+        """
+        Pass jobs whose annotated image an encoder process has handled on to the output stage
+        """
+        while True:
+            item = self.encoded.get()
+            if item is None:
+                break
+
+            delivery_tag, uploaded, error = item
+            job, processing_result = self.awaiting_annotation.pop(delivery_tag)
+            if error is not None:
+                logger.error(f"Error processing image request: {error[0]}")
+                self.finish(delivery_tag, self.service.handle_request_error(job['message'], rebuild_error(error)))
+                continue
+
+            job['annotation_uploaded'] = uploaded
+            self.output_queue.put((delivery_tag, job, processing_result))
+
+    def output_worker(self) -> None:
+        """
+        Store lazy annotations and cache results, then publish and ack on the connection thread
+        """
+        while True:
+            item = self.output_queue.get()
+            if item is STOP:
+                break
+
+            delivery_tag, job, processing_result = item
+            try:
+                if processing_result is None:
+                    result = self.service.complete_cached_request(job)
+                else:
+                    result = self.service.complete_image_request(job, processing_result)
+            except Exception as e:
+                logger.error(f"Error processing image request: {e}")
+                result = self.service.handle_request_error(job['message'], e)
+
+            self.finish(delivery_tag, result)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stop the stages in order, letting each drain into the next, then free the frame ring.
+        Requests still in flight when the connection closes are redelivered by the broker.
+        """
+        self.stopping = True
+        for _ in self.fetch_threads:
+            self.intake_queue.put(STOP)
+        for thread in self.fetch_threads:
+            thread.join(timeout)
+
+        decoders, encoders = self.processes[:SHM_DECODE_WORKERS], self.processes[SHM_DECODE_WORKERS:]
+        self.stop_processes(decoders, self.decode_tasks, timeout)
+
+        if self.inference_thread:
+            self.decoded.put(None)
+            self.inference_thread.join(timeout)
+
+        self.stop_processes(encoders, self.encode_tasks, timeout)
+
+        if self.collector_thread:
+            self.encoded.put(None)
+            self.collector_thread.join(timeout)
+
+        for _ in self.output_threads:
+            self.output_queue.put(STOP)
+        for thread in self.output_threads:
+            thread.join(timeout)
+
+        if self.ring:
+            self.ring.close()
+        logger.info("Shared memory pipeline stopped")
+
+    def stop_processes(self, processes: List[multiprocessing.Process], tasks, timeout: float) -> None:
+        """
+        Let worker processes finish their queued tasks and exit, terminating any that do not
+        """
+        for _ in processes:
+            tasks.put(None)
+        for process in processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Terminating {process.name}")
+                process.terminate()
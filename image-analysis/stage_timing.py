@@ -0,0 +1,36 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, List
+
+# Callbacks receiving (stage name, seconds) for every timed stage.
+# With no observers registered a stage costs two perf_counter calls.
+observers: List[Callable[[str, float], None]] = []
+
+
+def add_observer(observer: Callable[[str, float], None]) -> None:
+    """
+    Register a callback for stage durations
+    """
+    observers.append(observer)
+
+
+def remove_observer(observer: Callable[[str, float], None]) -> None:
+    """
+    Unregister a stage duration callback
+    """
+    if observer in observers:
+        observers.remove(observer)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a processing stage (download, decode, inference, postprocess, annotate, encode, upload, publish)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for observer in observers:
+            observer(name, elapsed)
@@ -0,0 +1,59 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict
+from metrics import READY, STARTUP_PHASE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Taken when the service entry point starts importing its dependencies
+PROCESS_START = time.perf_counter()
+
+
+class StartupTimer:
+    def __init__(self, start: float = PROCESS_START):
+        """
+        Times the startup phases of a process, logging each and exporting them as metrics
+        """
+        self.start = start
+        self.phases: Dict[str, float] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        STARTUP_PHASE.labels(name).set(self.phases[name])
+        logger.info(f"Startup phase {name} took {seconds:.3f}s")
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+def mark_ready(readiness_file: str, timer: StartupTimer) -> None:
+    """
+    Signal readiness through the metrics gauge and, if configured, a readiness file
+    """
+    if readiness_file:
+        with open(readiness_file, 'w') as f:
+            f.write(f"{os.getpid()}\n")
+    READY.set(1)
+
+    phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in timer.phases.items())
+    logger.info(f"Ready after {timer.elapsed():.2f}s ({phases})")
+
+
+def clear_ready(readiness_file: str) -> None:
+    READY.set(0)
+    if readiness_file:
+        try:
+            os.remove(readiness_file)
+        except FileNotFoundError:
+            pass
@@ -1,6 +1,13 @@
+import io
+import json
 import os
+import mimetypes
 import tempfile
+import threading
+from datetime import timedelta
+from typing import Iterator
 from minio import Minio
+from minio.commonconfig import CopySource
 from minio.error import S3Error
 import logging
 from config import *
@@ -26,6 +33,9 @@ class StorageService:
                 self.client.make_bucket(MINIO_BUCKET)
                 logger.info(f"Created bucket: {MINIO_BUCKET}")
             
+            # Reusable per-thread buffers for in-memory downloads, grown on demand
+            self.thread_local = threading.local()
+
             logger.info("Successfully initialized MinIO client")
             
         except Exception as e:
@@ -39,8 +49,7 @@ class StorageService:
         """
         try:
             # Create temporary file
-            temp_dir = tempfile.mkdtemp()
-            local_path = os.path.join(temp_dir, filename)
+            local_path = self.create_temp_path(filename)
             
             # Download file from MinIO
             self.client.fget_object(MINIO_BUCKET, filename, local_path)
@@ -71,6 +80,135 @@ class StorageService:
             logger.error(f"Error uploading {filename}: {e}")
             return False
 
+    def download_image_bytes(self, filename: str) -> memoryview:
+        """
+        Stream image from MinIO into this thread's reusable download buffer.
+        Returns a view over the buffer that is only valid until the thread's next download.
+        """
+        response = None
+        try:
+            response = self.client.get_object(MINIO_BUCKET, filename)
+
+            buffer = getattr(self.thread_local, 'download_buffer', None)
+            if buffer is None:
+                buffer = bytearray(DOWNLOAD_BUFFER_SIZE)
+
+            length = 0
+            for chunk in response.stream(DOWNLOAD_CHUNK_SIZE):
+                end = length + len(chunk)
+                if end > len(buffer):
+                    # Replace rather than resize so views handed out earlier stay valid
+                    grown = bytearray(max(end, 2 * len(buffer)))
+                    grown[:length] = buffer[:length]
+                    buffer = grown
+                buffer[length:end] = chunk
+                length = end
+
+            self.thread_local.download_buffer = buffer
+
+            logger.info(f"Downloaded {filename} ({length} bytes) into memory")
+            return memoryview(buffer)[:length]
+
+        except S3Error as e:
+            logger.error(f"MinIO error downloading {filename}: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error downloading {filename}: {e}")
+            raise
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+
+    def upload_image_bytes(self, data: bytes, filename: str) -> bool:
+        """
+        Upload encoded image bytes to MinIO without touching the filesystem
+        """
+        try:
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            self.client.put_object(MINIO_BUCKET, filename, io.BytesIO(data), len(data), content_type=content_type)
+            logger.info(f"Uploaded {len(data)} bytes as {filename}")
+            return True
+
+        except S3Error as e:
+            logger.error(f"MinIO error uploading {filename}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Error uploading {filename}: {e}")
+            return False
+
+    def get_json(self, filename: str):
+        """
+        Read a small JSON object from MinIO. Returns None if it does not exist.
+        """
+        response = None
+        try:
+            response = self.client.get_object(MINIO_BUCKET, filename)
+            return json.loads(response.read())
+        except S3Error as e:
+            if e.code != 'NoSuchKey':
+                logger.error(f"MinIO error reading {filename}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Error reading {filename}: {e}")
+            return None
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+
+    def put_json(self, filename: str, data) -> bool:
+        """
+        Write a small JSON object to MinIO
+        """
+        try:
+            body = json.dumps(data).encode('utf-8')
+            self.client.put_object(MINIO_BUCKET, filename, io.BytesIO(body), len(body), content_type='application/json')
+            return True
+        except S3Error as e:
+            logger.error(f"MinIO error writing {filename}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Error writing {filename}: {e}")
+            return False
+
+    def copy_object(self, source_filename: str, filename: str) -> bool:
+        """
+        Copy an object inside the bucket on the server side
+        """
+        try:
+            self.client.copy_object(MINIO_BUCKET, filename, CopySource(MINIO_BUCKET, source_filename))
+            logger.info(f"Copied {source_filename} to {filename}")
+            return True
+        except S3Error as e:
+            logger.error(f"MinIO error copying {source_filename} to {filename}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Error copying {source_filename} to {filename}: {e}")
+            return False
+
+    def list_objects(self, prefix: str = '', start_after: str = None) -> Iterator[str]:
+        """
+        Stream the names of the objects under a prefix in key order, after start_after when given
+        """
+        try:
+            for obj in self.client.list_objects(MINIO_BUCKET, prefix=prefix, recursive=True, start_after=start_after):
+                if not obj.is_dir:
+                    yield obj.object_name
+        except Exception as e:
+            logger.error(f"Error listing objects under {prefix!r}: {e}")
+            raise
+
+    def presigned_url(self, filename: str, expiry_seconds: int = VIDEO_URL_EXPIRY_SECONDS) -> str:
+        """
+        Presigned GET URL for streaming an object without downloading it first
+        """
+        try:
+            return self.client.presigned_get_object(MINIO_BUCKET, filename, expires=timedelta(seconds=expiry_seconds))
+        except Exception as e:
+            logger.error(f"Error creating presigned URL for {filename}: {e}")
+            raise
+
     def file_exists(self, filename: str) -> bool:
         """
         Check if file exists in MinIO bucket
@@ -84,6 +222,12 @@ class StorageService:
             logger.error(f"Error checking if {filename} exists: {e}")
             return False
 
+    def create_temp_path(self, filename: str) -> str:
+        """
+        Create a temporary directory and return a path for filename inside it
+        """
+        return os.path.join(tempfile.mkdtemp(), filename)
+
     def cleanup_temp_file(self, file_path: str) -> None:
         """
         Clean up temporary file and directory
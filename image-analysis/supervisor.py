@@ -0,0 +1,186 @@
+import os
+import gc
+import sys
+import time
+import signal
+import logging
+from typing import Dict, List
+from main import HelmetDetectionService, create_detector
+from startup import StartupTimer, clear_ready, mark_ready
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for exited workers and changes in worker readiness
+READINESS_POLL_INTERVAL = 1.0
+
+
+class WorkerSupervisor:
+    def __init__(self):
+        """
+        Load the model once and prepare to fork worker processes that share its weights copy-on-write.
+        No connections are opened here; every worker opens its own after the fork.
+        """
+        self.startup_timer = StartupTimer()
+        with self.startup_timer.phase('model'):
+            self.detector = create_detector()
+        self.cpu_sets = self.plan_cpu_sets()
+        self.workers: Dict[int, int] = {}  # pid -> worker index
+        self.stopping = False
+        # The supervisor alone owns READINESS_FILE; workers report through their own files
+        self.ready = False
+
+    def plan_cpu_sets(self) -> List[List[int]]:
+        """
+        Split the available cores into one contiguous CPU set per worker
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+
+        worker_count = WORKER_PROCESSES or max(1, len(cpus) // CPUS_PER_WORKER)
+        worker_count = min(worker_count, len(cpus))
+
+        base, extra = divmod(len(cpus), worker_count)
+        cpu_sets = []
+        start = 0
+        for index in range(worker_count):
+            size = base + (1 if index < extra else 0)
+            cpu_sets.append(cpus[start:start + size])
+            start += size
+
+        logger.info(f"Planned {worker_count} workers over {len(cpus)} cores")
+        return cpu_sets
+
+    def worker_readiness_file(self, index: int) -> str:
+        return f"{READINESS_FILE}.worker{index}" if READINESS_FILE else ''
+
+    def update_readiness(self) -> None:
+        """
+        Ready while at least one live worker is ready
+        """
+        ready = any(os.path.exists(self.worker_readiness_file(index)) for index in self.workers.values())
+        if ready and not self.ready:
+            mark_ready(READINESS_FILE, self.startup_timer)
+        elif not ready and self.ready:
+            logger.warning("No worker is ready")
+            clear_ready(READINESS_FILE)
+        self.ready = ready
+
+    def spawn_worker(self, index: int) -> None:
+        """
+        Fork a worker process for the given CPU set
+        """
+        # A worker that was killed could not remove its readiness file
+        clear_ready(self.worker_readiness_file(index))
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                exit_code = self.run_worker(index)
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else 0
+            except BaseException as e:
+                logger.error(f"Worker {index} crashed: {e}")
+            finally:
+                logging.shutdown()
+                os._exit(exit_code)
+
+        self.workers[pid] = index
+        logger.info(f"Started worker {index} (pid {pid}) on CPUs {self.cpu_sets[index]}")
+
+    def run_worker(self, index: int) -> int:
+        """
+        Worker process body: pin CPUs, size the inference thread pool and run a service on the shared model
+        """
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # Until the service installs its profiling handler
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+        cpus = self.cpu_sets[index]
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+
+        # Size the inference thread pool to the pinned cores
+        self.detector.configure_threads(len(cpus))
+
+        # Each worker gets its own RabbitMQ connection/channel and MinIO client
+        # Each worker serves metrics on its own port
+        metrics_port = METRICS_PORT + index if METRICS_PORT else 0
+        service = HelmetDetectionService(
+            detector=self.detector, metrics_port=metrics_port, readiness_file=self.worker_readiness_file(index)
+        )
+        service.run()
+        return 0
+
+    def run(self) -> None:
+        """
+        Start all workers and restart any that exit until asked to stop
+        """
+        def signal_handler(signum, frame):
+            logger.info("Received shutdown signal, stopping workers")
+            self.stopping = True
+            for pid in list(self.workers):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        def profile_handler(signum, frame):
+            # Profile every worker
+            for pid in list(self.workers):
+                try:
+                    os.kill(pid, signal.SIGUSR1)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+        signal.signal(signal.SIGUSR1, profile_handler)
+
+        # Keep objects created while loading the model out of future collections,
+        # so the garbage collector does not touch (and copy) their pages in every worker
+        gc.freeze()
+
+        for index in range(len(self.cpu_sets)):
+            self.spawn_worker(index)
+
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid == 0:
+                self.update_readiness()
+                time.sleep(READINESS_POLL_INTERVAL)
+                continue
+
+            index = self.workers.pop(pid, None)
+            if index is None:
+                continue
+            clear_ready(self.worker_readiness_file(index))
+            self.update_readiness()
+
+            if self.stopping:
+                logger.info(f"Worker {index} (pid {pid}) stopped")
+                continue
+
+            logger.error(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+            time.sleep(WORKER_RESTART_DELAY)
+            if not self.stopping:
+                self.spawn_worker(index)
+
+        clear_ready(READINESS_FILE)
+        logger.info("All workers stopped")
+
+
+if __name__ == "__main__":
+    try:
+        WorkerSupervisor().run()
+    except Exception as e:
+        logger.error(f"Failed to start worker pool: {e}")
+        sys.exit(1)
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from inference_backends import NMS_CLASS_OFFSET, ExportedModelBackend, class_aware_nms, letterbox
+from model_export import box_iou
+
+
+def test_nms_suppresses_overlapping_boxes_of_one_class():
+    boxes = np.array([[10, 10, 110, 110], [12, 12, 112, 112], [300, 300, 400, 400]], dtype=np.float32)
+    confidences = np.array([0.8, 0.9, 0.7], dtype=np.float32)
+    class_ids = np.zeros(3, dtype=np.int64)
+
+    kept = class_aware_nms(boxes, confidences, class_ids, 0.25, 0.45)
+
+    assert kept.tolist() == [1, 2]
+
+
+def test_nms_keeps_overlapping_boxes_of_different_classes():
+    boxes = np.array([[10, 10, 110, 110], [12, 12, 112, 112]], dtype=np.float32)
+    confidences = np.array([0.8, 0.9], dtype=np.float32)
+    class_ids = np.array([0, 1])
+
+    kept = class_aware_nms(boxes, confidences, class_ids, 0.25, 0.45)
+
+    assert kept.tolist() == [1, 0]
+
+
+def test_nms_class_offset_separates_boxes_at_the_far_edge():
+    # Boxes at the largest coordinates a class can have must not reach the next class's range
+    edge = NMS_CLASS_OFFSET - 100
+    boxes = np.array([[edge, edge, edge + 99, edge + 99], [0, 0, 99, 99]], dtype=np.float32)
+    confidences = np.array([0.9, 0.8], dtype=np.float32)
+    class_ids = np.array([0, 1])
+
+    kept = class_aware_nms(boxes, confidences, class_ids, 0.25, 0.45)
+
+    assert sorted(kept.tolist()) == [0, 1]
+
+
+def test_nms_drops_boxes_below_the_confidence_threshold():
+    boxes = np.array([[10, 10, 110, 110], [300, 300, 400, 400]], dtype=np.float32)
+    confidences = np.array([0.9, 0.1], dtype=np.float32)
+
+    kept = class_aware_nms(boxes, confidences, np.zeros(2, dtype=np.int64), 0.25, 0.45)
+
+    assert kept.tolist() == [0]
+
+
+def test_letterbox_pads_to_a_square_keeping_aspect_ratio():
+    image = np.full((300, 600, 3), 255, dtype=np.uint8)
+
+    padded, ratio, (left, top) = letterbox(image, 640)
+
+    assert padded.shape == (640, 640, 3)
+    assert ratio == pytest.approx(640 / 600)
+    assert left == 0 and top == 160
+    assert (padded[:top] == 114).all() and (padded[top:top + 320] == 255).all()
+
+
+class FixtureBackend(ExportedModelBackend):
+    def __init__(self, detections: np.ndarray, image_shape, size: int = 640):
+        """
+        Exported backend stand-in whose graph output holds the given original-coordinate
+        x1, y1, x2, y2, confidence, class_id detections, mapped into letterboxed input space
+        """
+        super().__init__('fixture.onnx', {0: 'helmet', 1: 'head'})
+        self.image_size = size
+        height, width = image_shape[:2]
+        ratio = min(size / height, size / width)
+        left = int(round((size - round(width * ratio)) / 2 - 0.1))
+        top = int(round((size - round(height * ratio)) / 2 - 0.1))
+
+        boxes = detections[:, :4] * ratio + [left, top, left, top]
+        output = np.zeros((4 + len(self.names), len(detections)), dtype=np.float32)
+        output[0] = (boxes[:, 0] + boxes[:, 2]) / 2
+        output[1] = (boxes[:, 1] + boxes[:, 3]) / 2
+        output[2] = boxes[:, 2] - boxes[:, 0]
+        output[3] = boxes[:, 3] - boxes[:, 1]
+        output[4 + detections[:, 5].astype(int), np.arange(len(detections))] = detections[:, 4]
+        self.output = output
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        return np.stack([self.output] * len(batch))
+
+
+@pytest.mark.parametrize('image_shape', [(480, 640, 3), (1080, 1920, 3), (900, 400, 3)])
+def test_exported_backend_maps_boxes_back_to_original_coordinates(image_shape):
+    expected = np.array([
+        [100, 50, 180, 210, 0.9, 0],
+        [105, 55, 185, 215, 0.6, 1],
+        [300, 200, 380, 400, 0.75, 0],
+    ], dtype=np.float32)
+    backend = FixtureBackend(expected, image_shape)
+
+    actual = backend.predict([np.zeros(image_shape, dtype=np.uint8)], 0.25, 0.45)[0]
+
+    assert len(actual) == len(expected)
+    for detection in expected:
+        same_class = actual[actual[:, 5] == detection[5]]
+        ious = box_iou(detection, same_class)
+        best = same_class[np.argmax(ious)]
+        assert ious.max() > 0.98
+        assert best[4] == pytest.approx(detection[4], abs=1e-6)
@@ -0,0 +1,61 @@
+import os
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('ultralytics')
+pytest.importorskip('onnxruntime')
+
+import inference_backends
+import model_export
+from config import HELMET_MODEL_PATH, INFERENCE_IMAGE_SIZE
+
+
+@pytest.fixture
+def model_path(tmp_path, monkeypatch):
+    """
+    The deployed weights when present, otherwise a tiny untrained YOLO saved to tmp_path
+    """
+    monkeypatch.setattr(inference_backends, 'EXPORTED_MODEL_DIR', str(tmp_path / 'exported'))
+    monkeypatch.setattr(model_export, 'EXPORTED_MODEL_DIR', str(tmp_path / 'exported'))
+
+    if os.path.exists(HELMET_MODEL_PATH):
+        return HELMET_MODEL_PATH
+
+    from ultralytics import YOLO
+    path = str(tmp_path / 'tiny.pt')
+    YOLO('yolov8n.yaml').save(path)
+    return path
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    """
+    Square scenes at the inference size, so both backends see the same letterboxed input
+    """
+    if os.getenv('PARITY_IMAGE_DIR'):
+        return os.getenv('PARITY_IMAGE_DIR')
+
+    directory = tmp_path / 'images'
+    directory.mkdir()
+    rng = np.random.default_rng(0)
+    for index in range(4):
+        image = rng.integers(0, 255, (INFERENCE_IMAGE_SIZE, INFERENCE_IMAGE_SIZE, 3), dtype=np.uint8)
+        for _ in range(5):
+            x, y = rng.integers(0, INFERENCE_IMAGE_SIZE - 120, 2)
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            cv2.rectangle(image, (int(x), int(y)), (int(x) + 100, int(y) + 120), color, -1)
+        cv2.imwrite(str(directory / f"scene_{index}.png"), image)
+    return str(directory)
+
+
+def test_onnx_export_matches_torch_backend(model_path, image_dir):
+    exported = model_export.export_model(model_path, 'onnx')
+    assert os.path.exists(exported)
+
+    report = model_export.check_parity(model_path, 'onnx', False, image_dir,
+                                       iou_tolerance=0.9, confidence_tolerance=0.05)
+
+    assert report['recall'] >= 0.95
+    assert report['precision'] >= 0.95
+    assert report['max_confidence_delta'] <= 0.05
@@ -0,0 +1,90 @@
+from typing import List, Tuple
+import numpy as np
+from inference_backends import class_aware_nms
+from config import *
+
+# Boxes ending this close to a tile edge that lies inside the image are treated as cut by the seam
+SEAM_MARGIN = 2
+
+Tile = Tuple[int, int, int, int]  # x1, y1, x2, y2 in image pixels
+
+
+def tile_positions(length: int, tile_size: int, overlap: int) -> List[int]:
+    """
+    Start offsets of overlapping tiles covering [0, length); the last tile ends at the image edge
+    """
+    if length <= tile_size:
+        return [0]
+
+    step = max(tile_size - overlap, 1)
+    positions = list(range(0, length - tile_size, step))
+    positions.append(length - tile_size)
+    return positions
+
+
+def plan_tiles(image_shape: Tuple[int, ...]) -> List[Tile]:
+    """
+    Tiles to run detection on for an image: just the whole image when it is at most
+    TILE_PIXEL_THRESHOLD pixels, otherwise the whole image (for people larger than a tile)
+    followed by a grid of TILE_SIZE tiles overlapping by TILE_OVERLAP pixels
+    """
+    height, width = image_shape[:2]
+    whole_image = (0, 0, width, height)
+
+    if not TILE_PIXEL_THRESHOLD or height * width <= TILE_PIXEL_THRESHOLD:
+        return [whole_image]
+
+    return [whole_image] + [
+        (x, y, min(x + TILE_SIZE, width), min(y + TILE_SIZE, height))
+        for y in tile_positions(height, TILE_SIZE, TILE_OVERLAP)
+        for x in tile_positions(width, TILE_SIZE, TILE_OVERLAP)
+    ]
+
+
+def crop_tiles(image: np.ndarray, tiles: List[Tile]) -> List[np.ndarray]:
+    """
+    Views of the image for each tile, without copying pixels
+    """
+    return [image[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles]
+
+
+def merge_tile_predictions(predictions: List[np.ndarray], tiles: List[Tile], image_shape: Tuple[int, ...],
+                           conf: float, iou: float) -> np.ndarray:
+    """
+    Merge the (N, 6) x1, y1, x2, y2, confidence, class_id predictions of an image's tiles into one array
+    in image coordinates. Tile boxes cut by a seam are dropped, since the overlapping neighbour
+    (or the whole-image pass) sees the complete person, and duplicates are removed with per-class NMS.
+    """
+    if len(tiles) == 1:
+        return predictions[0]
+
+    height, width = image_shape[:2]
+    merged = [predictions[0]]
+
+    for data, (x1, y1, x2, y2) in zip(predictions[1:], tiles[1:]):
+        if not len(data):
+            continue
+
+        boxes = data[:, :4]
+        cut = np.zeros(len(data), dtype=bool)
+        if x1 > 0:
+            cut |= boxes[:, 0] <= SEAM_MARGIN
+        if y1 > 0:
+            cut |= boxes[:, 1] <= SEAM_MARGIN
+        if x2 < width:
+            cut |= boxes[:, 2] >= (x2 - x1) - SEAM_MARGIN
+        if y2 < height:
+            cut |= boxes[:, 3] >= (y2 - y1) - SEAM_MARGIN
+
+        data = data[~cut].copy()
+        data[:, [0, 2]] += x1
+        data[:, [1, 3]] += y1
+        merged.append(data)
+
+    merged = np.concatenate(merged)
+    if not len(merged):
+        return merged
+
+    indices = class_aware_nms(merged[:, :4], merged[:, 4], merged[:, 5].astype(np.intp), conf, iou,
+                              class_offset=max(height, width) + 1)
+    return merged[indices]
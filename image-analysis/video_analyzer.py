@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import logging
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+import cv2
+import numpy as np
+from helmet_detector import HelmetDetector
+from memory_budget import release_buffer
+from detections import STATUS_NAMES, STATUS_WEARING_HELMET
+from config import *
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Size of the grayscale thumbnail compared between frames to detect scene changes,
+# and the gray level difference at which a thumbnail pixel counts as changed
+SCENE_THUMBNAIL_SIZE = (64, 36)
+SCENE_PIXEL_DELTA = 25
+# Feature points tracked by optical flow inside each box, the minimum that must survive,
+# and the forward-backward error in pixels above which a point is discarded
+FLOW_POINTS_PER_TRACK = 20
+FLOW_MIN_POINTS = 3
+FLOW_MAX_ERROR = 1.0
+
+
+class FrameSampler:
+    def __init__(self, capture: cv2.VideoCapture, sample_fps: float, max_sample_interval: float):
+        """
+        Iterate over every stride-th frame of a capture. Skipped frames are grabbed but not decoded.
+        The stride grows while nothing happens (relax) and drops back to the base rate on activity (reset).
+        """
+        self.capture = capture
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        self.base_stride = max(1, int(round(self.fps / sample_fps)))
+        self.max_stride = max(self.base_stride, int(round(self.fps * max_sample_interval)))
+        self.stride = self.base_stride
+        self.frames_read = 0
+
+    def __iter__(self) -> Iterator[Tuple[int, float, np.ndarray]]:
+        frame_index = 0
+        while True:
+            ok, frame = self.capture.read()
+            if not ok:
+                return
+            self.frames_read = frame_index + 1
+
+            yield frame_index, frame_index / self.fps, frame
+
+            for _ in range(self.stride - 1):
+                if not self.capture.grab():
+                    return
+                frame_index += 1
+                self.frames_read = frame_index + 1
+            frame_index += 1
+
+    def relax(self) -> None:
+        self.stride = min(self.stride * 2, self.max_stride)
+
+    def reset(self) -> None:
+        self.stride = self.base_stride
+
+
+def scene_thumbnail(gray: np.ndarray) -> np.ndarray:
+    return cv2.resize(gray, SCENE_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def scene_change(thumbnail: np.ndarray, reference: np.ndarray, tracked_boxes: List[np.ndarray], scale: np.ndarray) -> float:
+    """
+    Fraction of thumbnail pixels that changed between two frames,
+    ignoring changes inside tracked boxes (already explained by tracked motion)
+    """
+    changed = cv2.absdiff(thumbnail, reference) > SCENE_PIXEL_DELTA
+    for x, y, width, height in tracked_boxes:
+        # Cover the box at both its keyframe and current position with a margin of half its size
+        x1, y1 = int((x - width / 2) * scale[0]), int((y - height / 2) * scale[1])
+        x2, y2 = int((x + width * 1.5) * scale[0]) + 1, int((y + height * 1.5) * scale[1]) + 1
+        changed[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)] = False
+    return float(np.count_nonzero(changed)) / changed.size
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Pairwise IoU of two sets of x, y, width, height boxes
+    """
+    a = boxes_a[:, None, :].astype(np.float32)
+    b = boxes_b[None, :, :].astype(np.float32)
+
+    left = np.maximum(a[..., 0], b[..., 0])
+    top = np.maximum(a[..., 1], b[..., 1])
+    right = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2])
+    bottom = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3])
+
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+class Track:
+    def __init__(self, track_id: int, bbox: np.ndarray, timestamp: float):
+        """
+        One person followed across frames, with confidence-weighted helmet status votes
+        """
+        self.track_id = track_id
+        self.bbox = bbox.astype(np.float32)
+        self.votes = np.zeros(len(STATUS_NAMES), dtype=np.float64)
+        self.hits = 0
+        self.misses = 0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.confirmed = False
+
+    def observe(self, bbox: np.ndarray, confidence: float, status: int, timestamp: float) -> None:
+        self.bbox = bbox.astype(np.float32)
+        self.votes[status] += confidence
+        self.hits += 1
+        self.misses = 0
+        self.last_seen = timestamp
+
+    @property
+    def status(self) -> int:
+        return int(np.argmax(self.votes))
+
+    def to_event(self, event: str, source: str) -> Dict:
+        status = self.status
+        return {
+            'event': event,
+            'source': source,
+            'track_id': self.track_id,
+            'status': STATUS_NAMES[status],
+            'has_helmet': status == STATUS_WEARING_HELMET,
+            'status_confidence': float(self.votes[status] / self.votes.sum()) if self.votes.sum() > 0 else 0.0,
+            'first_seen': round(self.first_seen, 3),
+            'last_seen': round(self.last_seen, 3),
+            'keyframes': self.hits,
+            'bbox': [int(v) for v in self.bbox]
+        }
+
+
+class Tracker:
+    def __init__(self, source: str):
+        """
+        IoU tracker updated with detections on keyframes; between keyframes boxes
+        are moved with sparse Lucas-Kanade optical flow
+        """
+        self.source = source
+        self.tracks: List[Track] = []
+        self.next_track_id = 1
+
+    def update(self, detections: np.ndarray, timestamp: float) -> List[Dict]:
+        """
+        Match keyframe detections to tracks and return the resulting track events
+        """
+        events = []
+        matched_tracks = set()
+        matched_detections = set()
+
+        if self.tracks and len(detections):
+            track_boxes = np.stack([track.bbox for track in self.tracks])
+            overlaps = iou_matrix(track_boxes, detections['bbox'])
+
+            # Greedy assignment, best overlaps first
+            for flat_index in np.argsort(overlaps, axis=None)[::-1]:
+                track_index, detection_index = np.unravel_index(flat_index, overlaps.shape)
+                if overlaps[track_index, detection_index] < VIDEO_TRACK_IOU:
+                    break
+                if track_index in matched_tracks or detection_index in matched_detections:
+                    continue
+                matched_tracks.add(track_index)
+                matched_detections.add(detection_index)
+
+                detection = detections[detection_index]
+                self.tracks[track_index].observe(
+                    detection['bbox'], float(detection['confidence']), int(detection['status']), timestamp
+                )
+
+        remaining = []
+        for track_index, track in enumerate(self.tracks):
+            if track_index not in matched_tracks:
+                track.misses += 1
+                if track.misses > VIDEO_TRACK_MAX_MISSES:
+                    if track.confirmed:
+                        events.append(track.to_event('track_ended', self.source))
+                    continue
+            if not track.confirmed and track.hits >= VIDEO_TRACK_MIN_HITS:
+                track.confirmed = True
+                events.append(track.to_event('track_confirmed', self.source))
+            remaining.append(track)
+
+        for detection_index in range(len(detections)):
+            if detection_index in matched_detections:
+                continue
+            detection = detections[detection_index]
+            track = Track(self.next_track_id, detection['bbox'], timestamp)
+            track.observe(detection['bbox'], float(detection['confidence']), int(detection['status']), timestamp)
+            self.next_track_id += 1
+            if VIDEO_TRACK_MIN_HITS <= 1:
+                track.confirmed = True
+                events.append(track.to_event('track_confirmed', self.source))
+            remaining.append(track)
+
+        self.tracks = remaining
+        return events
+
+    def propagate(self, previous_gray: np.ndarray, gray: np.ndarray, timestamp: float) -> bool:
+        """
+        Move every track seen on the last keyframe by the median optical flow of feature points
+        inside its box. Returns False when a track could not be followed and detection should run again.
+        """
+        tracks = [track for track in self.tracks if track.misses == 0]
+        if not tracks:
+            return True
+
+        height, width = gray.shape
+        points = []
+        owners = []
+        for track_index, track in enumerate(tracks):
+            x, y, w, h = track.bbox
+            x1, y1 = int(max(x, 0)), int(max(y, 0))
+            x2, y2 = int(min(x + w, width)), int(min(y + h, height))
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                return False
+
+            corners = cv2.goodFeaturesToTrack(previous_gray[y1:y2, x1:x2], FLOW_POINTS_PER_TRACK, 0.01, 3)
+            if corners is None or len(corners) < FLOW_MIN_POINTS:
+                return False
+            points.append(corners.reshape(-1, 2) + (x1, y1))
+            owners.append(np.full(len(corners), track_index))
+
+        points = np.concatenate(points).astype(np.float32)
+        owners = np.concatenate(owners)
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(previous_gray, gray, points.reshape(-1, 1, 2), None)
+        # Track back to the previous frame and keep only points that return to where they started
+        returned, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, previous_gray, moved, None)
+        moved = moved.reshape(-1, 2)
+        error = np.linalg.norm(returned.reshape(-1, 2) - points, axis=1)
+        followed = (status.reshape(-1) == 1) & (back_status.reshape(-1) == 1) & (error < FLOW_MAX_ERROR)
+
+        for track_index, track in enumerate(tracks):
+            mask = followed & (owners == track_index)
+            if np.count_nonzero(mask) < FLOW_MIN_POINTS:
+                return False
+            track.bbox[:2] += np.median(moved[mask] - points[mask], axis=0)
+            track.last_seen = timestamp
+
+        return True
+
+    def finish(self) -> List[Dict]:
+        """
+        End all open tracks at the end of the video
+        """
+        events = [track.to_event('track_ended', self.source) for track in self.tracks if track.confirmed]
+        self.tracks = []
+        return events
+
+
+class VideoAnalyzer:
+    def __init__(self, detector: HelmetDetector):
+        """
+        Streams frames from a video file or stream URL, runs helmet detection only on
+        keyframes and emits per-track helmet compliance events
+        """
+        self.detector = detector
+        self.stats: Dict[str, int] = {}
+
+    def analyze(self, source: str, source_name: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Yield track events for a video file path or URL (MinIO presigned URL, RTSP, HTTP)
+        """
+        source_name = source_name or source
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video: {source_name}")
+
+        sampler = FrameSampler(capture, VIDEO_SAMPLE_FPS, VIDEO_MAX_SAMPLE_INTERVAL)
+        tracker = Tracker(source_name)
+        self.stats = {'frames_read': 0, 'frames_sampled': 0, 'keyframes': 0, 'tracks': 0}
+
+        previous_gray = None
+        reference_thumbnail = None
+        frames_since_keyframe = 0
+        redetect = True
+
+        try:
+            for frame_index, timestamp, frame in sampler:
+                self.stats['frames_sampled'] += 1
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                thumbnail = scene_thumbnail(gray)
+                scale = np.array(SCENE_THUMBNAIL_SIZE, dtype=np.float32) / gray.shape[::-1]
+
+                changed = reference_thumbnail is not None and scene_change(
+                    thumbnail, reference_thumbnail, [track.bbox for track in tracker.tracks], scale
+                ) >= VIDEO_SCENE_CHANGE_THRESHOLD
+
+                if not redetect and not changed and frames_since_keyframe < VIDEO_KEYFRAME_INTERVAL:
+                    redetect = not tracker.propagate(previous_gray, gray, timestamp)
+                    frames_since_keyframe += 1
+                else:
+                    # Frames decode as BGR; the model expects RGB like the image path
+                    model_input = self.detector.to_model_input(frame)
+                    try:
+                        detections = self.detector.detect_batch([model_input])[0]
+                    finally:
+                        release_buffer(model_input)
+                    self.stats['keyframes'] += 1
+                    for event in tracker.update(detections, timestamp):
+                        yield event
+
+                    reference_thumbnail = thumbnail
+                    frames_since_keyframe = 0
+                    redetect = False
+
+                # Sample sparsely while the scene is static and empty
+                if tracker.tracks or changed:
+                    sampler.reset()
+                else:
+                    sampler.relax()
+
+                previous_gray = gray
+
+            for event in tracker.finish():
+                yield event
+
+        finally:
+            capture.release()
+            self.stats['frames_read'] = sampler.frames_read
+            self.stats['tracks'] = tracker.next_track_id - 1
+            logger.info(f"Analyzed {source_name}: {self.stats}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Emit helmet compliance track events for video files or stream URLs as JSON lines")
+    parser.add_argument('sources', nargs='+', help="Video file paths or stream URLs")
+    args = parser.parse_args()
+
+    detector = HelmetDetector(
+        model_path=MODEL_PATH,
+        confidence_threshold=CONFIDENCE_THRESHOLD,
+        iou_threshold=IOU_THRESHOLD,
+        inference_backend=INFERENCE_BACKEND,
+        int8=INT8_QUANTIZATION
+    )
+    analyzer = VideoAnalyzer(detector)
+
+    for source in args.sources:
+        try:
+            for event in analyzer.analyze(source, os.path.basename(source) if os.path.exists(source) else source):
+                print(json.dumps(event), flush=True)
+        except Exception as e:
+            logger.error(f"Failed to analyze {source}: {e}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())